@@ -1,3 +1,85 @@
+import configparser
+import os
+import threading
+from collections import namedtuple
+
+ALGORITHMS = ('split-window', 'mono-window')
+
+# names of the source bands, None for the bands the sensor does not have
+Bands = namedtuple('Bands', ['lower_band', 'upper_band', 'lowest_band', 'visible_band', 'nir_band', 'mono_band'])
+
+# names of the angle bands, tie-point grids or metadata attributes, None if the sensor does not have them
+Angles = namedtuple('Angles', ['sat_za', 'sun_za', 'sat_az', 'sun_az', 'rel_az'])
+
+# the configuration of a sensor with parsed values, algorithms: the LSWT algorithms the sensor can be run with
+SensorConfig = namedtuple('SensorConfig', ['sensor', 'bands', 'angles', 'scale_factor_k', 'scale_factor_deg',
+                                           'scale_rf', 'algorithms'])
+
+# bands the algorithms read
+ALGORITHM_BANDS = {'split-window': ('lower_band', 'upper_band', 'lowest_band', 'visible_band', 'nir_band'),
+                   'mono-window': ('mono_band', 'visible_band', 'nir_band')}
+
+# the configurations are read once per sensor and shared by all operators of the process
+_sensor_configs = {}
+_sensor_configs_lock = threading.Lock()
+
+
+def load_sensor_config(sensor):
+    with _sensor_configs_lock:
+        if sensor not in _sensor_configs:
+            _sensor_configs[sensor] = read_sensor_config(sensor)
+        return _sensor_configs[sensor]
+
+
+def read_sensor_config(sensor):
+    # a <sensor>.ini in the working or the home directory overrides the built-in configuration
+    parser = configparser.ConfigParser()
+    cwd = os.getcwd()
+    parser.read([sensor + '.ini', os.path.join(cwd, sensor + '.ini'), os.path.expanduser('~/' + sensor + '.ini')])
+    if len(parser.sections()) == 0:
+        return parse_sensor_config(sensor, Config(sensor).get_conf())
+    return parse_sensor_config(sensor, parser)
+
+
+def parse_sensor_config(sensor, sections):
+    # sections: a ConfigParser or the dict of Config
+    def get(section, name):
+        if section not in sections:
+            raise ConfigException('the configuration of ' + str(sensor) + ' has no section ' + section)
+        value = sections[section].get(name)
+        if value is None:
+            return None
+        # the ini files quote some values
+        value = value.strip().strip('\'"')
+        return value if value != '' else None
+
+    def get_float(name):
+        value = get('scale_factors', name)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ConfigException('the scale factor ' + name + ' of ' + str(sensor) + ' is not a number: ' + str(value))
+
+    algorithm = get('algorithms', 'lswt-algorithm')
+    algorithms = ALGORITHMS if algorithm == 'both' else (algorithm,)
+    if algorithm is None or any(name not in ALGORITHMS for name in algorithms):
+        raise ConfigException('unknown lswt-algorithm of ' + str(sensor) + ': ' + str(algorithm))
+    config = SensorConfig(sensor, Bands(*[get('bands', name) for name in Bands._fields]),
+                          Angles(*[get('angles', name) for name in Angles._fields]), get_float('scale_factor_K'),
+                          get_float('scale_factor_deg'), get_float('scale_rf'), algorithms)
+    if config.angles.sat_za is None or config.angles.sun_za is None:
+        raise ConfigException('the configuration of ' + str(sensor) + ' has no zenith angles')
+    return config
+
+
+def check_sensor_config(config, algorithm):
+    # the bands the algorithm reads have to be configured
+    missing = [name for name in ALGORITHM_BANDS[algorithm] if getattr(config.bands, name) is None]
+    if len(missing) > 0:
+        raise ConfigException('the configuration of ' + config.sensor + ' has no ' + ', '.join(missing) + ' for the ' +
+                              algorithm + ' algorithm')
+
+
 class Config:
     def __init__(self, sensor):
         if sensor == 'AVHRR':
@@ -48,3 +130,11 @@ class Config:
 
     def get_conf(self):
         return self.config
+
+
+class ConfigException(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
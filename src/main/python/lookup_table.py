@@ -1,26 +1,130 @@
+import os
+import struct
+
 import numpy
 
+# interpolation modes: take the value of the lower corner of the enclosing cell or interpolate between all corners
+NEAREST = 'nearest'
+LINEAR = 'linear'
+
+# the coordinate tuples of a tile are deduplicated by a single int64 key while the product of the distinct values per
+# coordinate stays below this, otherwise by the rows of the stacked coordinates
+KEY_COMBINATIONS = 1 << 62
+
+# binary LUT file: magic, header (version, number of dimensions, length, offset of the values), the node count and
+# stride of each dimension, the nodes as float64 and finally the values as float32, everything little endian
+LUT_MAGIC = b'MSLUT\x00\x00\x00'
+LUT_VERSION = 1
+LUT_HEADER = struct.Struct('<4I')
+LUT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# nodes of the coefficient LUTs of both algorithms (split_window.lut, mono_window.lut): season (spring, summer,
+# autumn, winter), height in meter, satellite zenith angle 5 - 55deg in 5deg steps
+COEFFICIENT_DIMENSIONS = (numpy.array(range(0, 4), dtype=numpy.float64),
+                          numpy.array([400, 800, 1000], dtype=numpy.float64),
+                          numpy.array(range(5, 56, 5), dtype=numpy.float64))
+
+
+def lut_path(name):
+    return os.path.join(LUT_DIRECTORY, name)
+
 
 class LookupTable:
-    def __init__(self, values, dimensions, length=1):
+    # many tables can be alive in a batch worker, slots keep the instances small
+    __slots__ = ('interpolation', 'values', 'dimensions', 'length', 'strides', 'offset', 'grids', 'corners',
+                 'deduplicate', 'resolution', 'dtype')
+
+    def __init__(self, values, dimensions, length=1, interpolation=NEAREST):
         # return LookupTable(values, dimensions)
-        self.values = values  # numpy array of all values in the LUT
+        if interpolation != NEAREST and interpolation != LINEAR:
+            raise ValueError("unknown interpolation '" + str(interpolation) + "'")
+        self.interpolation = interpolation
+        # numpy array of all values in the LUT, lookups are done in float32, memory mapped values are not copied
+        self.values = numpy.asanyarray(values, dtype=numpy.float32)
         self.dimensions = dimensions  # array of numpy arrays of the different dimensions
         n = len(dimensions)
         self.length = length
 
-        self.strides = numpy.ones(n)
+        self.strides = numpy.ones(n, dtype=numpy.int64)
         stride = length
         for i in range(n, 0, -1):
             self.strides[i - 1] = stride
             stride *= len(dimensions[i - 1])
 
-        self.offset = numpy.zeros(1 << n)
+        self.offset = numpy.zeros(1 << n, dtype=numpy.int64)
         for i in range(0, len(self.strides)):
             k = 1 << i
             for j in range(0, k):
                 self.offset[k + j] = self.offset[j] + self.strides[i]
 
+        # (origin, step) of dimensions with equidistant nodes, their indexes are computed instead of searched
+        self.grids = [self.detectGrid(dimension) for dimension in dimensions]
+
+        # cell corners getValue reads, NEAREST only needs the lower corner
+        self.corners = 1 if interpolation == NEAREST else 1 << n
+
+        self.deduplicate = False
+        self.resolution = None
+        # floating point type of the arrays returned by getValues
+        self.dtype = numpy.dtype(numpy.float64)
+
+    def setDeduplication(self, enabled, resolution=None):
+        # with deduplication getValues evaluates every distinct coordinate tuple only once, coordinates are rounded to
+        # multiples of resolution (one value or one per dimension) first if it is given
+        self.deduplicate = enabled
+        self.resolution = resolution
+
+    def setDataType(self, dtype):
+        # getValues returns float64 by default, with float32 the values are interpolated in float32 as well
+        self.dtype = numpy.dtype(dtype)
+
+    def write(self, filename):
+        n = len(self.dimensions)
+        counts = [len(dimension) for dimension in self.dimensions]
+        nodes = numpy.concatenate([numpy.zeros(0, dtype='<f8')] +
+                                  [numpy.asarray(dimension, dtype='<f8') for dimension in self.dimensions])
+        header_size = len(LUT_MAGIC) + LUT_HEADER.size + 12 * n + nodes.nbytes
+        # the values start 16 byte aligned
+        data_offset = (header_size + 15) // 16 * 16
+        with open(filename, 'wb') as f:
+            f.write(LUT_MAGIC)
+            f.write(LUT_HEADER.pack(LUT_VERSION, n, self.length, data_offset))
+            f.write(struct.pack('<' + str(n) + 'I', *counts))
+            f.write(struct.pack('<' + str(n) + 'Q', *[int(stride) for stride in self.strides]))
+            f.write(nodes.tobytes())
+            f.write(b'\x00' * (data_offset - header_size))
+            f.write(self.values.astype('<f4', copy=False).tobytes())
+
+    @staticmethod
+    def read(filename, interpolation=NEAREST):
+        # the values are memory mapped read-only, processes using the same file share its pages
+        with open(filename, 'rb') as f:
+            if f.read(len(LUT_MAGIC)) != LUT_MAGIC:
+                raise ValueError(filename + " is not a LUT file")
+            version, n, length, data_offset = LUT_HEADER.unpack(f.read(LUT_HEADER.size))
+            if version != LUT_VERSION:
+                raise ValueError("LUT file version " + str(version) + " is not supported")
+            counts = struct.unpack('<' + str(n) + 'I', f.read(4 * n))
+            strides = struct.unpack('<' + str(n) + 'Q', f.read(8 * n))
+            dimensions = []
+            for count in counts:
+                dimensions.append(numpy.frombuffer(f.read(8 * count), dtype='<f8').astype(numpy.float64))
+        size = length * int(numpy.prod(counts))
+        values = numpy.memmap(filename, dtype='<f4', mode='r', offset=data_offset, shape=(size,))
+        lut = LookupTable(values, dimensions, length, interpolation)
+        if tuple(int(stride) for stride in lut.strides) != strides:
+            raise ValueError("strides of LUT file " + filename + " do not match its dimensions")
+        return lut
+
+    @staticmethod
+    def detectGrid(partition):
+        if len(partition) < 2:
+            return None
+        steps = numpy.diff(numpy.asarray(partition, dtype=numpy.float64))
+        if steps[0] <= 0 or not numpy.allclose(steps, steps[0], rtol=1e-9, atol=0):
+            return None
+        return float(partition[0]), float(steps[0])
+
     def getValue(self, coordinates):
         if coordinates is None:
             raise ValueError("array == null")
@@ -29,46 +133,43 @@ class LookupTable:
             raise ValueError(
                 "array.length = " + str(len(coordinates)) + " does not correspond to the expected length " + str(
                     len(self.dimensions)))
-        # TODO fracIndexes are deleted because of performance (4x better performance), not needed at the moment
+        # the scratch arrays are allocated per call, the table is shared by the threads that compute tiles
         fracIndexes = numpy.zeros((len(self.dimensions), 2))
-        for i in range(0, len(self.dimensions)):
-           fracIndexes[i, :] = self.computeFracIndex(self.dimensions[i], coordinates[i])
-
         origin = 0
         for i in range(0, len(self.dimensions)):
-           origin += fracIndexes[i, 0] * self.strides[i]
-        if self.length == 1:
-            v = numpy.zeros(1 << len(coordinates), dtype=numpy.float32)
-        else:
-            v = numpy.zeros((1 << len(coordinates), self.length), dtype=numpy.float32)
+            self.computeFracIndex(self.dimensions[i], coordinates[i], self.grids[i], fracIndexes[i])
+            origin += int(fracIndexes[i, 0]) * self.strides[i]
+        v = numpy.zeros(self.corners if self.length == 1 else (self.corners, self.length))
         for i in range(0, len(v)):
             if self.length == 1:
-                v[i] = self.values[int(origin + self.offset[i])]
+                v[i] = self.values[origin + self.offset[i]]
             else:
-                numpy.copyto(v[i], self.values[int(origin + self.offset[i]):int(origin + self.offset[i] + self.length)])
-        # for i in range(len(self.dimensions) - 1, -1, -1):
-        #    m = 1 << i
-        #    f = fracIndexes[i, 1]
-        #    for j in range(0, m):
-        #        if self.length == 1:
-        #            v[j] += f * (v[m + j] - v[j])
-        #        else:
-        #            for k in range(0, len(v[j])):
-        #                v[j][k] += f * (v[m + j][k] - v[j][k])
+                v[i] = self.values[origin + self.offset[i]:origin + self.offset[i] + self.length]
+        if self.interpolation == LINEAR:
+            for i in range(len(self.dimensions) - 1, -1, -1):
+                m = 1 << i
+                f = fracIndexes[i, 1]
+                for j in range(0, m):
+                    v[j] += f * (v[m + j] - v[j])
 
         return v[0]
 
-    def computeFracIndex(self, partition, coordinate):
-        fracIndex = numpy.zeros(2)
-        lo = 0
-        hi = len(partition) - 1
-        while hi > lo + 1:
-            m = (lo + hi) >> 1
+    def computeFracIndex(self, partition, coordinate, grid=None, fracIndex=None):
+        if fracIndex is None:
+            fracIndex = numpy.zeros(2)
+        if grid is not None:
+            lo = self.computeGridIndex(partition, coordinate, grid)
+            hi = lo + 1
+        else:
+            lo = 0
+            hi = len(partition) - 1
+            while hi > lo + 1:
+                m = (lo + hi) >> 1
 
-            if coordinate < partition[m]:
-                hi = m
-            else:
-                lo = m
+                if coordinate < partition[m]:
+                    hi = m
+                else:
+                    lo = m
         fracIndex[0] = lo
         fracIndex[1] = (coordinate - partition[lo]) / (partition[hi] - partition[lo])
         if fracIndex[1] < 0.0:
@@ -77,32 +178,158 @@ class LookupTable:
             fracIndex[1] = 1.0
         return fracIndex
 
-    def getValues(self, coordinates):
+    @staticmethod
+    def computeGridIndex(partition, coordinate, grid):
+        # same lower node as the binary search, a NaN coordinate ends up in the last cell like there
+        last = len(partition) - 2
+        position = (coordinate - grid[0]) / grid[1]
+        if numpy.isnan(position):
+            return last
+        lo = int(min(max(numpy.floor(position), 0), last))
+        # correct rounding errors of the division for coordinates lying on a node
+        if lo > 0 and coordinate < partition[lo]:
+            lo -= 1
+        elif lo < last and coordinate >= partition[lo + 1]:
+            lo += 1
+        return lo
+
+    @staticmethod
+    def computeGridIndexes(partition, coordinates, grid):
+        last = len(partition) - 2
+        position = (coordinates - grid[0]) / grid[1]
+        position = numpy.where(numpy.isnan(position), last, position)
+        indexes = numpy.clip(numpy.floor(position), 0, last).astype(numpy.int64)
+        indexes -= numpy.logical_and(indexes > 0, coordinates < partition[indexes])
+        indexes += numpy.logical_and(indexes < last, coordinates >= partition[numpy.minimum(indexes + 1, last + 1)])
+        return indexes
+
+    def computeFracIndexes(self, partition, coordinates, grid=None):
+        # vectorized counterpart of computeFracIndex, returns the lower node indexes and the fractions
+        coordinates = numpy.asarray(coordinates, dtype=numpy.float64)
+        last = max(len(partition) - 2, 0)
+        if grid is not None:
+            indexes = self.computeGridIndexes(partition, coordinates, grid)
+        else:
+            indexes = numpy.asarray(numpy.searchsorted(partition, coordinates, side='right') - 1)
+            numpy.clip(indexes, 0, last, out=indexes)
+        lower = partition[indexes]
+        upper = partition[numpy.minimum(indexes + 1, len(partition) - 1)]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            # an array for scalar coordinates as well, it is clipped in place
+            fractions = numpy.asarray((coordinates - lower) / (upper - lower))
+        numpy.clip(fractions, 0.0, 1.0, out=fractions)
+        return indexes, fractions
+
+    def getSubTable(self, coordinates):
+        # reduces the table to the dimensions whose coordinate is None, the other dimensions are fixed to the given
+        # coordinate the same way as getValue would evaluate them
+        if len(coordinates) != len(self.dimensions):
+            raise ValueError(
+                "array.length = " + str(len(coordinates)) + " does not correspond to the expected length " + str(
+                    len(self.dimensions)))
+        shape = tuple(len(dimension) for dimension in self.dimensions) + (self.length,)
+        values = self.values.reshape(shape)
+        dimensions = []
+        for i in range(len(self.dimensions) - 1, -1, -1):
+            if coordinates[i] is None:
+                dimensions.insert(0, self.dimensions[i])
+                continue
+            lo, f = self.computeFracIndex(self.dimensions[i], coordinates[i], self.grids[i])
+            lo = int(lo)
+            if self.interpolation == NEAREST:
+                values = values.take(lo, axis=i)
+            else:
+                lower = values.take(lo, axis=i).astype(numpy.float64)
+                values = lower + f * (values.take(lo + 1, axis=i) - lower)
+        sub_table = LookupTable(values.ravel(), dimensions, self.length, self.interpolation)
+        sub_table.setDeduplication(self.deduplicate, self.resolution)
+        sub_table.setDataType(self.dtype)
+        return sub_table
+
+    def getValues(self, coordinates, hitRatios=None):
+        # hitRatios: a list of the caller, with deduplication the share of the coordinates that were served by an
+        # already evaluated coordinate is appended to it
         if coordinates is None:
             raise ValueError("array == null")
         if len(coordinates) != len(self.dimensions):
             raise ValueError(
                 "array.length = " + str(len(coordinates)) + " does not correspond to the expected length " + str(
                     len(self.dimensions)))
-        n = len(coordinates)
-        shape_coordinates = coordinates[0].shape
-        for i in range(1, n):
-            if shape_coordinates != coordinates[i].shape:
-                raise ValueError("coordinate arrays are not same size")
+        # scene constants can be given as scalars, they are broadcast to the other coordinates without a copy
+        try:
+            shape_coordinates = numpy.broadcast(*coordinates).shape
+        except ValueError:
+            raise ValueError("coordinate arrays are not same size")
+        if self.deduplicate:
+            values, hitRatio = self.evaluateUniqueValues(coordinates, shape_coordinates)
+            if hitRatios is not None:
+                hitRatios.append(hitRatio)
+            return values
+        return self.evaluateValues(coordinates, shape_coordinates)
 
+    def evaluateUniqueValues(self, coordinates, shape_coordinates):
+        # within a tile most coordinate tuples repeat (one season, few heights, slowly changing zenith), so each
+        # distinct tuple is evaluated once and the results are scattered back to all pixels. Returns the values and
+        # the share of the coordinates that were served by an already evaluated tuple
+        size = int(numpy.prod(shape_coordinates))
+        resolutions = [None] * len(coordinates)
+        if self.resolution is not None:
+            resolutions = numpy.broadcast_to(self.resolution, (len(coordinates),))
+        quantized = []
+        key = numpy.zeros(size, dtype=numpy.int64)
+        combinations = 1
+        for i in range(0, len(coordinates)):
+            coordinate = numpy.asarray(coordinates[i], dtype=numpy.float64)
+            if resolutions[i]:
+                coordinate = numpy.round(coordinate / resolutions[i]) * resolutions[i]
+            if coordinate.ndim == 0:
+                # a scalar is a single node, it is not part of the key
+                quantized.append(coordinate)
+                continue
+            coordinate = numpy.broadcast_to(coordinate, shape_coordinates).ravel()
+            quantized.append(coordinate)
+            nodes, codes = numpy.unique(coordinate, return_inverse=True)
+            combinations *= max(len(nodes), 1)
+            if combinations < KEY_COMBINATIONS:
+                key = key * len(nodes) + codes.ravel()
+        if combinations < KEY_COMBINATIONS:
+            keys, first, inverse = numpy.unique(key, return_index=True, return_inverse=True)
+        else:
+            # the scalars are the same for every pixel, the rows only hold the other coordinates
+            rows = numpy.stack([coordinate for coordinate in quantized if coordinate.ndim > 0], axis=1)
+            keys, first, inverse = numpy.unique(rows, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        hitRatio = 1.0 - len(keys) / float(size) if size > 0 else 0.0
+
+        values = self.evaluateValues([coordinate if coordinate.ndim == 0 else coordinate[first]
+                                      for coordinate in quantized], (len(first),))
         if self.length != 1:
-            shape_coordinates = (self.length,) + shape_coordinates
-        result = numpy.zeros(shape_coordinates)
-        it = numpy.nditer(coordinates[0], flags=['multi_index'])
-        while not it.finished:
-            coord = [coordinates[0][it.multi_index]]
-            for i in range(1, n):
-                coord.append(coordinates[i][it.multi_index])
-            values = self.getValue(coord)
-            if self.length != 1:
-                for i in range(0, len(values)):
-                    result[i][it.multi_index] = values[i]
-            else:
-                result[it.multi_index] = values
-            it.iternext()
+            return values[:, inverse].reshape((self.length,) + tuple(shape_coordinates)), hitRatio
+        return values[inverse].reshape(shape_coordinates), hitRatio
+
+    def evaluateValues(self, coordinates, shape_coordinates):
+        n = len(coordinates)
+        # all coordinates are evaluated at once, the lower corner of the enclosing cell is the origin like in getValue
+        origin = numpy.zeros(shape_coordinates, dtype=numpy.int64)
+        fractions = []
+        for i in range(0, n):
+            indexes, fraction = self.computeFracIndexes(self.dimensions[i], coordinates[i], self.grids[i])
+            origin += indexes * self.strides[i]
+            fractions.append(fraction)
+        values = self.values
+        if self.length != 1:
+            origin = origin + numpy.arange(self.length).reshape((self.length,) + (1,) * len(shape_coordinates))
+        if self.interpolation == NEAREST:
+            return values.take(origin).astype(self.dtype, copy=False)
+
+        # multilinear interpolation: sum of all corners of the cell weighted by the fractions
+        result = numpy.zeros(origin.shape, dtype=self.dtype)
+        for corner in range(0, 1 << n):
+            weight = numpy.ones(shape_coordinates, dtype=self.dtype)
+            for i in range(0, n):
+                if corner & (1 << i):
+                    weight *= fractions[i]
+                else:
+                    weight *= 1.0 - fractions[i]
+            result += weight * values.take(origin + int(self.offset[corner]))
         return result
@@ -1,66 +1,154 @@
+import math
+
 import numpy
 
+import lookup_table
 from lookup_table import LookupTable
 from lswt_quality_check import QualityCheck
 from lswt_quality_check_mono import QualityCheckMono
 from utils import Utils
-from mono import Mono
 from snappy import jpy
 
 Float = jpy.get_type('java.lang.Float')
 
+try:
+    # optional, evaluates the split-window formula in a single multithreaded pass
+    import numexpr
+except ImportError:
+    numexpr = None
+
+SPLIT_WINDOW_EXPRESSION = 'a0 + a1 * lower + a2 * (lower - upper) + ' \
+                          'a3 * (1 - 1 / cos(zenith * deg_to_rad)) * (lower - upper)'
+
+# the same formula with the zenith term a3 * (1 - 1 / cos(zenith)) of a scene-constant zenith angle computed before
+SPLIT_WINDOW_CONSTANT_ZENITH_EXPRESSION = 'a0 + a1 * lower + a2 * (lower - upper) + zenith_term * (lower - upper)'
+
+
+def select(values, pixels):
+    # the pixels of a tile array, a scalar (e.g. a scene-constant angle) applies to all pixels and is kept
+    if numpy.ndim(values) == 0:
+        return values
+    return values[pixels]
+
+
+def broadcast_scenes(values, shape):
+    # one value per scene (or one for all) broadcast to the stacked scenes (n_scenes, height, width) without a copy
+    values = numpy.asarray(values)
+    if values.ndim == 1:
+        values = values.reshape((len(values),) + (1,) * (len(shape) - 1))
+    return numpy.broadcast_to(values, shape)
+
 
 class SplitWindowAlgo:
-    def __init__(self, a0, a1, a2, a3, needs_lut):
+    def __init__(self, a0, a1, a2, a3, needs_lut, interpolation=lookup_table.NEAREST, use_numexpr=True,
+                 dtype=numpy.float64):
+        self.use_numexpr = use_numexpr and numexpr is not None
+        # floating point type of the lswt and of all intermediate arrays
+        self.dtype = numpy.dtype(dtype)
         if needs_lut:
             self.has_lut = True
-            season = numpy.array(range(0, 4), dtype=numpy.float64)  # spring, summer, autumn, winter
-            height = numpy.array([400, 800, 1000])  # height in meter
-            zenith = numpy.array(range(5, 56, 5), dtype=numpy.float64)  # 5 - 55deg in 5deg steps
-            dimensions = [season, height, zenith]
-            #  TODO needs to be loaded from file!
-            values = numpy.tile([3.079654, 0.988938, 1.867209, -0.434251],
-                                len(season) * len(zenith) * len(height))
-            self.lut = LookupTable(values, dimensions, 4)
+            # dimensions: lookup_table.COEFFICIENT_DIMENSIONS
+            self.lut = LookupTable.read(lookup_table.lut_path('split_window.lut'), interpolation)
+            self.lut.setDataType(self.dtype)
         else:
             self.has_lut = False
             self.a0 = a0
             self.a1 = a1
             self.a2 = a2
             self.a3 = a3
+        self.lut_curve = None
         self.check = None
+        # the quality check skips its expensive tests for pixels that are already rejected
+        self.early_out = False
+        # names of the quality tests that do not run, and the run time of the others (quality_tests.QualityTestTimings)
+        self.disabled_tests = ()
+        self.timings = None
 
     def get_season(self, start_date):
         utils = Utils()
         return utils.get_season(start_date)
 
-    def compute_lswt_lut(self, lower_data, upper_data, zenith_data, season, height):
-        lswt = numpy.zeros(numpy.shape(lower_data))
-        lswt[numpy.where(numpy.logical_or(numpy.isnan(lower_data), numpy.isnan(upper_data)))] = Float.NaN
-
-        season = season[numpy.where(numpy.logical_and(~numpy.isnan(lower_data), ~numpy.isnan(upper_data)))]
-        zenith_data = zenith_data[numpy.where(numpy.logical_and(~numpy.isnan(lower_data), ~numpy.isnan(upper_data)))]
-        height = height[numpy.where(numpy.logical_and(~numpy.isnan(lower_data), ~numpy.isnan(upper_data)))]
-
-        size = numpy.shape(season)
-        if size != (0,):
-            [self.a0, self.a1, self.a2, self.a3] = self.lut.getValues([season, height, zenith_data])
-            lswt[
-                numpy.where(numpy.logical_and(~numpy.isnan(lower_data), ~numpy.isnan(upper_data)))] = self.compute_lswt(
-                lower_data[numpy.where(numpy.logical_and(~numpy.isnan(lower_data), ~numpy.isnan(upper_data)))],
-                upper_data[numpy.where(numpy.logical_and(~numpy.isnan(lower_data), ~numpy.isnan(upper_data)))],
-                zenith_data)
-        return lswt
-
-    def compute_lswt(self, lower_data, upper_data, zenith_data):
-        lswt = self.a0 + self.a1 * lower_data + self.a2 * (lower_data - upper_data) + \
-               self.a3 * (1 - 1 / (numpy.cos(zenith_data * (numpy.math.pi / 180.0)))) * (lower_data - upper_data)
-        return lswt
+    def collapse_lut(self, season, height):
+        # season and height are constant for the scene, the LUT is reduced once to coefficients over zenith angle
+        self.lut_curve = self.lut.getSubTable([season, height, None])
+
+    def compute_lswt_lut(self, lower_data, upper_data, zenith_data, season, height, out=None, hit_ratios=None):
+        # the formula is evaluated on all pixels directly into out, the invalid pixels are set to NaN afterwards. This
+        # avoids gathering the valid pixels into temporaries and scattering the result back.
+        # hit_ratios: a list the deduplication hit ratio of the LUT lookup is appended to, see LookupTable.getValues
+        valid = ~numpy.logical_or(numpy.isnan(lower_data), numpy.isnan(upper_data))
+        if out is None:
+            out = numpy.empty(numpy.shape(lower_data), dtype=self.dtype)
+        if not valid.any():
+            out.fill(Float.NaN)
+            return out
+        # scalar coordinates give scalar coefficients, they are looked up once for the tile
+        if season is None:
+            coefficients = self.lut_curve.getValues([zenith_data], hit_ratios)
+        else:
+            coefficients = self.lut.getValues([season, height, zenith_data], hit_ratios)
+        self.compute_lswt(lower_data, upper_data, zenith_data, out=out, coefficients=coefficients)
+        out[~valid] = Float.NaN
+        return out
+
+    def compute_lswt_batch(self, lower_data, upper_data, zenith_data, season=None, height=None, out=None):
+        # stacked scenes (n_scenes, height, width) are computed in one call, season and height are given per scene
+        # (one value or one per scene), without them the collapsed LUT is used
+        if not self.has_lut:
+            return self.compute_lswt(lower_data, upper_data, zenith_data, out=out)
+        shape = numpy.shape(lower_data)
+        if season is not None:
+            season = broadcast_scenes(season, shape)
+            height = broadcast_scenes(height, shape)
+        return self.compute_lswt_lut(lower_data, upper_data, numpy.broadcast_to(zenith_data, shape), season, height,
+                                     out=out)
+
+    def compute_lswt(self, lower_data, upper_data, zenith_data, out=None, coefficients=None):
+        # lswt = a0 + a1 * T11 + a2 * (T11 - T12) + a3 * (1 - 1 / cos(zenith)) * (T11 - T12)
+        if coefficients is None:
+            coefficients = (self.a0, self.a1, self.a2, self.a3)
+        a0, a1, a2, a3 = coefficients
+        dtype = numpy.result_type(lower_data, upper_data, zenith_data, a0, a1, a2, a3)
+        # the zenith term has the shape of the zenith angle and a3, for a scene constant it is computed once
+        zenith_shape = numpy.broadcast(zenith_data, a3).shape
+        if self.use_numexpr:
+            # numexpr treats python scalars as double, cast them so the result has the same precision as numpy's
+            local_dict = {'lower': lower_data, 'upper': upper_data, 'zenith': zenith_data,
+                          'deg_to_rad': numpy.asarray(math.pi / 180.0, dtype)}
+            for name, coefficient in zip(('a0', 'a1', 'a2', 'a3'), coefficients):
+                local_dict[name] = numpy.asarray(coefficient, dtype)
+            if zenith_shape != ():
+                return numexpr.evaluate(SPLIT_WINDOW_EXPRESSION, out=out, casting='same_kind', local_dict=local_dict)
+        zenith_term = numpy.empty(zenith_shape, dtype)
+        numpy.multiply(zenith_data, math.pi / 180.0, out=zenith_term)
+        numpy.cos(zenith_term, out=zenith_term)
+        numpy.divide(1, zenith_term, out=zenith_term)
+        numpy.subtract(1, zenith_term, out=zenith_term)
+        numpy.multiply(a3, zenith_term, out=zenith_term)
+        if self.use_numexpr:
+            local_dict['zenith_term'] = zenith_term
+            return numexpr.evaluate(SPLIT_WINDOW_CONSTANT_ZENITH_EXPRESSION, out=out, casting='same_kind',
+                                    local_dict=local_dict)
+        # same order of operations as the formula above, but only two temporaries besides the output
+        shape = numpy.broadcast(lower_data, upper_data, zenith_term, a0, a1, a2).shape
+        if out is None:
+            out = numpy.empty(shape, dtype)
+        diff = numpy.empty(shape, dtype)
+        numpy.subtract(lower_data, upper_data, out=diff)
+        zenith_term = numpy.multiply(zenith_term, diff, out=zenith_term if zenith_term.shape == shape else None)
+        numpy.multiply(a1, lower_data, out=out)
+        numpy.add(a0, out, out=out)
+        numpy.multiply(a2, diff, out=diff)
+        numpy.add(out, diff, out=out)
+        numpy.add(out, zenith_term, out=out)
+        return out
 
     def compute_flags(self, lswt, visible, nir, bt3, lower_bt, upper_bt, sat_za, sun_za, rel_az, lwm,
-                      cmsk, height, width, sattype):
+                      cmsk, height, width, sattype, index=None):
+        # index: flat indices of the tile pixels the inputs are given for, None for the whole height x width tile
         self.check = QualityCheck(lswt, visible, nir, bt3, lower_bt, upper_bt, sat_za, sun_za, rel_az, lwm,
-                                  cmsk, height, width, sattype)
+                                  cmsk, height, width, sattype, self.dtype, self.early_out, self.disabled_tests,
+                                  self.timings, index)
         return self.check.check_quality()
 
     def compute_quality_index(self, flags):
@@ -68,62 +156,136 @@ class SplitWindowAlgo:
 
 
 class MonoWindowAlgo:
-    def __init__(self, a0, a1, needs_lut):
+    def __init__(self, a0, a1, needs_lut, interpolation=lookup_table.NEAREST, grid_step=(1, 1),
+                 dtype=numpy.float64):
         self.needs_lut = needs_lut
+        self.lut_curve = None
+        self.early_out = False
+        self.disabled_tests = ()
+        self.timings = None
+        # floating point type of the lswt and of all intermediate arrays
+        self.dtype = numpy.dtype(dtype)
+        # pixel distance (y, x) of the grid the coefficients are evaluated on, (1, 1) evaluates them per pixel
+        self.grid_step = grid_step
+        # height and width of the scene, the grid nodes are multiples of the step and the last row and column
+        self.scene_size = None
         if not needs_lut:
             self.a0 = a0
             self.a1 = a1
         else:
-            season = numpy.array(range(0, 4), dtype=numpy.float64)  # spring, summer, autumn, winter
-            height = numpy.array([400, 800, 1000])  # height in meter
-            zenith = numpy.array(range(5, 56, 5), dtype=numpy.float64)  # 5 - 55deg in 5deg steps
-            dimensions = [season, height, zenith]
-            mono_coeff = Mono()
-            values = numpy.array(mono_coeff.values, dtype=numpy.float64)
-            self.lut = LookupTable(values, dimensions, 2)
+            # dimensions: lookup_table.COEFFICIENT_DIMENSIONS
+            self.lut = LookupTable.read(lookup_table.lut_path('mono_window.lut'), interpolation)
+            self.lut.setDataType(self.dtype)
             self.check = None
 
     def get_season(self, start_date):
         utils = Utils()
         return utils.get_season(start_date)
 
-    def compute_lswt(self, data, season, height, zenith_data):
+    def collapse_lut(self, season, height):
+        # season and height are constant for the scene, the LUT is reduced once to coefficients over zenith angle
+        self.lut_curve = self.lut.getSubTable([season, height, None])
+
+    def compute_lswt(self, data, season, height, zenith_data, rectangle=None, hit_ratios=None):
+        # hit_ratios: see SplitWindowAlgo.compute_lswt_lut
         if not self.needs_lut:
             return self.a0 * data + self.a1
+        elif rectangle is not None and self.grid_step != (1, 1):
+            # rectangle: (x, y, width, height) of the tile in the scene, season, height and zenith_data are given on
+            # get_grid_rectangle(rectangle) or as scalars
+            a0, a1 = self.compute_coefficient_field(season, height, zenith_data, rectangle, hit_ratios)
+            return a0.reshape(numpy.shape(data)) * data + a1.reshape(numpy.shape(data))
         else:
-            lswt = numpy.zeros(numpy.shape(data))
+            lswt = numpy.zeros(numpy.shape(data), dtype=self.dtype)
             lswt[numpy.where(numpy.isnan(data))] = Float.NaN
 
-            season = season[numpy.where(~numpy.isnan(data))]
-            height = height[numpy.where(~numpy.isnan(data))]
-            zenith_data = zenith_data[numpy.where(~numpy.isnan(data))]
-
-            size = numpy.shape(season)
-            if size != (0,):
-                if len(size) == 2:
-                    (shape_x, shape_y) = size
-                    result = self.lut.getValues([season[::2, ::2], height[::2, ::2], zenith_data[::2, ::2]])
-                    [a0, a1] = result
-                    a0 = numpy.repeat(numpy.repeat(a0, 2, axis=0), 2, axis=1)
-                    a1 = numpy.repeat(numpy.repeat(a1, 2, axis=0), 2, axis=1)
-                    a0 = a0[:shape_x, :shape_y]
-                    a1 = a1[:shape_x, :shape_y]
-                elif len(size) == 1:
-                    (shape_x,) = size
-                    result = self.lut.getValues([season[::2], height[::2], zenith_data[::2]])
-                    [a0, a1] = result
-                    a0 = numpy.repeat(a0, 2)
-                    a1 = numpy.repeat(a1, 2)
-                    a0 = a0[:shape_x]
-                    a1 = a1[:shape_x]
+            # scalar coordinates are scene constants, their coefficients are looked up once
+            zenith_data = select(zenith_data, numpy.where(~numpy.isnan(data)))
+
+            if not numpy.isnan(data).all():
+                if season is None:
+                    [a0, a1] = self.lut_curve.getValues([zenith_data], hit_ratios)
+                else:
+                    season = select(season, numpy.where(~numpy.isnan(data)))
+                    height = select(height, numpy.where(~numpy.isnan(data)))
+                    [a0, a1] = self.lut.getValues([season, height, zenith_data], hit_ratios)
 
                 lswt[numpy.where(~numpy.isnan(data))] = a0 * data[numpy.where(~numpy.isnan(data))] + a1
             return lswt
 
+    def compute_lswt_batch(self, data, zenith_data, season=None, height=None):
+        # stacked scenes (n_scenes, height, width) in one call, see SplitWindowAlgo.compute_lswt_batch
+        if not self.needs_lut:
+            return self.compute_lswt(data, None, None, None)
+        shape = numpy.shape(data)
+        if season is not None:
+            season = broadcast_scenes(season, shape)
+            height = broadcast_scenes(height, shape)
+        return self.compute_lswt(data, season, height, numpy.broadcast_to(zenith_data, shape))
+
+    def compute_coefficient_field(self, season, height, zenith_data, rectangle, hit_ratios=None):
+        # the LUT is evaluated on a coarse grid only and the coefficients are interpolated bilinearly to the tile. The
+        # grid is the same for the whole scene, so the coefficients do not depend on the tiling
+        x, y, tile_width, tile_height = rectangle
+        rows, cols = self.get_tile_nodes(rectangle)
+
+        def sample(values):
+            values = numpy.asarray(values)
+            if values.size == 1:
+                return numpy.full((len(rows), len(cols)), values.item())
+            values = values.reshape((rows[-1] - rows[0] + 1, cols[-1] - cols[0] + 1))
+            return values[numpy.ix_(rows - rows[0], cols - cols[0])]
+
+        if season is None:
+            coefficients = self.lut_curve.getValues([sample(zenith_data)], hit_ratios)
+        else:
+            coefficients = self.lut.getValues([sample(season), sample(height), sample(zenith_data)], hit_ratios)
+        coefficients = self.upsample(coefficients, rows, tile_height, axis=1)
+        coefficients = self.upsample(coefficients, cols, tile_width, axis=2)
+        return coefficients.reshape((len(coefficients), -1))
+
+    def get_tile_nodes(self, rectangle):
+        # rows and columns of the grid nodes enclosing the tile, relative to the tile origin
+        x, y, tile_width, tile_height = rectangle
+        return (self.get_grid_nodes(y, tile_height, self.grid_step[0], self.scene_size[0]),
+                self.get_grid_nodes(x, tile_width, self.grid_step[1], self.scene_size[1]))
+
+    def get_grid_rectangle(self, rectangle):
+        # (x, y, width, height) of the scene pixels from the first to the last grid node enclosing the tile, the
+        # inputs of the coefficients are read on this rectangle
+        rows, cols = self.get_tile_nodes(rectangle)
+        return (int(rectangle[0] + cols[0]), int(rectangle[1] + rows[0]), int(cols[-1] - cols[0] + 1),
+                int(rows[-1] - rows[0] + 1))
+
+    @staticmethod
+    def get_grid_nodes(origin, size, step, scene_size):
+        # nodes of the scene wide grid (multiples of step and the last pixel) from the last node at or before the
+        # first pixel of the tile to the first node at or after its last pixel, relative to the tile origin
+        nodes = numpy.union1d(numpy.arange(0, scene_size, step), [scene_size - 1])
+        first = numpy.searchsorted(nodes, origin, side='right') - 1
+        last = numpy.searchsorted(nodes, origin + size - 1, side='left')
+        return nodes[first:last + 1] - origin
+
+    @staticmethod
+    def upsample(values, nodes, size, axis):
+        # linear interpolation of values given at the pixel positions nodes to all pixels 0 .. size - 1 along axis, the
+        # first node is at or before 0 and the last at or after size - 1
+        if len(nodes) == 1:
+            return numpy.repeat(values, size, axis=axis)
+        positions = numpy.arange(size)
+        lower = numpy.clip(numpy.searchsorted(nodes, positions, side='right') - 1, 0, len(nodes) - 2)
+        weight = ((positions - nodes[lower]) / (nodes[lower + 1] - nodes[lower]).astype(numpy.float64)).astype(
+            values.dtype)
+        shape = [1] * values.ndim
+        shape[axis] = size
+        weight = weight.reshape(shape)
+        return values.take(lower, axis=axis) * (1 - weight) + values.take(lower + 1, axis=axis) * weight
+
     def compute_flags(self, lswt, visible, nir, bt, sat_za, sun_za, rel_az, lwm,
-                      cmsk, height, width, sattype):
+                      cmsk, height, width, sattype, index=None):
         self.check = QualityCheck(lswt, visible, nir, None, bt, None, sat_za, sun_za, rel_az, lwm,
-                                  cmsk, height, width, sattype)
+                                  cmsk, height, width, sattype, self.dtype, self.early_out, self.disabled_tests,
+                                  self.timings, index)
         return self.check.check_quality()
 
     def compute_quality_index(self, flags):
@@ -0,0 +1,73 @@
+# Converts coefficient tables into the binary LUT format read by LookupTable.read
+#
+# usage: python lut_converter.py <table.xlsx> <output.lut>
+#        python lut_converter.py mono <output.lut>
+#
+# The spreadsheet needs a header row like lut_template.xlsx: the columns before the first 'coef' column are the
+# dimensions of the LUT, the 'coef' columns are the coefficients of each node. Rows with placeholders instead of
+# numbers are skipped, a table without coefficients for every node is not converted.
+# mono converts the coefficients of mono.py into mono_window.lut.
+
+import sys
+
+import numpy
+
+import lookup_table
+from lookup_table import LookupTable
+from mono import Mono
+
+
+def convert_xlsx(filename, output):
+    # openpyxl is only needed for the conversion, not for the processor
+    import openpyxl
+    sheet = openpyxl.load_workbook(filename, read_only=True, data_only=True).active
+    rows = sheet.iter_rows(values_only=True)
+    header = [str(name).strip().lower() for name in next(rows) if name is not None]
+    coef_columns = [i for i in range(0, len(header)) if header[i].startswith('coef')]
+    if len(coef_columns) == 0:
+        raise ValueError(filename + " has no coefficient columns")
+    axis_count = coef_columns[0]
+
+    nodes = []
+    coefficients = []
+    for row in rows:
+        row = row[:len(header)]
+        if not all(is_number(value) for value in row[:axis_count]):
+            continue
+        if not all(is_number(row[i]) for i in coef_columns):
+            continue
+        nodes.append([float(value) for value in row[:axis_count]])
+        coefficients.append([float(row[i]) for i in coef_columns])
+    if len(nodes) == 0:
+        raise ValueError(filename + " contains no coefficients")
+
+    nodes = numpy.array(nodes)
+    dimensions = [numpy.unique(nodes[:, i]) for i in range(0, axis_count)]
+    shape = tuple(len(dimension) for dimension in dimensions) + (len(coef_columns),)
+    values = numpy.ones(shape, dtype=numpy.float32) * numpy.nan
+    index = tuple(numpy.searchsorted(dimensions[i], nodes[:, i]) for i in range(0, axis_count))
+    values[index] = numpy.array(coefficients)
+    missing = numpy.isnan(values).any(axis=-1).sum()
+    if missing > 0:
+        raise ValueError(filename + " has no coefficients for " + str(missing) + " of " +
+                         str(int(numpy.prod(shape[:-1]))) + " nodes")
+    LookupTable(values.ravel(), dimensions, len(coef_columns)).write(output)
+
+
+def convert_mono(output):
+    values = numpy.array(Mono().values, dtype=numpy.float64)
+    LookupTable(values, list(lookup_table.COEFFICIENT_DIMENSIONS), 2).write(output)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python lut_converter.py <table.xlsx|mono> <output.lut>')
+        sys.exit(1)
+    if sys.argv[1] == 'mono':
+        convert_mono(sys.argv[2])
+    else:
+        convert_xlsx(sys.argv[1], sys.argv[2])
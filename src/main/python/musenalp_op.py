@@ -1,47 +1,56 @@
 import lswt_algo
 import numpy
+import quality_levels
+import quality_tests
+import sensors
 import snappy
 from snappy import FlagCoding
 from datetime import datetime
 
-from config import Config
-from tirs_utils import TirsUtils
+import config
+from concurrent.futures import ThreadPoolExecutor
+import logging
 from utils import Utils
-import configparser
-import os
-from slstr_utils import SlstrUtils
+import threading
+import tile_io
+import water_index
 
 from snappy import jpy
 
 Float = jpy.get_type('java.lang.Float')
 Color = jpy.get_type('java.awt.Color')
+Rectangle = jpy.get_type('java.awt.Rectangle')
 IndexCoding = jpy.get_type('org.esa.snap.core.datamodel.IndexCoding')
 DateFormat = jpy.get_type('java.text.DateFormat')
 Date = jpy.get_type('java.util.Date')
 SimpleDateFormat = jpy.get_type('java.text.SimpleDateFormat')
 
+# the processing statistics are logged at the end if the logStatistics parameter is set
+LOGGER = logging.getLogger('musenalp')
+
+# rows of the land/water mask read at once for the water index
+WATER_INDEX_ROWS = 256
+# prefetched tiles that are kept until a thread computes them, the oldest is dropped for a new one
+PREFETCH_TILES = 4
+# started tiles that are not prefetched again, the oldest is forgotten. Tiles are started in about row order, so the
+# next tile of a tile is either started shortly before or after it
+STARTED_TILES = 64
+
 
 class MuSenALPOp:
     def __init__(self):
         self.source_product = None
-        self.lower_band = None
-        self.upper_band = None
+        # adapter of the sensor, it holds the source bands and the calibration constants
+        self.sensor = None
+        # raw inputs of the sensor read for every tile
+        self.tile_reads = set()
         self.lswt_flags_band = None
         self.lswt_quality_index = None
         self.lswt_band = None
-        self.visible_band = None
-        self.nir_band = None
-        self.bt3_band = None
-        self.sat_za = None
-        self.sun_za = None
-        self.rel_az = None
-        self.sat_az = None
-        self.sun_az = None
         self.lwm_band = None
         self.ref_band_org = None
         self.cmsk_band = None
         self.ref_band = None
-        self.mono_band = None
         self.valid_pixel_band = None
 
         self.algorithm_parameter = ''
@@ -54,6 +63,35 @@ class MuSenALPOp:
         self.a1_mono = 0.0
         self.needs_lut = False
         self.season = None
+        self.elevation = 0.0
+        self.height_band = None
+        # deduplication hit ratios of the LUT lookups, only collected if the statistics are logged
+        self.lut_hit_ratios = None
+        self.log_statistics = False
+        # tiles without a pixel to compute the lswt for, they are written without reading the other bands
+        self.skipped_tiles = []
+        # run-length spans of the water pixels of the scene, the tiles compute only these pixels
+        self.water_index = None
+        # floating point type of the tiles, float32 halves the memory of every intermediate array
+        self.dtype = numpy.dtype(numpy.float64)
+        # input and output buffers are reused between tiles, one set per thread as SNAP computes tiles concurrently
+        self.buffers = threading.local()
+        # pixels around each tile that are read for the spatial quality tests
+        self.halo = 0
+        # threads that read the source tiles of a tile concurrently, None reads them one after another
+        self.read_pool = None
+        # thread that reads the source tiles of the next tile while the current one is computed, None without prefetch
+        self.prefetch_pool = None
+        # futures of the inputs of prefetched tiles and the last tiles that have been started (to None), by x, y, width
+        # and height, both in the order they were added
+        self.prefetched = {}
+        self.started_tiles = {}
+        self.prefetch_lock = threading.Lock()
+        # the results are copied into the data buffers of the target tiles instead of being set with setSamples
+        self.zero_copy_write = False
+        self.tile_size = None
+        # inputs read by the enabled quality tests, the bands only disabled tests need are not read
+        self.quality_inputs = set()
         self.lat_band = None
         self.lon_band = None
 
@@ -64,10 +102,6 @@ class MuSenALPOp:
         self.padding = 0
         self.range = (0, 0, 0, 0)
 
-        self.solar_irr_s2 = 0.0
-        self.solar_irr_s3 = 0.0
-        self.azimuth = 0.0
-
         self.utils = Utils()
         self.width = 0
         self.height = 0
@@ -75,7 +109,8 @@ class MuSenALPOp:
         self.sattype = ''
         self.file_location = None
 
-        self.config = configparser.ConfigParser()
+        # config.SensorConfig of the sensor
+        self.config = None
 
     def initialize(self, context):
         self.sattype = context.getParameter('sattype')
@@ -84,34 +119,45 @@ class MuSenALPOp:
         self.get_cut_param(context)
 
         self.algorithm_parameter = context.getParameter('algorithm')
-        self.check_correct_algoithm(self.config['algorithms']['lswt-algorithm'])
+        self.dtype = numpy.dtype(str(context.getParameter('precision')))
+        self.halo = context.getParameter('tileHalo')
+        self.check_correct_algoithm(self.config.algorithms)
+        config.check_sensor_config(self.config, self.algorithm_parameter)
 
         if self.algorithm_parameter == 'split-window':
             self.get_split_window_coeff(context)
         elif self.algorithm_parameter == 'mono-window':
             self.get_mono_window_coeff(context)
+        self.algo.early_out = context.getParameter('flagEarlyOut')
+        self.get_quality_tests(context)
+        self.get_statistics(context)
         self.source_product = context.getSourceProduct('source')
         if self.needs_lut:
+            self.algo.lut.setDeduplication(context.getParameter('lutDeduplication'),
+                                           context.getParameter('lutResolution'))
             self.get_lut_info(context)
+            if self.season is not None and self.height_band is None:
+                self.algo.collapse_lut(self.season, self.elevation)
         self.file_location = self.source_product.getFileLocation()
         if self.file_location is not None:
             self.file_location = self.file_location.getAbsolutePath()
         if self.sattype == 'SLSTR' or self.sattype == 'TIRS':
-            self.source_product = self.utils.resample(self.source_product, self.config['bands']['lower_band'])
+            self.source_product = self.utils.resample(self.source_product, self.config.bands.lower_band)
         if self.cut:
             self.source_product = self.utils.cut_product(self.source_product, self.range)
         self.width = self.source_product.getSceneRasterWidth()
         self.height = self.source_product.getSceneRasterHeight()
-        if self.algorithm_parameter == 'split-window':
-            self.get_split_window_bands(context)
-        else:
-            self.get_mono_window_bands(context)
+        self.get_sensor(context)
 
         ref_image = self.get_reg_image(context)
         self.get_land_water_mask(context)
         self.get_cloud_mask(context)
         self.get_valid_pixel_band(context)
-        self.get_geo_data(context)
+        self.get_water_index(context)
+        if self.needs_lut and self.algorithm_parameter == 'mono-window':
+            self.get_lut_grid_step(context)
+        self.get_read_threads(context)
+        self.zero_copy_write = bool(context.getParameter('zeroCopyWrite'))
 
         self.configure_target_product(context, ref_image)
 
@@ -119,13 +165,24 @@ class MuSenALPOp:
         lswt = None
         lswt_flags = None
         lswt_index = None
-        lwm_data = self.get_lwm_data(context, target_rectangle)
-        cmsk_data = self.get_cmsk_data(context, target_rectangle)
-        valid_data = self.get_valid_data(context, target_rectangle)
-
-        if self.algorithm_parameter == 'split-window':
-            bt3_data, data, nir_data, upper_data, visible_data = self.get_split_window_band_data(context,
-                                                                                                 target_rectangle)
+        # the spatial quality tests need the pixels around the tile, they are computed on the tile with a halo
+        source_rectangle = self.get_source_rectangle(target_rectangle)
+        water, skip_flags, samples = self.get_inputs(context, target_rectangle, source_rectangle)
+        lwm_data = samples.get('lwm')
+        valid_data = samples.get('valid')
+
+        if skip_flags is not None:
+            self.skipped_tiles.append((target_rectangle.x, target_rectangle.y))
+            lswt = numpy.full(skip_flags.shape, Float.NaN, dtype=self.dtype)
+            lswt_flags = skip_flags
+            # the quality index has the type the quality check gives it
+            level_type = numpy.int32 if self.dtype == numpy.float32 else numpy.float64
+            lswt_index = quality_levels.STANDARD.get_levels(skip_flags, level_type)
+        elif self.algorithm_parameter == 'split-window':
+            cmsk_data = samples.get('cmsk')
+            tile = self.calibrate(samples)
+            data, upper_data, bt3_data, visible_data, nir_data, sat_za_data, sun_za_data, rel_az_data = [
+                tile[name] for name in sensors.INPUTS]
             if valid_data is not None:
                 data[numpy.where(valid_data == 0)] = Float.NaN
                 upper_data[numpy.where(valid_data == 0)] = Float.NaN
@@ -134,79 +191,229 @@ class MuSenALPOp:
                     data[numpy.where(lwm_data == 0)] = Float.NaN
                     upper_data[numpy.where(lwm_data == 0)] = Float.NaN
                 if cmsk_data is not None:
-                    if self.sattype == 'AVHRR':
-                        data[numpy.where(numpy.logical_or(cmsk_data >= 7, cmsk_data == 0))] = Float.NaN
-                        upper_data[numpy.where(numpy.logical_or(cmsk_data >= 7, cmsk_data == 0))] = Float.NaN
-                    else:
-                        data[numpy.where(cmsk_data != 0)] = Float.NaN
-                        upper_data[numpy.where(cmsk_data != 0)] = Float.NaN
-
-            rel_az_data = None
-            sat_za_data = None
-            sun_za_data = None
-            data, nir_data, rel_az_data, sat_za_data, sun_za_data, upper_data, visible_data = self.get_geom_data(
-                context, data, nir_data, rel_az_data, sat_za_data, sun_za_data, target_rectangle, upper_data,
-                visible_data)
+                    cloudy = numpy.where(self.sensor.get_cloudy(cmsk_data))
+                    data[cloudy] = Float.NaN
+                    upper_data[cloudy] = Float.NaN
+
+            height_data = None
+            season_data = None
+            if self.needs_lut:
+                height_data, season_data = self.get_lut_data(samples.get('height'))
+            if water is not None:
+                # the algorithm and the quality tests run on vectors of the water pixels
+                (data, upper_data, visible_data, nir_data, bt3_data, sat_za_data, sun_za_data, rel_az_data, lwm_data,
+                 cmsk_data, height_data, season_data) = self.gather(water, data, upper_data, visible_data, nir_data,
+                                                                    bt3_data, sat_za_data, sun_za_data, rel_az_data,
+                                                                    lwm_data, cmsk_data, height_data, season_data)
             if self.needs_lut:
-                height_data, season_data = self.get_lut_data(context, data, target_rectangle)
-                lswt = self.algo.compute_lswt_lut(data, upper_data, sat_za_data, season_data, height_data)
+                lswt = self.algo.compute_lswt_lut(data, upper_data, sat_za_data, season_data, height_data,
+                                                  out=self.get_output_buffer(data.shape),
+                                                  hit_ratios=self.lut_hit_ratios)
             else:
-                lswt = self.algo.compute_lswt(data, upper_data, sat_za_data)
+                lswt = self.algo.compute_lswt(data, upper_data, sat_za_data, out=self.get_output_buffer(data.shape))
 
-            lswt_flags = self.algo.compute_flags(numpy.array(lswt, copy=True), visible_data, nir_data, bt3_data,
+            lswt_flags = self.algo.compute_flags(lswt, visible_data, nir_data, bt3_data,
                                                  data, upper_data, sat_za_data, sun_za_data, rel_az_data, lwm_data,
-                                                 cmsk_data, target_rectangle.getHeight(), target_rectangle.getWidth(),
-                                                 self.sattype)
+                                                 cmsk_data, source_rectangle.getHeight(), source_rectangle.getWidth(),
+                                                 self.sattype, water)
+            if water is not None:
+                lswt, lswt_flags = self.scatter(water, source_rectangle, lswt, lswt_flags)
 
             lswt_index = self.algo.compute_quality_index(lswt_flags)
 
         elif self.algorithm_parameter == 'mono-window':
-            data, visible_data, nir_data = self.get_mono_window_band_data(context, target_rectangle)
-            rel_az_data = None
-            sat_za_data = None
-            sun_za_data = None
-            if self.sattype == 'AVHRR':
-                data, rel_az_data, sat_za_data, sun_za_data, upper_data = self.get_geom_data_avhrr(context, data,
-                                                                                                   rel_az_data,
-                                                                                                   sun_za_data,
-                                                                                                   target_rectangle,
-                                                                                                   None)
-            if self.sattype == 'SLSTR':
-                nir_data, rel_az_data, sat_za_data, sun_za_data, visible_data = self.get_geom_data_slstr(context,
-                                                                                                         nir_data,
-                                                                                                         target_rectangle,
-                                                                                                         visible_data)
-            if self.sattype == 'AATSR':
-                rel_az_data, sat_za_data, sun_za_data = self.get_geom_data_aatsr(context,
-                                                                                 target_rectangle)
-            if self.sattype == 'VIIRS':
-                rel_az_data, sat_za_data, sun_za_data = self.get_geom_data_viirs(context, target_rectangle)
+            cmsk_data = samples.get('cmsk')
+            tile = self.calibrate(samples)
+            data, visible_data, nir_data, sat_za_data, sun_za_data, rel_az_data = [
+                tile[name] for name in ('bt4', 'rf1', 'rf2', 'sat_za', 'sun_za', 'rel_az')]
             height_data = 0.0
             season_data = 0
             if self.needs_lut:
-                height_data, season_data = self.get_lut_data(context, data, target_rectangle)
+                height_data, season_data = self.get_lut_data(samples.get('height'))
             if valid_data is not None:
                 data[numpy.where(valid_data == 0)] = Float.NaN
             if context.getParameter('maskBeforeCalculation'):
                 if lwm_data is not None:
                     data[numpy.where(lwm_data == 0)] = Float.NaN
                 if cmsk_data is not None:
-                    if self.sattype == 'AVHRR':
-                        data[numpy.where(numpy.logical_or(cmsk_data >= 7, cmsk_data == 0))] = Float.NaN
-                    else:
-                        data[numpy.where(cmsk_data != 0)] = Float.NaN
-            lswt = self.algo.compute_lswt(data, season_data, height_data, sat_za_data)
-
-            lswt_flags = self.algo.compute_flags(numpy.array(lswt, copy=True), visible_data, nir_data, data,
+                    data[numpy.where(self.sensor.get_cloudy(cmsk_data))] = Float.NaN
+            # the coefficients of the LUT grid are interpolated on the whole tile, the water pixels are gathered after
+            tile_grid = self.needs_lut and self.algo.grid_step != (1, 1)
+            if water is not None and not tile_grid:
+                (data, visible_data, nir_data, sat_za_data, sun_za_data, rel_az_data, lwm_data, cmsk_data, height_data,
+                 season_data) = self.gather(water, data, visible_data, nir_data, sat_za_data, sun_za_data, rel_az_data,
+                                            lwm_data, cmsk_data, height_data, season_data)
+            grid_height, grid_zenith = height_data, sat_za_data
+            if tile_grid:
+                grid_height, grid_zenith = self.read_grid_inputs(context, source_rectangle)
+            lswt = self.algo.compute_lswt(data, season_data, grid_height, grid_zenith,
+                                          (source_rectangle.x, source_rectangle.y, source_rectangle.width,
+                                           source_rectangle.height), self.lut_hit_ratios)
+            if water is not None and tile_grid:
+                (lswt, data, visible_data, nir_data, sat_za_data, sun_za_data, rel_az_data, lwm_data,
+                 cmsk_data) = self.gather(water, lswt, data, visible_data, nir_data, sat_za_data, sun_za_data,
+                                          rel_az_data, lwm_data, cmsk_data)
+
+            lswt_flags = self.algo.compute_flags(lswt, visible_data, nir_data, data,
                                                  sat_za_data, sun_za_data, rel_az_data, lwm_data, cmsk_data,
-                                                 target_rectangle.getHeight(), target_rectangle.getWidth(),
-                                                 self.sattype)
+                                                 source_rectangle.getHeight(), source_rectangle.getWidth(),
+                                                 self.sattype, water)
+            if water is not None:
+                lswt, lswt_flags = self.scatter(water, source_rectangle, lswt, lswt_flags)
             lswt_index = self.algo.compute_quality_index(lswt_flags)
 
+        if source_rectangle is not target_rectangle:
+            lswt, lswt_flags, lswt_index = [self.crop(values, source_rectangle, target_rectangle)
+                                            for values in (lswt, lswt_flags, lswt_index)]
         self.set_target_tiles(lswt, lswt_flags, lswt_index, target_tiles)
 
+    def get_inputs(self, context, target_rectangle, source_rectangle):
+        # the water pixels, the skip flags and the source samples of a tile, see read_inputs
+        future = None
+        if self.prefetch_pool is not None:
+            with self.prefetch_lock:
+                key = (target_rectangle.x, target_rectangle.y, target_rectangle.width, target_rectangle.height)
+                self.started_tiles.pop(key, None)
+                self.started_tiles[key] = None
+                if len(self.started_tiles) > STARTED_TILES:
+                    del self.started_tiles[next(iter(self.started_tiles))]
+                future = self.prefetched.pop(key, None)
+                self.prefetch(context, target_rectangle)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                # the prefetch thread calls getSourceTile outside the threads GPF computes the tiles with. A read that
+                # failed there is repeated by this thread, its errors are raised to GPF from here
+                pass
+        return self.read_inputs(context, source_rectangle, self.get_tile_buffers())
+
+    def prefetch(self, context, target_rectangle):
+        # the inputs of the next tile in row order are read by the prefetch thread into buffers of their own. With
+        # several threads computing tiles, the next tile may already have been started by another thread
+        if self.tile_size is None:
+            tile_size = context.getTargetProduct().getPreferredTileSize()
+            self.tile_size = (target_rectangle.width, target_rectangle.height) if tile_size is None else (
+                tile_size.width, tile_size.height)
+        key = tile_io.next_tile(target_rectangle, self.tile_size, (self.width, self.height))
+        if key is None or key in self.started_tiles or key in self.prefetched:
+            return
+        if len(self.prefetched) >= PREFETCH_TILES:
+            self.prefetched.pop(next(iter(self.prefetched))).cancel()
+        self.prefetched[key] = self.prefetch_pool.submit(self.read_inputs, context,
+                                                         self.get_source_rectangle(Rectangle(*key)),
+                                                         tile_io.TileBuffers())
+
+    def read_inputs(self, context, rectangle, buffers):
+        # the land/water mask and the valid pixels are read first, the other bands only for a tile with pixels to
+        # compute. The bands of each step are read concurrently by the read threads
+        water = None
+        bands = {'valid': self.valid_pixel_band}
+        if self.water_index is None:
+            if self.needs_input('lwm') or context.getParameter('maskBeforeCalculation'):
+                bands['lwm'] = self.lwm_band
+        samples = tile_io.read_tiles(context, rectangle, bands, buffers, self.read_pool)
+        if self.water_index is not None:
+            # flat indices of the water pixels in the tile, the land/water mask tile is not read
+            water = self.water_index.get_pixels(rectangle.x, rectangle.y, rectangle.width, rectangle.height)
+            lwm_data = buffers.get('lwm', rectangle.width * rectangle.height)
+            lwm_data.fill(0)
+            lwm_data[water] = 1
+            samples['lwm'] = lwm_data
+        skip_flags = self.get_skip_flags(context, samples.get('lwm'), samples.get('valid'))
+        if skip_flags is not None:
+            # the sensor bands, the cloud mask and the height are not read for a skipped tile
+            return water, skip_flags, samples
+        bands = self.sensor.get_source_bands(self.tile_reads)
+        if self.needs_input('cmsk') or context.getParameter('maskBeforeCalculation'):
+            bands['cmsk'] = self.cmsk_band
+        if self.needs_lut:
+            bands['height'] = self.height_band
+        samples.update(tile_io.read_tiles(context, rectangle, bands, buffers, self.read_pool))
+        return water, None, samples
+
+    def calibrate(self, samples):
+        # the physical inputs of the sensor, inputs of a wider floating point type than the tiles are narrowed to it,
+        # so that float32 tiles are not promoted to float64 by a single input
+        tile = self.sensor.calibrate(dict((name, samples[name]) for name in self.tile_reads))
+        for name, values in tile.items():
+            if isinstance(values, (numpy.ndarray, numpy.floating)) and values.dtype.itemsize > self.dtype.itemsize:
+                tile[name] = values.astype(self.dtype)
+        return tile
+
+    def read_grid_inputs(self, context, rectangle):
+        # height and satellite zenith angle of the mono-window coefficients on the rectangle of the scene wide grid
+        # nodes enclosing the tile, which extends beyond the tile unless its borders are nodes
+        grid_rectangle = Rectangle(*self.algo.get_grid_rectangle((rectangle.x, rectangle.y, rectangle.width,
+                                                                  rectangle.height)))
+        bands = self.sensor.get_source_bands(self.sensor.get_reads({'sat_za'}))
+        if self.height_band is not None and self.algo.lut_curve is None:
+            bands['height'] = self.height_band
+        samples = tile_io.read_tiles(context, grid_rectangle, bands)
+        height_data = self.get_lut_data(samples.pop('height', None))[0]
+        return height_data, self.sensor.calibrate(samples)['sat_za']
+
+    def get_skip_flags(self, context, lwm_data, valid_data):
+        # constant flags of a tile without a valid water pixel, None if the tile has to be computed. The lswt of these
+        # pixels is NaN anyway. Only the land/water mask and the valid pixels are known: land pixels get the land bit
+        # and invalid pixels the range bit, i.e. quality level 0. The cloud mask and the other inputs are not read, so
+        # the bits of the other tests are not set
+        candidates = None
+        if valid_data is not None:
+            candidates = valid_data != 0
+        if lwm_data is not None and context.getParameter('maskBeforeCalculation') and self.needs_input('lwm'):
+            water = lwm_data != 0
+            candidates = water if candidates is None else numpy.logical_and(candidates, water)
+        if candidates is None or candidates.any():
+            return None
+        flags = numpy.full(candidates.shape, 8, dtype=numpy.uint16)
+        if valid_data is not None:
+            flags[valid_data == 0] = 32
+        return flags
+
+    @staticmethod
+    def gather(index, *arrays):
+        # the values of the pixels index of tile arrays, scalars and missing arrays are passed on as they are
+        return [values if values is None or numpy.ndim(values) == 0 else numpy.reshape(values, -1)[index]
+                for values in arrays]
+
+    def scatter(self, index, rectangle, lswt, lswt_flags):
+        # the results of the water pixels on the whole tile, the land pixels get a NaN lswt and the land bit
+        size = rectangle.width * rectangle.height
+        tile_lswt = numpy.full(size, Float.NaN, dtype=self.dtype)
+        tile_lswt[index] = lswt
+        tile_flags = numpy.full(size, 8, dtype=numpy.uint16)
+        tile_flags[index] = lswt_flags
+        return tile_lswt, tile_flags
+
+    def get_source_rectangle(self, target_rectangle):
+        if self.halo == 0:
+            return target_rectangle
+        source_rectangle = Rectangle(target_rectangle.x - self.halo, target_rectangle.y - self.halo,
+                                     target_rectangle.width + 2 * self.halo, target_rectangle.height + 2 * self.halo)
+        return source_rectangle.intersection(Rectangle(0, 0, self.width, self.height))
+
+    @staticmethod
+    def crop(values, source_rectangle, target_rectangle):
+        values = numpy.reshape(values, (source_rectangle.height, source_rectangle.width))
+        y = target_rectangle.y - source_rectangle.y
+        x = target_rectangle.x - source_rectangle.x
+        return numpy.ascontiguousarray(values[y:y + target_rectangle.height, x:x + target_rectangle.width])
+
+    def get_output_buffer(self, shape):
+        # the lswt is copied into the target tile, so the buffer can be reused by the next tile of the same thread
+        # the buffer is only reallocated for a larger tile, the vectors of the water pixels differ in size every tile
+        return self.get_tile_buffers().get('lswt', int(numpy.prod(shape)), self.dtype).reshape(shape)
+
+    def get_tile_buffers(self):
+        buffers = getattr(self.buffers, 'tile', None)
+        if buffers is None:
+            buffers = tile_io.TileBuffers()
+            self.buffers.tile = buffers
+        return buffers
+
     def check_correct_algoithm(self, valid_algorithms):
-        if valid_algorithms != 'both' and valid_algorithms != self.algorithm_parameter:
+        if self.algorithm_parameter not in valid_algorithms:
             raise AlgorithmException(
                 'the sensor ' + self.sattype + ' cannot be run with the algorithm ' + self.algorithm_parameter)
 
@@ -214,272 +421,22 @@ class MuSenALPOp:
         lswt_tile = target_tiles.get(self.lswt_band)
         lswt_flags_tile = target_tiles.get(self.lswt_flags_band)
         lswt_quality_tile = target_tiles.get(self.lswt_quality_index)
-        # Set the result to the target tiles
-        lswt_tile.setSamples(lswt)
-        lswt_flags_tile.setSamples(lswt_flags)
-        lswt_quality_tile.setSamples(lswt_index)
-
-    def get_mono_window_band_data(self, context, target_rectangle):
-        data_tile = context.getSourceTile(self.mono_band, target_rectangle)
-        data_samples = data_tile.getSamplesFloat()
-        data = numpy.array(data_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_K'])
-        visible_tile = context.getSourceTile(self.visible_band, target_rectangle)
-        nir_tile = context.getSourceTile(self.nir_band, target_rectangle)
-        visible_sample = visible_tile.getSamplesFloat()
-        nir_sample = nir_tile.getSamplesFloat()
-        visible_data = numpy.array(visible_sample, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_rf'])
-        nir_data = numpy.array(nir_sample, dtype=numpy.float32) * float(self.config['scale_factors']['scale_rf'])
-        return data, visible_data, nir_data
-
-    def get_geom_data(self, context, data, nir_data, rel_az_data, sat_za_data, sun_za_data, target_rectangle,
-                      upper_data, visible_data):
-        if self.sattype == 'AVHRR':
-            data, rel_az_data, sat_za_data, sun_za_data, upper_data = self.get_geom_data_avhrr(context, data,
-                                                                                               rel_az_data,
-                                                                                               sun_za_data,
-                                                                                               target_rectangle,
-                                                                                               upper_data)
-        if self.sattype == 'SLSTR':
-            nir_data, rel_az_data, sat_za_data, sun_za_data, visible_data = self.get_geom_data_slstr(context,
-                                                                                                     nir_data,
-                                                                                                     target_rectangle,
-                                                                                                     visible_data)
-        if self.sattype == 'TIRS':
-            data, nir_data, rel_az_data, sat_za_data, sun_za_data, upper_data, visible_data = self.get_geom_data_tiirs(
-                data, nir_data, sat_za_data, sun_za_data, upper_data, visible_data)
-
-        if self.sattype == 'AATSR':
-            rel_az_data, sat_za_data, sun_za_data = self.get_geom_data_aatsr(context,
-                                                                             target_rectangle)
-
-        if self.sattype == 'VIIRS':
-            rel_az_data, sat_za_data, sun_za_data = self.get_geom_data_viirs(context,
-                                                                             target_rectangle)
-
-        return data, nir_data, rel_az_data, sat_za_data, sun_za_data, upper_data, visible_data
-
-    def get_lut_data(self, context, data, target_rectangle):
-        if self.sattype == 'SLSTR':
-            height_tile = context.getSourceTile(self.height_band, target_rectangle)
-            height_samples = height_tile.getSamplesFloat()
-            height_data = numpy.array(height_samples, dtype=numpy.float32)
-        else:
-            height_data = numpy.ones(data.shape) * self.elevation
-        season_data = numpy.ones(data.shape) * self.season
+        # Set the result to the target tiles, they are converted to the types of the bands while they are copied
+        tile_io.write_samples(lswt_tile, lswt, self.zero_copy_write)
+        tile_io.write_samples(lswt_flags_tile, lswt_flags, self.zero_copy_write)
+        tile_io.write_samples(lswt_quality_tile, lswt_index, self.zero_copy_write)
+
+    def get_lut_data(self, height_data):
+        # height_data: the samples of the height band, None without a height band
+        if self.algo.lut_curve is not None:
+            # season and height are constant, the LUT has already been reduced to them in initialize
+            return None, None
+        # a constant height and the season are scalars, the LUT broadcasts them to the pixels
+        if height_data is None:
+            height_data = self.dtype.type(self.elevation)
+        season_data = self.dtype.type(self.season)
         return height_data, season_data
 
-    def get_geom_data_tiirs(self, data, nir_data, sat_za_data, sun_za_data, upper_data, visible_data):
-        tirs_utils = TirsUtils()
-        data = tirs_utils.radiance_to_kelvin(data, self.source_product.getMetadataRoot().getElement(
-            'L1_METADATA_FILE').getElement('TIRS_THERMAL_CONSTANTS').getAttributeDouble(
-            'K1_CONSTANT_BAND_10'),
-                                             self.source_product.getMetadataRoot().getElement(
-                                                 'L1_METADATA_FILE').getElement(
-                                                 'TIRS_THERMAL_CONSTANTS').getAttributeDouble(
-                                                 'K2_CONSTANT_BAND_10'))
-        upper_data = tirs_utils.radiance_to_kelvin(upper_data,
-                                                   self.source_product.getMetadataRoot().getElement(
-                                                       'L1_METADATA_FILE').getElement(
-                                                       'TIRS_THERMAL_CONSTANTS').getAttributeDouble(
-                                                       'K1_CONSTANT_BAND_10'),
-                                                   self.source_product.getMetadataRoot().getElement(
-                                                       'L1_METADATA_FILE').getElement(
-                                                       'TIRS_THERMAL_CONSTANTS').getAttributeDouble(
-                                                       'K2_CONSTANT_BAND_10'))
-        sat_za_data = numpy.ones(data.shape) * self.source_product.getMetadataRoot().getElement(
-            'L1_METADATA_FILE').getElement('IMAGE_ATTRIBUTES').getAttributeDouble(
-            self.config['angles']['sat_za'])
-        sun_za_data = 90 - numpy.ones(data.shape) * self.source_product.getMetadataRoot().getElement(
-            'L1_METADATA_FILE').getElement('IMAGE_ATTRIBUTES').getAttributeDouble(
-            self.config['angles']['sun_za'])
-        sat_az_data = numpy.ones(data.shape) * self.azimuth
-        sun_az_data = numpy.ones(data.shape) * self.source_product.getMetadataRoot().getElement(
-            'L1_METADATA_FILE').getElement('IMAGE_ATTRIBUTES').getAttributeDouble(
-            self.config['angles']['sun_az'])
-        rel_az_data = numpy.absolute(sat_az_data - sun_az_data
-                                     * float(self.config['scale_factors']['scale_factor_deg']))
-        rel_az_data = rel_az_data * (rel_az_data <= 180) + (360 - rel_az_data) * (rel_az_data > 180)
-        visible_data = tirs_utils.radiance_to_reflectance(visible_data,
-                                                          self.source_product.getMetadataRoot().getElement(
-                                                              'L1_METADATA_FILE').getElement(
-                                                              'RADIOMETRIC_RESCALING').getAttributeDouble(
-                                                              'RADIANCE_MULT_BAND_4'),
-                                                          self.source_product.getMetadataRoot().getElement(
-                                                              'L1_METADATA_FILE').getElement(
-                                                              'RADIOMETRIC_RESCALING').getAttributeDouble(
-                                                              'RADIANCE_ADD_BAND_4'),
-                                                          self.source_product.getMetadataRoot().getElement(
-                                                              'L1_METADATA_FILE').getElement(
-                                                              'RADIOMETRIC_RESCALING').getAttributeDouble(
-                                                              'REFLECTANCE_MULT_BAND_4'),
-                                                          self.source_product.getMetadataRoot().getElement(
-                                                              'L1_METADATA_FILE').getElement(
-                                                              'RADIOMETRIC_RESCALING').getAttributeDouble(
-                                                              'REFLECTANCE_ADD_BAND_4'),
-                                                          self.source_product.getMetadataRoot().getElement(
-                                                              'L1_METADATA_FILE').getElement(
-                                                              'IMAGE_ATTRIBUTES').getAttributeDouble(
-                                                              self.config['angles']['sun_za']))
-        nir_data = tirs_utils.radiance_to_reflectance(nir_data,
-                                                      self.source_product.getMetadataRoot().getElement(
-                                                          'L1_METADATA_FILE').getElement(
-                                                          'RADIOMETRIC_RESCALING').getAttributeDouble(
-                                                          'RADIANCE_MULT_BAND_5'),
-                                                      self.source_product.getMetadataRoot().getElement(
-                                                          'L1_METADATA_FILE').getElement(
-                                                          'RADIOMETRIC_RESCALING').getAttributeDouble(
-                                                          'RADIANCE_ADD_BAND_5'),
-                                                      self.source_product.getMetadataRoot().getElement(
-                                                          'L1_METADATA_FILE').getElement(
-                                                          'RADIOMETRIC_RESCALING').getAttributeDouble(
-                                                          'REFLECTANCE_MULT_BAND_5'),
-                                                      self.source_product.getMetadataRoot().getElement(
-                                                          'L1_METADATA_FILE').getElement(
-                                                          'RADIOMETRIC_RESCALING').getAttributeDouble(
-                                                          'REFLECTANCE_ADD_BAND_5'),
-                                                      self.source_product.getMetadataRoot().getElement(
-                                                          'L1_METADATA_FILE').getElement(
-                                                          'IMAGE_ATTRIBUTES').getAttributeDouble(
-                                                          self.config['angles']['sun_za']))
-        return data, nir_data, rel_az_data, sat_za_data, sun_za_data, upper_data, visible_data
-
-    def get_geom_data_slstr(self, context, nir_data, target_rectangle, visible_data):
-        sat_za_tile = context.getSourceTile(self.sat_za, target_rectangle)
-        sun_za_tile = context.getSourceTile(self.sun_za, target_rectangle)
-        sat_za_samples = sat_za_tile.getSamplesFloat()
-        sun_za_samples = sun_za_tile.getSamplesFloat()
-        sat_za_data = numpy.array(sat_za_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_deg'])
-        sun_za_data = numpy.array(sun_za_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_deg'])
-        sat_az_tile = context.getSourceTile(self.sat_az, target_rectangle)
-        sat_az_samples = sat_az_tile.getSamplesFloat()
-        sun_az_tile = context.getSourceTile(self.sun_az, target_rectangle)
-        sun_az_samples = sun_az_tile.getSamplesFloat()
-        rel_az_data = numpy.absolute(numpy.array(sat_az_samples, dtype=numpy.float32)
-                                     * float(self.config['scale_factors']['scale_factor_deg']) -
-                                     numpy.array(sun_az_samples, dtype=numpy.float32)
-                                     * float(self.config['scale_factors']['scale_factor_deg']))
-        rel_az_data = rel_az_data * (rel_az_data <= 180) + (360 - rel_az_data) * (rel_az_data > 180)
-        slstr_utils = SlstrUtils()
-        visible_data = slstr_utils.radiance_to_reflectance(visible_data, sun_za_data, self.solar_irr_s2)
-        nir_data = slstr_utils.radiance_to_reflectance(nir_data, sun_za_data, self.solar_irr_s3)
-        return nir_data, rel_az_data, sat_za_data, sun_za_data, visible_data
-
-    def get_geom_data_aatsr(self, context, target_rectangle):
-        sat_za_tile = context.getSourceTile(self.sat_za, target_rectangle)
-        sun_za_tile = context.getSourceTile(self.sun_za, target_rectangle)
-        sat_za_samples = sat_za_tile.getSamplesFloat()
-        sun_za_samples = sun_za_tile.getSamplesFloat()
-        sat_za_data = 90 - numpy.array(sat_za_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_deg'])
-        sun_za_data = 90 - numpy.array(sun_za_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_deg'])
-        sat_az_tile = context.getSourceTile(self.sat_az, target_rectangle)
-        sat_az_samples = sat_az_tile.getSamplesFloat()
-        sun_az_tile = context.getSourceTile(self.sun_az, target_rectangle)
-        sun_az_samples = sun_az_tile.getSamplesFloat()
-        rel_az_data = numpy.absolute(numpy.array(sat_az_samples, dtype=numpy.float32)
-                                     * float(self.config['scale_factors']['scale_factor_deg']) -
-                                     numpy.array(sun_az_samples, dtype=numpy.float32)
-                                     * float(self.config['scale_factors']['scale_factor_deg']))
-        rel_az_data = rel_az_data * (rel_az_data <= 180) + (360 - rel_az_data) * (rel_az_data > 180)
-        return rel_az_data, sat_za_data, sun_za_data
-
-    def get_geom_data_viirs(self, context, target_rectangle):
-        sat_za_tile = context.getSourceTile(self.sat_za, target_rectangle)
-        sun_za_tile = context.getSourceTile(self.sun_za, target_rectangle)
-        sat_za_samples = sat_za_tile.getSamplesFloat()
-        sun_za_samples = sun_za_tile.getSamplesFloat()
-        sat_za_data = numpy.array(sat_za_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_deg'])
-        sun_za_data = numpy.array(sun_za_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_deg'])
-        sat_az_tile = context.getSourceTile(self.sat_az, target_rectangle)
-        sat_az_samples = sat_az_tile.getSamplesFloat()
-        sun_az_tile = context.getSourceTile(self.sun_az, target_rectangle)
-        sun_az_samples = sun_az_tile.getSamplesFloat()
-        rel_az_data = numpy.absolute(numpy.array(sat_az_samples, dtype=numpy.float32)
-                                     * float(self.config['scale_factors']['scale_factor_deg']) -
-                                     numpy.array(sun_az_samples, dtype=numpy.float32)
-                                     * float(self.config['scale_factors']['scale_factor_deg']))
-        rel_az_data = rel_az_data * (rel_az_data <= 180) + (360 - rel_az_data) * (rel_az_data > 180)
-        return rel_az_data, sat_za_data, sun_za_data
-
-    def get_geom_data_avhrr(self, context, data, rel_az_data, sun_za_data, target_rectangle, upper_data):
-        nan_array = numpy.ones(data.shape)
-        nan_array[:] = Float.NaN
-        data = numpy.where(data == 6553.5, nan_array, data)
-        if upper_data is not None:
-            upper_data = numpy.where(data == 6553.5, nan_array, upper_data)
-        sat_za_tile = context.getSourceTile(self.sat_za, target_rectangle)
-        sun_za_tile = context.getSourceTile(self.sun_za, target_rectangle)
-        sat_za_samples = sat_za_tile.getSamplesFloat()
-        sun_za_samples = sun_za_tile.getSamplesFloat()
-        sat_za_data = numpy.array(sat_za_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_deg'])
-        sun_za_data = numpy.array(sun_za_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_deg'])
-        sat_za_data = numpy.where(data == -327.68, nan_array, sat_za_data)
-        rel_az_tile = context.getSourceTile(self.rel_az, target_rectangle)
-        rel_az_samples = rel_az_tile.getSamplesFloat()
-        rel_az_data = numpy.array(rel_az_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_deg'])
-        return data, rel_az_data, sat_za_data, sun_za_data, upper_data
-
-    def get_cmsk_data(self, context, target_rectangle):
-        if self.cmsk_band is not None:
-            cmsk_tile = context.getSourceTile(self.cmsk_band, target_rectangle)
-            cmsk_samples = cmsk_tile.getSamplesFloat()
-            cmsk_data = numpy.array(cmsk_samples, dtype=numpy.float32)
-        else:
-            cmsk_data = None
-        return cmsk_data
-
-    def get_valid_data(self, context, target_rectangle):
-        if self.valid_pixel_band is not None:
-            valid_tile = context.getSourceTile(self.valid_pixel_band, target_rectangle)
-            valid_samples = valid_tile.getSamplesFloat()
-            valid_data = numpy.array(valid_samples, dtype=numpy.float32)
-        else:
-            valid_data = None
-        return valid_data
-
-    def get_lwm_data(self, context, target_rectangle):
-        if self.lwm_band is not None:
-            lwm_tile = context.getSourceTile(self.lwm_band, target_rectangle)
-            lwm_samples = lwm_tile.getSamplesFloat()
-            lwm_data = numpy.array(lwm_samples, dtype=numpy.float32)
-        else:
-            lwm_data = None
-        return lwm_data
-
-    def get_split_window_band_data(self, context, target_rectangle):
-        data_tile = context.getSourceTile(self.lower_band, target_rectangle)
-        upper_tile = context.getSourceTile(self.upper_band, target_rectangle)
-        visible_tile = context.getSourceTile(self.visible_band, target_rectangle)
-        nir_tile = context.getSourceTile(self.nir_band, target_rectangle)
-        bt3_tile = context.getSourceTile(self.bt3_band, target_rectangle)
-        data_samples = data_tile.getSamplesFloat()
-        upper_samples = upper_tile.getSamplesFloat()
-        visible_sample = visible_tile.getSamplesFloat()
-        nir_sample = nir_tile.getSamplesFloat()
-        bt3_sample = bt3_tile.getSamplesFloat()
-        # Convert the data into numpy data. It is easier and faster to work with
-        data = numpy.array(data_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_K'])
-        upper_data = numpy.array(upper_samples, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_K'])
-        visible_data = numpy.array(visible_sample, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_rf'])
-        nir_data = numpy.array(nir_sample, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_rf'])
-        bt3_data = numpy.array(bt3_sample, dtype=numpy.float32) * float(
-            self.config['scale_factors']['scale_factor_K'])
-        return bt3_data, data, nir_data, upper_data, visible_data
-
     def configure_target_product(self, context, ref_image):
         musenalp_product = snappy.Product('py_MuSenALP', 'py_MuSenALP', self.width, self.height)
         # geocoding from reference picture?
@@ -553,10 +510,10 @@ class MuSenALPOp:
         flag_q8 = lswt_flag_coding.addFlag("Spatial_STDV_gr_3", 256,
                                            "Valid pixels only those which sourrounding pixels have a SDEV from " +
                                            "lower 3°C according to Schwab et al 1999")
-        flag_q9 = lswt_flag_coding.addFlag("SZA_gr_45", 512, "Use only pixels for satelite zenith angle <= 45°")
-        flag_q10 = lswt_flag_coding.addFlag("Spatial_STDV_gr_1.5", 1024,
-                                            "Valid pixels only those which sourrounding pixels have a SDEV from" +
-                                            " lower 1.5°C according to Schwab et al 1999")
+        flag_q9 = lswt_flag_coding.addFlag("Spatial_STDV_gr_1.5", 512,
+                                           "Valid pixels only those which sourrounding pixels have a SDEV from" +
+                                           " lower 1.5°C according to Schwab et al 1999")
+        flag_q10 = lswt_flag_coding.addFlag("SZA_gr_45", 1024, "Use only pixels for satelite zenith angle <= 45°")
         flag_q11 = lswt_flag_coding.addFlag("Glint_Angle_le_36", 2048, "Use only pixels with glint angle > 36°")
         # for levels 0 to 6, not working with the masks!
         # flag_q0 = lswt_flag_coding.addFlag("Q0", 0, "Quality level 0")
@@ -594,72 +551,6 @@ class MuSenALPOp:
         musenalp_product.addMask('mask_' + flag_q11.getName(), 'lswt_flags.' + flag_q11.getName(),
                                  flag_q11.getDescription(), Color(255, 0, 127), 0.3)
 
-    def get_geo_data(self, context):
-        self.get_geo_data_avhrr(context)
-        self.get_geo_data_slstr()
-        self.get_geo_data_tirs()
-        self.get_geo_data_viirs()
-        self.get_geo_data_aatsr()
-
-    def get_geo_data_viirs(self):
-        if self.sattype == 'VIIRS':
-            self.sat_za = self._get_band(self.source_product, self.config['angles']['sat_za'])
-            self.sun_za = self._get_band(self.source_product, self.config['angles']['sun_za'])
-            self.sat_az = self._get_band(self.source_product, self.config['angles']['sat_az'])
-            self.sun_az = self._get_band(self.source_product, self.config['angles']['sun_az'])
-
-    def get_geo_data_tirs(self):
-        if self.sattype == 'TIRS':
-            tirs_utils = TirsUtils()
-            lut = tirs_utils.create_wrs_lut()
-            path = self.source_product.getMetadataRoot().getElement('L1_METADATA_FILE').getElement(
-                'PRODUCT_METADATA').getAttributeDouble('WRS_PATH')
-            row = self.source_product.getMetadataRoot().getElement('L1_METADATA_FILE').getElement(
-                'PRODUCT_METADATA').getAttributeDouble('WRS_ROW')
-            corners = tirs_utils.get_corners(lut, path, row)
-            self.azimuth = tirs_utils.calculate_sat_azimuth(corners)
-
-    def get_geo_data_slstr(self):
-        if self.sattype == 'SLSTR':
-            self.sat_za = self.source_product.getTiePointGrid(self.config['angles']['sat_za'])
-            self.sun_za = self.source_product.getTiePointGrid(self.config['angles']['sun_za'])
-            self.sat_az = self.source_product.getTiePointGrid(self.config['angles']['sat_az'])
-            self.sun_az = self.source_product.getTiePointGrid(self.config['angles']['sun_az'])
-
-            product_s2 = None
-            product_s3 = None
-            if self.file_location is not None and 'xfdumanifest.xml' in self.file_location:
-                product_s2 = snappy.ProductIO.readProduct(
-                    self.file_location.replace('xfdumanifest.xml', 'S2_quality_an.nc'))
-                product_s3 = snappy.ProductIO.readProduct(
-                    self.file_location.replace('xfdumanifest.xml', 'S3_quality_an.nc'))
-            if product_s2 is not None:
-                self.solar_irr_s2 = product_s2.getMetadataRoot().getElement('Variable_Attributes').getElement(
-                    'S2_solar_irradiance_an').getElement('Values').getAttributeDouble('data')
-            else:
-                self.solar_irr_s2 = 1525.94
-            if product_s3 is not None:
-                self.solar_irr_s3 = product_s3.getMetadataRoot().getElement('Variable_Attributes').getElement(
-                    'S3_solar_irradiance_an').getElement('Values').getAttributeDouble('data')
-            else:
-                self.solar_irr_s3 = 956.17
-
-    def get_geo_data_aatsr(self):
-        if self.sattype == 'AATSR':
-            self.sat_za = self.source_product.getTiePointGrid(self.config['angles']['sat_za'])
-            self.sun_za = self.source_product.getTiePointGrid(self.config['angles']['sun_za'])
-            self.sat_az = self.source_product.getTiePointGrid(self.config['angles']['sat_az'])
-            self.sun_az = self.source_product.getTiePointGrid(self.config['angles']['sun_az'])
-
-    def get_geo_data_avhrr(self, context):
-        if self.sattype == 'AVHRR':
-            geom = snappy.ProductIO.readProduct(str(context.getParameter('geometricData')))
-            if self.cut:
-                geom = self.utils.cut_product(geom, self.range)
-            self.sat_za = self._get_band(geom, self.config['angles']['sat_za'])
-            self.sun_za = self._get_band(geom, self.config['angles']['sun_za'])
-            self.rel_az = self._get_band(geom, self.config['angles']['rel_az'])
-
     def get_valid_pixel_band(self, context):
         expression = str(context.getParameter('validPixelExpression'))
         if expression != 'None' and expression != '':
@@ -715,6 +606,42 @@ class MuSenALPOp:
                                                        self.source_product.getSceneRasterHeight(), lwm_band_param)
                     self.lwm_band.setOwner(self.source_product)
 
+    def get_water_index(self, context):
+        # the land/water mask is read once in blocks of rows and kept as spans of water pixels. Land pixels then only
+        # get the land bit, so the index is only used if their lswt is masked anyway
+        if not context.getParameter('waterPixelsOnly') or not context.getParameter('maskBeforeCalculation') or \
+                self.lwm_band is None or not self.needs_input('lwm'):
+            return
+        spans = []
+        for y in range(0, self.height, WATER_INDEX_ROWS):
+            rows = min(WATER_INDEX_ROWS, self.height - y)
+            lwm_data = numpy.zeros(rows * self.width, dtype=numpy.float32)
+            self.lwm_band.readPixels(0, y, self.width, rows, lwm_data)
+            spans.append(water_index.find_spans(lwm_data.reshape((rows, self.width)) != 0, y))
+        self.water_index = water_index.WaterIndex(self.width, self.height,
+                                                  *[numpy.concatenate(values) for values in zip(*spans)])
+
+    def get_read_threads(self, context):
+        read_threads = context.getParameter('readThreads')
+        if read_threads > 1:
+            self.read_pool = ThreadPoolExecutor(max_workers=read_threads)
+        if context.getParameter('prefetchTiles'):
+            # a single thread, it only waits for the read threads and so never blocks them
+            self.prefetch_pool = ThreadPoolExecutor(max_workers=1)
+
+    def get_sensor(self, context):
+        # the bands and calibration constants of the sensor are looked up once, the tiles only read raw samples
+        geometry = None
+        if self.sattype == 'AVHRR':
+            geometry = snappy.ProductIO.readProduct(str(context.getParameter('geometricData')))
+            if self.cut:
+                geometry = self.utils.cut_product(geometry, self.range)
+        self.sensor = sensors.create(self.sattype, self.config)
+        self.sensor.open(self.source_product, self.algorithm_parameter, geometry, self.file_location)
+        inputs = set(['bt4', 'bt5', 'sat_za'] + [name for name in ('bt3', 'rf1', 'rf2', 'sun_za', 'rel_az')
+                                                 if self.needs_input(name)])
+        self.tile_reads = self.sensor.get_reads(inputs)
+
     def get_reg_image(self, context):
         ref_image = None
         if self.sattype == 'AVHRR':
@@ -725,18 +652,6 @@ class MuSenALPOp:
 
         return ref_image
 
-    def get_mono_window_bands(self, context):
-        self.mono_band = self.source_product.getBand(self.config['bands']['mono_band'])
-        self.visible_band = self._get_band(self.source_product, self.config['bands']['visible_band'])
-        self.nir_band = self._get_band(self.source_product, self.config['bands']['nir_band'])
-
-    def get_split_window_bands(self, context):
-        self.lower_band = self.source_product.getBand(self.config['bands']['lower_band'])
-        self.upper_band = self.source_product.getBand(self.config['bands']['upper_band'])
-        self.visible_band = self._get_band(self.source_product, self.config['bands']['visible_band'])
-        self.nir_band = self._get_band(self.source_product, self.config['bands']['nir_band'])
-        self.bt3_band = self._get_band(self.source_product, self.config['bands']['lowest_band'])
-
     def get_lut_info(self, context):
         start_time = self.source_product.getStartTime()
         if start_time is None:
@@ -752,12 +667,52 @@ class MuSenALPOp:
         else:
             self.elevation = context.getParameter('height')
 
+    def get_lut_grid_step(self, context):
+        # the mono-window coefficients are evaluated on a coarse grid and interpolated bilinearly to the pixels,
+        # by default on the tie-point grid of the satellite zenith angle
+        self.algo.scene_size = (self.height, self.width)
+        step = context.getParameter('lutGridStep')
+        if step > 0:
+            self.algo.grid_step = (step, step)
+        elif self.sensor.bands.get('sat_za') is not None:
+            tie_point_grid = self.source_product.getTiePointGrid(self.sensor.bands['sat_za'].getName())
+            if tie_point_grid is not None:
+                self.algo.grid_step = (max(1, int(round(tie_point_grid.getSubSamplingY()))),
+                                       max(1, int(round(tie_point_grid.getSubSamplingX()))))
+
+    def get_quality_tests(self, context):
+        # comma separated names of the quality tests (quality_tests.TESTS) that do not run
+        disabled = context.getParameter('disabledQualityTests')
+        if disabled:
+            self.algo.disabled_tests = [name.strip() for name in str(disabled).split(',') if name.strip() != '']
+        # both algorithms flag with the standard scheme
+        tests = quality_tests.QualityTests(quality_tests.STANDARD_SCHEME, self.algo.disabled_tests)
+        self.quality_inputs = tests.get_inputs()
+
+    def get_statistics(self, context):
+        # the LUT hit ratios and the run time of the quality tests are only collected if they are logged. Without a
+        # configured logging handler the statistics are written to stderr
+        self.log_statistics = bool(context.getParameter('logStatistics'))
+        if not self.log_statistics:
+            return
+        self.lut_hit_ratios = []
+        self.algo.timings = quality_tests.QualityTestTimings()
+        if LOGGER.level == logging.NOTSET:
+            LOGGER.setLevel(logging.INFO)
+        if not LOGGER.hasHandlers():
+            LOGGER.addHandler(logging.StreamHandler())
+
+    def needs_input(self, *names):
+        # whether one of the enabled quality tests reads one of the inputs
+        return any(name in self.quality_inputs for name in names)
+
     def get_mono_window_coeff(self, context):
         self.a0_mono = context.getParameter('a0-mono')
         self.a1_mono = context.getParameter('a1-mono')
         if self.a0_mono == 0.0:
             self.needs_lut = True
-        self.algo = lswt_algo.MonoWindowAlgo(self.a0_mono, self.a1_mono, self.needs_lut)
+        self.algo = lswt_algo.MonoWindowAlgo(self.a0_mono, self.a1_mono, self.needs_lut,
+                                             str(context.getParameter('lutInterpolation')), dtype=self.dtype)
 
     def get_split_window_coeff(self, context):
         # algorithm coefficients
@@ -776,7 +731,9 @@ class MuSenALPOp:
             self.a1 = context.getParameter('a1')
             self.a2 = context.getParameter('a2')
             self.a3 = context.getParameter('a3')
-        self.algo = lswt_algo.SplitWindowAlgo(self.a0, self.a1, self.a2, self.a3, self.needs_lut)
+        self.algo = lswt_algo.SplitWindowAlgo(self.a0, self.a1, self.a2, self.a3, self.needs_lut,
+                                              str(context.getParameter('lutInterpolation')),
+                                              context.getParameter('useNumexpr'), self.dtype)
 
     def get_cut_param(self, context):
         if self.cut:
@@ -788,29 +745,33 @@ class MuSenALPOp:
                 self.range = self.utils.get_reference_coordinates(ref, self.poi_x, self.poi_y, self.padding)
 
     def get_config(self):
-        cwd = os.getcwd()
-        self.config.read(
-            [self.sattype + '.ini', cwd + self.sattype + '.ini', os.path.expanduser('~/' + self.sattype + '.ini')])
-        if len(self.config.sections()) == 0:
-            self.config = Config(self.sattype).get_conf()
+        # resolved once per process and sensor, shared by all operator instances
+        self.config = config.load_sensor_config(self.sattype)
 
     def dispose(self, context):
-        pass
+        with self.prefetch_lock:
+            for future in self.prefetched.values():
+                future.cancel()
+            self.prefetched.clear()
+        for pool in (self.prefetch_pool, self.read_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        if not self.log_statistics:
+            return
+        if len(self.lut_hit_ratios) > 0:
+            LOGGER.info('MuSenALP: deduplication saved %.1f %% of the LUT lookups (mean of %d tiles)',
+                        100 * numpy.mean(self.lut_hit_ratios), len(self.lut_hit_ratios))
+        if len(self.skipped_tiles) > 0:
+            LOGGER.info('MuSenALP: skipped %d tiles without valid water pixels', len(self.skipped_tiles))
+        if self.algo is not None and self.algo.timings is not None:
+            for name, seconds, tiles in self.algo.timings.get_report():
+                LOGGER.info('MuSenALP: quality test %s took %.3f s (%d tiles)', name, seconds, tiles)
 
     @staticmethod
     def _get_band(product, name):
-        # Retrieve the band from the product
-        # Some times data is not stored in a band but in a tie-point grid or a mask or a vector data.
-        # To get access to this information other methods are exposed by the product class. Like
-        # getTiePointGridGroup().get('name'), getVectorDataGroup().get('name') or getMaskGroup().get('name')
-        # For bands and tie-point grids a short cut exists. Simply use getBand('name') or getTiePointGrid('name')
-        band = product.getBandGroup().get(name)
-        if not band:
-            raise RuntimeError('Product does not contain a band named', name)
-        return band
+        return sensors.get_band(product, name)
 
-    @staticmethod
-    def add_processor_metadata(context, target_product, source_product):
+    def add_processor_metadata(self, context, target_product, source_product):
         metadata_element = jpy.get_type('org.esa.snap.core.datamodel.MetadataElement')
         meta_elem = metadata_element('MuSenALP')
         meta_elem.setAttributeString('source_product', source_product.getName())
@@ -840,6 +801,28 @@ class MuSenALPOp:
         meta_elem.setAttributeString('algorithm', context.getParameter('algorithm'))
         if context.getParameter('coef-file'):
             meta_elem.setAttributeString('coef-file', str(context.getParameter('coef-file')))
+        meta_elem.setAttributeString('precision', str(context.getParameter('precision')))
+        if context.getParameter('lutInterpolation'):
+            meta_elem.setAttributeString('lutInterpolation', str(context.getParameter('lutInterpolation')))
+        if context.getParameter('lutDeduplication'):
+            meta_elem.setAttributeString('lutDeduplication', 'True')
+            meta_elem.setAttributeDouble('lutResolution', context.getParameter('lutResolution'))
+        if self.needs_lut and self.algorithm_parameter == 'mono-window':
+            meta_elem.setAttributeString('lutGridStep', '%d,%d' % self.algo.grid_step)
+        if context.getParameter('useNumexpr') and lswt_algo.numexpr is not None:
+            meta_elem.setAttributeString('useNumexpr', 'True')
+        meta_elem.setAttributeInt('tileHalo', self.halo)
+        if context.getParameter('flagEarlyOut'):
+            meta_elem.setAttributeString('flagEarlyOut', 'True')
+        if self.water_index is not None:
+            meta_elem.setAttributeString('waterPixelsOnly', 'True')
+        meta_elem.setAttributeInt('readThreads', context.getParameter('readThreads'))
+        if self.prefetch_pool is not None:
+            meta_elem.setAttributeString('prefetchTiles', 'True')
+        if self.zero_copy_write:
+            meta_elem.setAttributeString('zeroCopyWrite', 'True')
+        if len(self.algo.disabled_tests) > 0:
+            meta_elem.setAttributeString('disabledQualityTests', ','.join(self.algo.disabled_tests))
         if context.getParameter('a0'):
             meta_elem.setAttributeDouble('a0', context.getParameter('a0'))
         if context.getParameter('a1'):
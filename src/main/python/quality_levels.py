@@ -0,0 +1,57 @@
+###################################################################################################
+# mapping of the 16 bit quality flag word to a quality level
+#
+# a scheme is declared by a default level and rules (mask, value, level): a flag word matches a rule if
+# flag & mask == value, the last matching rule gives the level. The scheme is compiled once into a table with one
+# entry per flag word, so a tile is mapped with a single gather.
+###################################################################################################
+
+import numpy
+
+ALL_BITS = 0xffff
+
+# lswt_quality_check.QualityCheck: Q0 if one of the lower 8 bits is set, Q1 (worst) to Q8 (best) otherwise
+STANDARD_SCHEME = (0, [(511, 256, 1),
+                       (2047, 1536, 2),
+                       (ALL_BITS, 2560, 3),
+                       (ALL_BITS, 3072, 4),
+                       (ALL_BITS, 2048, 5),
+                       (ALL_BITS, 512, 6),
+                       (ALL_BITS, 1024, 7),
+                       (ALL_BITS, 0, 8)])
+
+# lswt_quality_check_mono.QualityCheckMono
+MONO_SCHEME = (0, [(ALL_BITS, 48, 1),
+                   (ALL_BITS, 32, 2),
+                   (ALL_BITS, 0, 3)])
+
+# lswt_quality_check_idl.QualityCheck: every level requires the tests of the previous one (VZA1, VZA2, glint, std2)
+IDL_SCHEME = (1, [(511, 0, 4),
+                  (511 | 7 << 11, 0, 8),
+                  (511 | 7 << 11 | 7 << 12, 0, 16),
+                  (511 | 7 << 11 | 7 << 12 | 7 << 13, 0, 32),
+                  (511 | 7 << 11 | 7 << 12 | 7 << 13 | 7 << 10, 0, 64)])
+
+
+class QualityLevels:
+    def __init__(self, scheme):
+        default, rules = scheme
+        flags = numpy.arange(ALL_BITS + 1, dtype=numpy.uint16)
+        self.table = numpy.full(ALL_BITS + 1, default, dtype=numpy.uint8)
+        for mask, value, level in rules:
+            self.table[(flags & mask) == value] = level
+        # the table converted to the types the levels are requested in
+        self.tables = {self.table.dtype: self.table}
+
+    def get_levels(self, flags, dtype=numpy.float64):
+        dtype = numpy.dtype(dtype)
+        table = self.tables.get(dtype)
+        if table is None:
+            table = self.table.astype(dtype)
+            self.tables[dtype] = table
+        return table.take(numpy.asarray(flags).astype(numpy.uint16, copy=False))
+
+
+STANDARD = QualityLevels(STANDARD_SCHEME)
+MONO = QualityLevels(MONO_SCHEME)
+IDL = QualityLevels(IDL_SCHEME)
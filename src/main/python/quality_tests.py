@@ -0,0 +1,426 @@
+###################################################################################################
+# registry of the quality tests of the LSWT
+#
+# every test is a unit with a name, the inputs it reads and a function that returns the condition under which a pixel
+# is flagged. A scheme assigns a bit to each test and gives the order the tests run in, the QualityCheck classes are
+# the standard, IDL and mono-window schemes. Tests can be disabled by name, their inputs are then not needed at all.
+#
+# the spatial tests (single pixel, standard deviation) only take the pixels into account that have not been flagged
+# before the first of them runs. With early out the expensive tests only run on pixels that are not rejected yet.
+# Tests whose outcome is the same for every pixel of a tile (e.g. daytime tests on a night tile) are decided from the
+# range of the angles over the tile and skipped or filled without being evaluated per pixel. Scene-constant inputs
+# (scalars broadcast to the tile) are passed to the tests as scalars.
+#
+# the inputs can be given for a subset of the tile pixels only (e.g. the water pixels), as vectors with the flat index
+# of each pixel in the tile. The pixels outside the subset count as flagged for the spatial tests.
+###################################################################################################
+
+import threading
+import time
+from collections import namedtuple
+
+import numpy
+
+import window_stats
+
+QFILTER = {'cmask': 7, 'r1lim': 0.005, 'r2lim': 0.1, 'r21lim': 1.0, 'T4lim': 263.15,
+           'lswtLim': [268.15, 308.15], 'vzaLim': 55., 'georefRel': 1.8, 'georefRel2': 1.8, 'std1': 3.,
+           'std2': 1.5, 'VZA2': 45., 'sunglint': 36., 'ircldtshld': 1.0, 'strattshld': -0.6,
+           'cloudTEST': 0}
+
+# the n x n window of the spatial tests, including the central pixel
+WINDOW = 3
+
+# degrees the angles of a tile have to be away from the glint limit to decide the glint test for the whole tile
+GLINT_MARGIN = 1e-6
+
+QualityTest = namedtuple('QualityTest', ['name', 'inputs', 'function', 'spatial', 'expensive', 'decide'])
+
+# tests: (name, bit value) in the order they run, reject_mask: the bits that give the lowest quality level on their own
+Scheme = namedtuple('Scheme', ['tests', 'reject_mask'])
+
+TESTS = {}
+
+
+def register(name, inputs, spatial=False, expensive=False, decide=None):
+    # the function is called with the tile and the pixels (index arrays, None for all) it is evaluated on. decide is
+    # called with the tile before, it returns False if the test flags no pixel, True if it flags every pixel and None
+    # if the test has to be evaluated
+    def add(function):
+        TESTS[name] = QualityTest(name, tuple(inputs), function, spatial, expensive, decide)
+        return function
+
+    return add
+
+
+###############################################################
+# decisions for the whole tile
+###############################################################
+def day_only(tile):
+    # the daytime tests flag no pixel when the sun is below the horizon on the whole tile
+    if tile.get_range('sun_za')[0] >= 90:
+        return False
+    return None
+
+
+def night_only(tile):
+    if tile.get_range('sun_za')[1] <= 85:
+        return False
+    return None
+
+
+def above_view_zenith(limit):
+    def decide(tile):
+        low, high, finite = tile.get_range('sat_za')
+        if high <= tile.qfilter[limit]:
+            return False
+        # NaN angles are never flagged
+        if low > tile.qfilter[limit] and finite:
+            return True
+        return None
+
+    return decide
+
+
+def glint_outside(tile):
+    # whatever the azimuth, the glint angle lies between 90 - (sat_za + sun_za) and 90 - |sat_za - sun_za|
+    sat_low, sat_high, sat_finite = tile.get_range('sat_za')
+    sun_low, sun_high, sun_finite = tile.get_range('sun_za')
+    if not (sat_low >= 0 and sun_low >= 0 and sat_high <= 180 and sun_high <= 180):
+        return None
+    limit = 90 - tile.qfilter['sunglint']
+    if sat_high + sun_high < limit - GLINT_MARGIN:
+        return False
+    if max(sun_low - sat_high, sat_low - sun_high) > limit + GLINT_MARGIN and sat_finite and sun_finite and \
+            tile.get_range('rel_az')[2]:
+        return True
+    return None
+
+
+def no_good_pixels(tile):
+    # without good pixels every pixel is a single pixel and there is no deviation
+    if not tile.good_pix.any():
+        return True
+    if tile.good_pix.all() and tile.index is None:
+        return False
+    return None
+
+
+def no_deviation(tile):
+    if not tile.good_pix.any():
+        return False
+    return None
+
+
+###############################################################
+# Applying Cloud Mask
+###############################################################
+@register('cloud_mask', ['cmsk'])
+def cloud_mask(tile, pixels):
+    cmsk = tile.get('cmsk', pixels)
+    if cmsk is None:
+        return True
+    if tile.sattype == 'AVHRR':
+        return numpy.logical_or(cmsk >= tile.qfilter['cmask'], cmsk == 0)
+    return cmsk != 0
+
+
+###############################################################
+# VISIBLE CLOUD THRESHOLD TEST # reflectance higher than 0.1 then
+# do not compute a SST (BoM)
+###############################################################
+@register('vis_cloud', ['rf2', 'sun_za'], decide=day_only)
+def vis_cloud(tile, pixels):
+    return numpy.logical_and(tile.get('rf2', pixels) >= tile.qfilter['r2lim'], tile.get('sun_za', pixels) < 90)
+
+
+###############################################################
+# NIR/VISIBLE RATIO TEST # ration higher than 1.0 then
+# do not compute a SST (BoM)
+###############################################################
+@register('ratio', ['rf1', 'rf2', 'sun_za'], expensive=True, decide=day_only)
+def ratio(tile, pixels):
+    # decided per pixel (day only) instead of per tile, so that the flags do not depend on the tile size
+    r21 = tile.get('rf2', pixels) / tile.get('rf1', pixels)
+    return numpy.logical_and(r21 > tile.qfilter['r21lim'], tile.get('sun_za', pixels) < 90)
+
+
+###############################################################
+# Applying Sea and Lake Mask
+###############################################################
+@register('land_water', ['lwm'])
+def land_water(tile, pixels):
+    lwm = tile.get('lwm', pixels)
+    if lwm is None:
+        return True
+    return lwm == 0
+
+
+###############################################################
+# GROSS IR TEST / VALID VIS TEST # if the channel 4 temperature is less than  #10° then
+# do not compute a SST (BOM)
+###############################################################
+@register('gross_ir', ['bt4', 'rf1', 'sun_za'], decide=day_only)
+def gross_ir(tile, pixels):
+    return numpy.logical_and(numpy.logical_or(tile.get('bt4', pixels) <= tile.qfilter['T4lim'],
+                                              tile.get('rf1', pixels) < tile.qfilter['r1lim']),
+                             tile.get('sun_za', pixels) < 90)
+
+
+###############################################################
+# Creating final product, limiting data to -5°C to +35°C
+###############################################################
+@register('range', ['lswt'])
+def lswt_range(tile, pixels):
+    lswt = tile.get('lswt', pixels)
+    return numpy.logical_or(lswt <= tile.qfilter['lswtLim'][0], lswt >= tile.qfilter['lswtLim'][1])
+
+
+###############################################################
+# NIGHTTIME IR CLOUD TEST # if a calculated channel 4 temperature based on the channel 5 value
+# (channel 5 temp * 1.0439 # 11.49) differs from the actual channel 4 temperature by more than
+# 1.0° C then do not compute a SST (BoM)
+###############################################################
+@register('ir_cloud', ['bt4', 'bt5', 'sun_za'], decide=night_only)
+def ir_cloud(tile, pixels):
+    # TODO, GL, this is masking out the LAKES !!!
+    syn_ch4 = (tile.get('bt5', pixels) * 1.0439) - 11.49
+    return numpy.logical_and(numpy.absolute(syn_ch4 - tile.get('bt4', pixels)) >= tile.qfilter['ircldtshld'],
+                             tile.get('sun_za', pixels) > 85)
+
+
+###############################################################
+# NIGHTTIME LOW STRATUS TEST # the difference obtained when subtracting channel 3
+# temperature from channel 5 temperature must be LE #0.6° C. (BoM)
+###############################################################
+@register('low_stratus', ['bt3', 'bt5'])
+def low_stratus(tile, pixels):
+    bt3 = tile.get('bt3', pixels)
+    return numpy.logical_and((tile.get('bt5', pixels) - bt3) > tile.qfilter['strattshld'], bt3 > 100)
+
+
+###############################################################
+# Valid pixels only those which are not completely surrounded by nonvaliddata
+# according to Schwab et al 1999
+###############################################################
+@register('single_pixel', [], spatial=True, decide=no_good_pixels)
+def single_pixel(tile, pixels):
+    # use only those pix with two or more good neighbors
+    neighbors = window_stats.window_count(tile.to_grid(tile.good_pix, False), WINDOW)
+    return tile.select(tile.from_grid(neighbors), pixels) < 2
+
+
+###############################################################
+# Use only pixels for VZA LE 45 deg.
+###############################################################
+@register('vza_55', ['sat_za'], decide=above_view_zenith('vzaLim'))
+def vza_55(tile, pixels):
+    return tile.get('sat_za', pixels) > tile.qfilter['vzaLim']
+
+
+@register('vza_45', ['sat_za'], decide=above_view_zenith('VZA2'))
+def vza_45(tile, pixels):
+    return tile.get('sat_za', pixels) > tile.qfilter['VZA2']
+
+
+###############################################################
+# Valid pixels only those which sourrounding pixels have a SDEV from lower 3°C
+# according to Schwab et al 1999
+###############################################################
+@register('stddev_3', ['lswt'], spatial=True, expensive=True, decide=no_deviation)
+def stddev_3(tile, pixels):
+    lswt_stdv = tile.select(tile.get_stddev(), pixels)
+    return numpy.logical_and(numpy.isfinite(lswt_stdv), lswt_stdv > tile.qfilter['std1'])
+
+
+@register('stddev_1.5', ['lswt'], spatial=True, expensive=True, decide=no_deviation)
+def stddev_15(tile, pixels):
+    lswt_stdv = tile.select(tile.get_stddev(), pixels)
+    return numpy.logical_and(numpy.isfinite(lswt_stdv), lswt_stdv > tile.qfilter['std2'])
+
+
+###############################################################
+# Calculate glint angle
+###############################################################
+@register('glint', ['sat_za', 'sun_za', 'rel_az'], expensive=True, decide=glint_outside)
+def glint(tile, pixels):
+    sat_za = numpy.radians(tile.get('sat_za', pixels))
+    sun_za = numpy.radians(tile.get('sun_za', pixels))
+    rel_az = numpy.radians(tile.get('rel_az', pixels))
+    angle = numpy.arcsin(numpy.sin(sat_za) * numpy.sin(sun_za) * numpy.cos(rel_az) +
+                         numpy.cos(sat_za) * numpy.cos(sun_za))
+    return numpy.degrees(angle) < tile.qfilter['sunglint']
+
+
+# lswt_quality_check.QualityCheck, the bits of the original cascade: SZA > 45 is 1024 and STDV > 1.5 is 512
+STANDARD_SCHEME = Scheme([('cloud_mask', 1), ('vis_cloud', 2), ('land_water', 8), ('gross_ir', 16), ('range', 32),
+                          ('ratio', 4), ('single_pixel', 64), ('vza_55', 128), ('vza_45', 1024), ('stddev_3', 256),
+                          ('stddev_1.5', 512), ('glint', 2048)], 255)
+
+# lswt_quality_check_idl.QualityCheck
+IDL_SCHEME = Scheme([('gross_ir', 1), ('vis_cloud', 2), ('ratio', 4), ('ir_cloud', 8), ('low_stratus', 16),
+                     ('range', 32), ('land_water', 64), ('cloud_mask', 128), ('single_pixel', 256), ('stddev_3', 512),
+                     ('stddev_1.5', 1024), ('vza_55', 2048), ('vza_45', 4096), ('glint', 8192)], 511)
+
+# lswt_quality_check_mono.QualityCheckMono
+MONO_SCHEME = Scheme([('cloud_mask', 1), ('land_water', 2), ('range', 4), ('single_pixel', 8), ('stddev_3', 16),
+                      ('stddev_1.5', 32)], 15)
+
+
+def tile_view(values, shape):
+    # values on the (height, width) tile, or on the (n,) pixels of a subset, without a copy: flat tile samples are
+    # reshaped, arrays of the shape are used as they are and scalars (or single rows and columns) are broadcast as
+    # read-only views. None stays None
+    if values is None:
+        return None
+    values = numpy.asarray(values)
+    if values.ndim == 1 and values.size == numpy.prod(shape):
+        return values.reshape(shape)
+    return numpy.broadcast_to(values, shape)
+
+
+class QualityTests:
+    def __init__(self, scheme, disabled=(), early_out=False, timings=None):
+        unknown = [name for name in disabled if name not in TESTS]
+        if len(unknown) > 0:
+            raise QualityTestException('unknown quality tests: ' + ', '.join(unknown))
+        self.tests = [(TESTS[name], bit) for name, bit in scheme.tests if name not in disabled]
+        self.reject_mask = scheme.reject_mask
+        self.early_out = early_out
+        # run time of the tests, accumulated over all tiles
+        self.timings = timings
+
+    def get_inputs(self):
+        # names of the inputs the enabled tests read
+        return set(name for test, bit in self.tests for name in test.inputs)
+
+    def run(self, inputs, sattype, qfilter=QFILTER, shape=None, index=None):
+        # inputs: 2-d arrays of the same shape by name, they are only read. With index the inputs are vectors of the
+        # tile pixels index (flat indices into the tile of the given shape). The flags are collected in a uint16 word
+        # with bitwise or
+        tile = Tile(inputs, sattype, qfilter, shape, index)
+        quality_flag = numpy.zeros(inputs['lswt'].shape, dtype=numpy.uint16)
+        for test, bit in self.tests:
+            start = time.time()
+            if test.spatial and tile.good_pix is None:
+                # check which pix are good so far
+                tile.good_pix = quality_flag == 0
+            decision = None if test.decide is None else test.decide(tile)
+            if decision is not False:
+                pixels = self.get_candidates(quality_flag) if test.expensive else None
+                if decision:
+                    self.set_flag(quality_flag, True, bit, pixels)
+                elif pixels is None or pixels[0].size != 0:
+                    self.set_flag(quality_flag, test.function(tile, pixels), bit, pixels)
+            if self.timings is not None:
+                self.timings.add(test.name, time.time() - start)
+        return quality_flag
+
+    def get_candidates(self, quality_flag):
+        # with early out the expensive tests only run on pixels that are not rejected yet, None runs them on all
+        if not self.early_out:
+            return None
+        return numpy.logical_not(quality_flag & self.reject_mask).nonzero()
+
+    @staticmethod
+    def set_flag(quality_flag, condition, value, pixels=None):
+        # condition is given for all pixels or only for the pixels (index arrays) it has been evaluated on
+        if pixels is None:
+            numpy.bitwise_or(quality_flag, value, out=quality_flag, where=condition)
+        else:
+            condition = numpy.broadcast_to(condition, pixels[0].shape)
+            pixels = tuple(index[condition] for index in pixels)
+            quality_flag[pixels] |= value
+
+
+class Tile:
+    # the inputs of one tile and the intermediate results the tests share
+    def __init__(self, inputs, sattype, qfilter, shape=None, index=None):
+        self.inputs = inputs
+        self.sattype = sattype
+        self.qfilter = qfilter
+        self.shape = shape
+        self.index = index
+        self.good_pix = None
+        self.lswt_stdv = None
+        self.ranges = {}
+
+    def get(self, name, pixels=None):
+        values = self.inputs.get(name)
+        if values is not None and values.size > 0 and not any(values.strides):
+            # a broadcast scene constant is used as a scalar, the terms the tests derive from it are computed once
+            return values[(0,) * values.ndim]
+        return self.select(values, pixels)
+
+    @staticmethod
+    def select(values, pixels):
+        if values is None or pixels is None:
+            return values
+        return values[pixels]
+
+    def get_range(self, name):
+        # (minimum, maximum, all finite) of an input over the tile, the limits leave NaN out (NaN without values)
+        if name not in self.ranges:
+            values = self.inputs[name]
+            # a broadcast scalar is reduced to its value
+            values = values[tuple(slice(None, 1) if stride == 0 else slice(None) for stride in values.strides)]
+            if values.size == 0:
+                self.ranges[name] = (numpy.nan, numpy.nan, False)
+                return self.ranges[name]
+            low, high = values.min(), values.max()
+            finite = bool(numpy.isfinite(low) and numpy.isfinite(high))
+            if numpy.isnan(low) or numpy.isnan(high):
+                values = values[~numpy.isnan(values)]
+                if values.size == 0:
+                    low, high = numpy.nan, numpy.nan
+                else:
+                    low, high = values.min(), values.max()
+            self.ranges[name] = (low, high, finite)
+        return self.ranges[name]
+
+    def get_stddev(self):
+        # only the good pixels so far contribute to the deviation
+        if self.lswt_stdv is None:
+            self.lswt_stdv = self.from_grid(window_stats.window_statistics(
+                self.to_grid(self.inputs['lswt'], numpy.nan), WINDOW, self.to_grid(self.good_pix, False))[2])
+        return self.lswt_stdv
+
+    def to_grid(self, values, fill):
+        # the values of the subset on the whole tile, fill for the other pixels
+        if self.index is None:
+            return values
+        grid = numpy.full(self.shape[0] * self.shape[1], fill, dtype=values.dtype)
+        grid[self.index] = values
+        return grid.reshape(self.shape)
+
+    def from_grid(self, grid):
+        if self.index is None:
+            return grid
+        return grid.reshape(-1)[self.index]
+
+
+class QualityTestTimings:
+    # run time per test, shared by the threads that compute the tiles
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = {}
+        self.calls = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def get_report(self):
+        # (name, seconds, number of tiles) sorted by run time
+        with self.lock:
+            return sorted([(name, self.seconds[name], self.calls[name]) for name in self.seconds],
+                          key=lambda item: -item[1])
+
+
+class QualityTestException(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
@@ -0,0 +1,242 @@
+###################################################################################################
+# per-sensor adapters
+#
+# an adapter looks up the source bands of a sensor and reads its calibration constants once when the operator is
+# initialized. For every tile only the raw samples are read and calibrate converts them with numpy: brightness
+# temperatures in K, reflectances and angles in degree. The inputs are named like the inputs of the quality tests:
+# bt4 (lower split-window band or mono-window band), bt5, bt3, rf1, rf2, sat_za, sun_za, rel_az; the raw azimuth
+# angles of the sensors without a relative azimuth band are sat_az and sun_az.
+###################################################################################################
+
+import numpy
+import snappy
+
+import tile_io
+from slstr_utils import SlstrUtils
+from tirs_utils import TirsUtils
+
+INPUTS = ('bt4', 'bt5', 'bt3', 'rf1', 'rf2', 'sat_za', 'sun_za', 'rel_az')
+
+
+def get_band(product, name):
+    # Retrieve the band from the product
+    # Some times data is not stored in a band but in a tie-point grid or a mask or a vector data.
+    # To get access to this information other methods are exposed by the product class. Like
+    # getTiePointGridGroup().get('name'), getVectorDataGroup().get('name') or getMaskGroup().get('name')
+    # For bands and tie-point grids a short cut exists. Simply use getBand('name') or getTiePointGrid('name')
+    band = product.getBandGroup().get(name)
+    if not band:
+        raise RuntimeError('Product does not contain a band named', name)
+    return band
+
+
+def relative_azimuth(sat_az, sun_az):
+    rel_az = numpy.absolute(sat_az - sun_az)
+    return rel_az * (rel_az <= 180) + (360 - rel_az) * (rel_az > 180)
+
+
+def create(sattype, config):
+    if sattype not in SENSORS:
+        raise SensorException('Unknown sensor ' + str(sattype))
+    return SENSORS[sattype](config)
+
+
+class Sensor:
+    def __init__(self, config):
+        # config: the config.SensorConfig of the sensor
+        self.config = config
+        self.scale_k = config.scale_factor_k
+        self.scale_deg = config.scale_factor_deg
+        self.scale_rf = config.scale_rf
+        # source bands and tie-point grids of the raw inputs
+        self.bands = {}
+
+    def open(self, product, algorithm, geometry=None, file_location=None):
+        # product: the (resampled and cut) source product, geometry: the product with the angles if it is separate
+        bands = self.config.bands
+        if algorithm == 'split-window':
+            self.bands['bt4'] = product.getBand(bands.lower_band)
+            self.bands['bt5'] = product.getBand(bands.upper_band)
+            self.bands['bt3'] = get_band(product, bands.lowest_band)
+        else:
+            self.bands['bt4'] = product.getBand(bands.mono_band)
+        self.bands['rf1'] = get_band(product, bands.visible_band)
+        self.bands['rf2'] = get_band(product, bands.nir_band)
+        self.open_angles(product if geometry is None else geometry, file_location)
+
+    def open_angles(self, product, file_location):
+        for name in ('sat_za', 'sun_za', 'sat_az', 'sun_az'):
+            self.bands[name] = product.getTiePointGrid(getattr(self.config.angles, name))
+
+    def get_reads(self, inputs):
+        # raw inputs read per tile for the calibrated inputs
+        reads = set(name for name in inputs if self.bands.get(name) is not None)
+        if 'rel_az' in inputs and 'rel_az' not in reads:
+            reads.update(name for name in ('sat_az', 'sun_az') if self.bands.get(name) is not None)
+        return reads
+
+    def get_source_bands(self, reads):
+        # the source bands and tie-point grids of the raw inputs by name
+        return dict((name, self.bands[name]) for name in reads)
+
+    def read(self, context, rectangle, reads, buffers=None, executor=None):
+        # buffers: tile_io.TileBuffers the samples are read into, the arrays are overwritten by the next tile
+        return tile_io.read_tiles(context, rectangle, self.get_source_bands(reads), buffers, executor)
+
+    def calibrate(self, tile):
+        # the raw samples of a tile to physical values, inputs that have not been read are None. The samples are
+        # scaled in place, the arrays of the tile are not used after calibrating
+        values = dict.fromkeys(INPUTS)
+        for names, scale in [(('bt4', 'bt5', 'bt3'), self.scale_k), (('rf1', 'rf2'), self.scale_rf),
+                             (('sat_za', 'sun_za', 'rel_az'), self.scale_deg)]:
+            for name in names:
+                if name in tile:
+                    values[name] = tile[name] if scale == 1 else numpy.multiply(tile[name], scale, out=tile[name])
+        if values['rel_az'] is None and 'sat_az' in tile and 'sun_az' in tile:
+            values['rel_az'] = relative_azimuth(tile['sat_az'] * self.scale_deg, tile['sun_az'] * self.scale_deg)
+        return values
+
+    def get_cloudy(self, cmsk_data):
+        # pixels of the cloud mask that are masked before the calculation
+        return cmsk_data != 0
+
+
+class AvhrrSensor(Sensor):
+    def open_angles(self, product, file_location):
+        # the angles are bands of the separate geometry product
+        for name in ('sat_za', 'sun_za', 'rel_az'):
+            self.bands[name] = get_band(product, getattr(self.config.angles, name))
+
+    def calibrate(self, tile):
+        values = Sensor.calibrate(self, tile)
+        # the fill values of the brightness temperatures (65535 x 0.1 K) and of the satellite zenith angle
+        # (-32768 x 0.01 deg) are set to NaN in place, in the type of the tile
+        for name, fill_value in [('bt4', 6553.5), ('bt5', 6553.5), ('bt3', 6553.5), ('sat_za', -327.68)]:
+            if values[name] is not None:
+                values[name][values[name] == values[name].dtype.type(fill_value)] = numpy.nan
+        return values
+
+    def get_cloudy(self, cmsk_data):
+        return numpy.logical_or(cmsk_data >= 7, cmsk_data == 0)
+
+
+class SlstrSensor(Sensor):
+    def __init__(self, config):
+        Sensor.__init__(self, config)
+        # without a manifest the irradiances are unknown and the reflectances are not finite
+        self.solar_irr_s2 = 0.0
+        self.solar_irr_s3 = 0.0
+
+    def open_angles(self, product, file_location):
+        Sensor.open_angles(self, product, file_location)
+        # the solar irradiances are read from the quality products next to the manifest, the nominal values are used
+        # if they do not exist
+        if file_location is not None and 'xfdumanifest.xml' in file_location:
+            product_s2 = snappy.ProductIO.readProduct(file_location.replace('xfdumanifest.xml', 'S2_quality_an.nc'))
+            product_s3 = snappy.ProductIO.readProduct(file_location.replace('xfdumanifest.xml', 'S3_quality_an.nc'))
+            if product_s2 is not None:
+                self.solar_irr_s2 = product_s2.getMetadataRoot().getElement('Variable_Attributes').getElement(
+                    'S2_solar_irradiance_an').getElement('Values').getAttributeDouble('data')
+            else:
+                self.solar_irr_s2 = 1525.94
+            if product_s3 is not None:
+                self.solar_irr_s3 = product_s3.getMetadataRoot().getElement('Variable_Attributes').getElement(
+                    'S3_solar_irradiance_an').getElement('Values').getAttributeDouble('data')
+            else:
+                self.solar_irr_s3 = 956.17
+
+    def get_reads(self, inputs):
+        # the reflectances are computed with the sun zenith angle
+        reads = Sensor.get_reads(self, inputs)
+        if 'rf1' in reads or 'rf2' in reads:
+            reads.add('sun_za')
+        return reads
+
+    def calibrate(self, tile):
+        values = Sensor.calibrate(self, tile)
+        slstr_utils = SlstrUtils()
+        if values['rf1'] is not None:
+            values['rf1'] = slstr_utils.radiance_to_reflectance(values['rf1'], values['sun_za'], self.solar_irr_s2)
+        if values['rf2'] is not None:
+            values['rf2'] = slstr_utils.radiance_to_reflectance(values['rf2'], values['sun_za'], self.solar_irr_s3)
+        return values
+
+
+class AatsrSensor(Sensor):
+    def calibrate(self, tile):
+        # the tie-point grids are elevation angles
+        values = Sensor.calibrate(self, tile)
+        for name in ('sat_za', 'sun_za'):
+            if values[name] is not None:
+                values[name] = 90 - values[name]
+        return values
+
+
+class ViirsSensor(Sensor):
+    def open_angles(self, product, file_location):
+        for name in ('sat_za', 'sun_za', 'sat_az', 'sun_az'):
+            self.bands[name] = get_band(product, getattr(self.config.angles, name))
+
+
+class TirsSensor(Sensor):
+    def __init__(self, config):
+        Sensor.__init__(self, config)
+        self.k1 = 0.0
+        self.k2 = 0.0
+        # RADIANCE_MULT, RADIANCE_ADD, REFLECTANCE_MULT, REFLECTANCE_ADD of the visible and the nir band
+        self.rescaling = {}
+        self.roll_angle = 0.0
+        self.sun_elevation = 0.0
+        self.sun_azimuth = 0.0
+        self.sat_azimuth = 0.0
+
+    def open_angles(self, product, file_location):
+        # the angles and the calibration constants are scene constants of the metadata
+        metadata = product.getMetadataRoot().getElement('L1_METADATA_FILE')
+        constants = metadata.getElement('TIRS_THERMAL_CONSTANTS')
+        self.k1 = constants.getAttributeDouble('K1_CONSTANT_BAND_10')
+        self.k2 = constants.getAttributeDouble('K2_CONSTANT_BAND_10')
+        rescaling = metadata.getElement('RADIOMETRIC_RESCALING')
+        for name, band in [('rf1', 4), ('rf2', 5)]:
+            self.rescaling[name] = tuple(rescaling.getAttributeDouble(attribute + '_BAND_' + str(band)) for attribute in
+                                         ('RADIANCE_MULT', 'RADIANCE_ADD', 'REFLECTANCE_MULT', 'REFLECTANCE_ADD'))
+        attributes = metadata.getElement('IMAGE_ATTRIBUTES')
+        angles = self.config.angles
+        self.roll_angle = attributes.getAttributeDouble(angles.sat_za)
+        self.sun_elevation = attributes.getAttributeDouble(angles.sun_za)
+        self.sun_azimuth = attributes.getAttributeDouble(angles.sun_az)
+        tirs_utils = TirsUtils()
+        product_metadata = metadata.getElement('PRODUCT_METADATA')
+        corners = tirs_utils.get_corners(tirs_utils.create_wrs_lut(), product_metadata.getAttributeDouble('WRS_PATH'),
+                                         product_metadata.getAttributeDouble('WRS_ROW'))
+        self.sat_azimuth = tirs_utils.calculate_sat_azimuth(corners)
+
+    def calibrate(self, tile):
+        values = Sensor.calibrate(self, tile)
+        tirs_utils = TirsUtils()
+        for name in ('bt4', 'bt5'):
+            if values[name] is not None:
+                values[name] = tirs_utils.radiance_to_kelvin(values[name], self.k1, self.k2)
+        for name in ('rf1', 'rf2'):
+            if values[name] is not None:
+                # the sine of the sun elevation is a float64 scalar, the reflectances keep the type of the tile
+                values[name] = tirs_utils.radiance_to_reflectance(
+                    values[name], *(self.rescaling[name] + (self.sun_elevation,))).astype(tile[name].dtype, copy=False)
+        # the angles are constant for the scene, they are Python floats that the algorithm and the quality check
+        # broadcast. Unlike numpy.float64 scalars they do not promote float32 tiles
+        values['sat_za'] = float(self.roll_angle)
+        values['sun_za'] = 90 - float(self.sun_elevation)
+        values['rel_az'] = float(relative_azimuth(float(self.sat_azimuth), float(self.sun_azimuth) * self.scale_deg))
+        return values
+
+
+class SensorException(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+SENSORS = {'AVHRR': AvhrrSensor, 'SLSTR': SlstrSensor, 'TIRS': TirsSensor, 'VIIRS': ViirsSensor,
+           'AATSR': AatsrSensor}
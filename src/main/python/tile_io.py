@@ -0,0 +1,128 @@
+###################################################################################################
+# tile I/O between SNAP tiles and numpy
+#
+# getSamplesFloat converts the raster of a tile sample by sample into a new Java float[], which numpy.array copies and
+# the calibration copies again. read_samples views the raw data buffer of the tile instead and converts it in one step
+# into a float32 buffer that is reused by the next tile. write_samples sets the results with setSamples. With zero_copy
+# it copies them into the data buffer of the target tile in the type of its band instead; this relies on jpy writing
+# the buffer back to the Java array if it handed out a copy, so it is only used if it is asked for.
+# A tile whose data buffer cannot be viewed from Python (log-scaled bands, read-only buffers) falls back to
+# getSamplesFloat and setSamples.
+# read_tiles reads the source tiles of several bands, concurrently if it is given a thread pool: getSourceTile computes
+# virtual bands and interpolates tie-point grids on demand.
+###################################################################################################
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+
+def get_raster_view(tile, writable=False):
+    # the samples of the tile rectangle in the raw data buffer as a 2-d numpy view in the type of the band, e.g. uint16
+    # for the Java short[] of an unsigned band. None if the buffer is not accessible
+    data = tile.getDataBuffer()
+    if data is None:
+        return None
+    try:
+        buffer = numpy.frombuffer(data.getElems(), dtype=numpy.dtype(str(data.getTypeString())))
+    except (TypeError, ValueError):
+        return None
+    if writable and not buffer.flags.writeable:
+        return None
+    width = tile.getWidth()
+    height = tile.getHeight()
+    offset = tile.getScanlineOffset()
+    stride = tile.getScanlineStride()
+    if offset + (height - 1) * stride + width > buffer.size:
+        return None
+    return as_strided(buffer[offset:], shape=(height, width), strides=(stride * buffer.itemsize, buffer.itemsize),
+                      writeable=writable)
+
+
+def get_scaling(tile):
+    # factor and offset of the geophysical values of the raw samples, None for log-scaled bands
+    raster = tile.getRasterDataNode()
+    if raster is None or not raster.isScalingApplied():
+        return 1.0, 0.0
+    if raster.isLog10Scaled():
+        return None
+    return raster.getScalingFactor(), raster.getScalingOffset()
+
+
+def read_samples(tile, out=None):
+    # the geophysical samples of the tile rectangle as a flat float32 array. out: a float32 buffer of the size of the
+    # rectangle, it is filled and returned
+    size = tile.getWidth() * tile.getHeight()
+    if out is None:
+        out = numpy.empty(size, dtype=numpy.float32)
+    scaling = get_scaling(tile)
+    view = None if scaling is None else get_raster_view(tile)
+    if view is None:
+        samples = tile.getSamplesFloat()
+        try:
+            out[:] = numpy.frombuffer(samples, dtype=numpy.float32)
+        except (TypeError, ValueError):
+            out[:] = numpy.array(samples, dtype=numpy.float32)
+        return out
+    values = out.reshape(view.shape)
+    factor, offset = scaling
+    if factor == 1.0:
+        numpy.copyto(values, view, casting='unsafe')
+    else:
+        numpy.multiply(view, factor, out=values, casting='unsafe')
+    if offset != 0.0:
+        values += offset
+    return out
+
+
+def read_tiles(context, rectangle, bands, buffers=None, executor=None):
+    # the samples of the source tiles of bands (band by name, None for bands that are not read) by name.
+    # buffers: TileBuffers the samples are read into, executor: a concurrent.futures pool that reads the tiles
+    size = rectangle.width * rectangle.height
+    reads = [(name, band, None if buffers is None else buffers.get(name, size)) for name, band in bands.items()
+             if band is not None]
+
+    def read(band, out):
+        return read_samples(context.getSourceTile(band, rectangle), out)
+
+    if executor is None or len(reads) < 2:
+        return dict((name, read(band, out)) for name, band, out in reads)
+    futures = [(name, executor.submit(read, band, out)) for name, band, out in reads]
+    return dict((name, future.result()) for name, future in futures)
+
+
+def next_tile(rectangle, tile_size, scene_size):
+    # x, y, width and height of the tile after rectangle in row order, None after the last tile of the scene
+    x = rectangle.x + rectangle.width
+    y = rectangle.y
+    if x >= scene_size[0]:
+        x = 0
+        y = rectangle.y + rectangle.height
+    if y >= scene_size[1]:
+        return None
+    return x, y, min(tile_size[0], scene_size[0] - x), min(tile_size[1], scene_size[1] - y)
+
+
+def write_samples(tile, values, zero_copy=False):
+    # values: the samples of the tile rectangle, they are converted to the type of the band while they are copied.
+    # zero_copy: the samples are copied into the data buffer of the tile instead of being set with setSamples
+    view = get_raster_view(tile, writable=True) if zero_copy else None
+    if view is None or get_scaling(tile) != (1.0, 0.0):
+        # Java has no unsigned arrays, the integer types are set as int[]
+        tile.setSamples(values if values.dtype.kind == 'f' else values.astype(numpy.int32))
+        return
+    # jpy may hand out a copy of the Java array, it is written back when the view is released on return
+    numpy.copyto(view, numpy.reshape(values, view.shape), casting='unsafe')
+
+
+class TileBuffers:
+    def __init__(self):
+        # flat buffers by name, they are only reallocated for a larger tile or another type
+        self.arrays = {}
+
+    def get(self, name, size, dtype=numpy.float32):
+        # a buffer of size elements, its contents are overwritten by the next tile that gets it
+        buffer = self.arrays.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = numpy.empty(size, dtype=dtype)
+            self.arrays[name] = buffer
+        return buffer[:size]
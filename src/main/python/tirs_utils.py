@@ -1,8 +1,10 @@
+import os
+
 import numpy
 from snappy import jpy
-from wrs import Wrs
 
 # LookupTable = jpy.get_type('org.esa.snap.core.util.math.LookupTable')
+import lookup_table
 from lookup_table import LookupTable
 
 File = jpy.get_type('java.io.File')
@@ -27,6 +29,20 @@ class TirsUtils:
         return reflectance / sin_sun_elevation
 
     def create_wrs_lut(self):
+        # the compiled LUT is memory mapped, it is created from the wrs module once if it does not exist yet
+        filename = lookup_table.lut_path('wrs.lut')
+        if os.path.exists(filename):
+            return LookupTable.read(filename)
+        lut = self.convert_wrs_lut()
+        try:
+            lut.write(filename + '.tmp')
+            os.replace(filename + '.tmp', filename)
+        except (IOError, OSError):
+            pass
+        return lut
+
+    def convert_wrs_lut(self):
+        from wrs import Wrs
         paths = numpy.array(range(1, 234), dtype=numpy.float64)
         rows = numpy.array(range(1, 249), dtype=numpy.float64)
         # points=['CTR LAT', 'CTR LON', 'UL LAT', 'UL LON', 'UR LAT', 'UR LON', 'LL LAT', 'LL LON', 'LR LAT', 'LR LON']
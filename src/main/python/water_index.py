@@ -0,0 +1,56 @@
+###################################################################################################
+# run-length index of the water pixels of a scene
+#
+# the land/water mask is read once and kept as spans of water pixels per row (first and last + 1 column), which for
+# lake scenes takes a small fraction of the memory of the mask. The water pixels of a tile are looked up from the spans
+# of its rows, so a tile can gather them into compact vectors and scatter the results back.
+###################################################################################################
+
+import numpy
+
+
+def find_spans(mask, y=0):
+    # rows, starts and ends of the runs of true pixels of a 2-d mask whose first row is row y of the scene
+    mask = numpy.asarray(mask, dtype=bool)
+    edges = numpy.zeros((mask.shape[0], mask.shape[1] + 2), dtype=numpy.int8)
+    edges[:, 1:-1] = mask
+    edges = numpy.diff(edges, axis=1)
+    # the runs of a row start and end in the same order, nonzero goes through the rows in order
+    rows, starts = numpy.nonzero(edges == 1)
+    ends = numpy.nonzero(edges == -1)[1]
+    return (rows + y).astype(numpy.int32), starts.astype(numpy.int32), ends.astype(numpy.int32)
+
+
+class WaterIndex:
+    def __init__(self, width, height, rows, starts, ends):
+        # rows, starts, ends: the spans sorted by row and column, as returned by find_spans
+        self.width = width
+        self.height = height
+        self.rows = numpy.asarray(rows, dtype=numpy.int32)
+        self.starts = numpy.asarray(starts, dtype=numpy.int32)
+        self.ends = numpy.asarray(ends, dtype=numpy.int32)
+        # the spans of row y are offsets[y]:offsets[y + 1]
+        self.offsets = numpy.searchsorted(self.rows, numpy.arange(height + 1))
+
+    @staticmethod
+    def from_mask(mask):
+        mask = numpy.asarray(mask)
+        return WaterIndex(mask.shape[1], mask.shape[0], *find_spans(mask))
+
+    def get_pixel_count(self):
+        return int(numpy.sum(self.ends - self.starts, dtype=numpy.int64))
+
+    def get_pixels(self, x, y, width, height):
+        # flat indices of the water pixels in the rectangle, in row-major order of the rectangle
+        first = self.offsets[min(max(y, 0), self.height)]
+        last = self.offsets[min(max(y + height, 0), self.height)]
+        starts = numpy.maximum(self.starts[first:last], x)
+        ends = numpy.minimum(self.ends[first:last], x + width)
+        inside = ends > starts
+        rows = self.rows[first:last][inside] - y
+        starts = starts[inside] - x
+        lengths = (ends[inside] - x) - starts
+        # every pixel is the start of its span plus its position in the span
+        span_offsets = numpy.cumsum(lengths) - lengths
+        positions = numpy.arange(numpy.sum(lengths), dtype=numpy.int64) - numpy.repeat(span_offsets, lengths)
+        return numpy.repeat(rows.astype(numpy.int64) * width + starts, lengths) + positions
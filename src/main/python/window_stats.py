@@ -0,0 +1,60 @@
+###################################################################################################
+# statistics over the n x n window around every pixel, used by the neighbour and standard deviation tests of the
+# quality checks
+#
+# the window sums are read from summed-area tables, so the cost per pixel does not depend on the window size. At the
+# borders the tile is mirrored like in ndimage.convolve (mode 'reflect'). Only finite values are taken into account,
+# the values are centred on their mean before they are summed up, which keeps the variance accurate in float32.
+###################################################################################################
+
+import numpy
+
+
+def window_sum(values, n):
+    # sum of the n x n window around every pixel of a 2-d array, integers are summed exactly in int64
+    if n < 1 or n % 2 != 1:
+        raise ValueError('window size must be odd and positive, got ' + str(n))
+    values = numpy.asarray(values)
+    if values.ndim != 2:
+        raise ValueError('expected a 2-d array, got ' + str(values.ndim) + ' dimensions')
+    if values.dtype.kind in 'biu':
+        accumulator = numpy.int64
+    else:
+        accumulator = numpy.float64
+    height, width = values.shape
+    padded = numpy.pad(values, n // 2, mode='symmetric')
+    table = numpy.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=accumulator)
+    numpy.cumsum(numpy.cumsum(padded, axis=0, dtype=accumulator), axis=1, out=table[1:, 1:])
+    return (table[n:n + height, n:n + width] - table[:height, n:n + width] - table[n:n + height, :width] +
+            table[:height, :width])
+
+
+def window_count(mask, n):
+    # number of true pixels in the n x n window around every pixel
+    return window_sum(numpy.asarray(mask, dtype=bool), n)
+
+
+def window_statistics(data, n, valid=None):
+    # count, mean and standard deviation (sample, ddof 1) of the finite values in the n x n window around every pixel,
+    # valid restricts the values further. The mean is NaN without values, the deviation with less than two values.
+    # data is not modified, the mean and deviation are float32 for float32 data and float64 otherwise
+    data = numpy.asarray(data)
+    used = numpy.isfinite(data)
+    if valid is not None:
+        used &= numpy.asarray(valid, dtype=bool)
+    count = window_count(used, n)
+
+    reference = data[used].mean(dtype=numpy.float64) if used.any() else 0.0
+    centred = numpy.where(used, data - reference, 0.0)
+    sums = window_sum(centred, n)
+    squares = window_sum(centred * centred, n)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / count
+        variance = (squares - sums * mean) / (count - 1)
+    # rounding can leave a tiny negative variance for constant windows
+    numpy.maximum(variance, 0.0, out=variance)
+    variance[count < 2] = numpy.nan
+    mean += reference
+
+    dtype = numpy.float32 if data.dtype == numpy.float32 else numpy.float64
+    return count, mean.astype(dtype, copy=False), numpy.sqrt(variance).astype(dtype, copy=False)
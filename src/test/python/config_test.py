@@ -1,5 +1,10 @@
+import configparser
+import os
+import tempfile
 import unittest
+from unittest import mock
 
+import config
 from config import Config
 
 
@@ -16,6 +21,55 @@ class TestConfig(unittest.TestCase):
         self.assertEqual('sat_zenith_tn', config['angles']['sat_za'])
         self.assertEqual(1, float(config['scale_factors']['scale_factor_K']))
 
+    def test_parse_sensor_config(self):
+        for sattype in ['AVHRR', 'SLSTR', 'TIRS', 'VIIRS', 'AATSR']:
+            sensor_config = config.parse_sensor_config(sattype, Config(sattype).get_conf())
+            for algorithm in sensor_config.algorithms:
+                config.check_sensor_config(sensor_config, algorithm)
+        sensor_config = config.parse_sensor_config('AVHRR', Config('AVHRR').get_conf())
+        self.assertEqual('Band_4_BT____[K_x_10]', sensor_config.bands.lower_band)
+        self.assertEqual(0.1, sensor_config.scale_factor_k)
+        self.assertEqual(config.ALGORITHMS, sensor_config.algorithms)
+        self.assertEqual(('split-window',), config.parse_sensor_config('TIRS', Config('TIRS').get_conf()).algorithms)
+
+    def test_parse_sensor_config_ini(self):
+        parser = configparser.ConfigParser()
+        parser.read_dict(Config('SLSTR').get_conf())
+        parser['algorithms']['lswt-algorithm'] = "'both'"
+        parser['bands']['nir_band'] = ''
+        sensor_config = config.parse_sensor_config('SLSTR', parser)
+        self.assertEqual(config.ALGORITHMS, sensor_config.algorithms)
+        self.assertIsNone(sensor_config.bands.nir_band)
+        self.assertRaises(config.ConfigException, config.check_sensor_config, sensor_config, 'split-window')
+
+    def test_parse_sensor_config_errors(self):
+        conf = Config('VIIRS').get_conf()
+        conf['scale_factors'] = dict(conf['scale_factors'], scale_rf='x')
+        self.assertRaises(config.ConfigException, config.parse_sensor_config, 'VIIRS', conf)
+        conf = Config('VIIRS').get_conf()
+        conf['algorithms'] = {'lswt-algorithm': 'dual-window'}
+        self.assertRaises(config.ConfigException, config.parse_sensor_config, 'VIIRS', conf)
+        conf = Config('VIIRS').get_conf()
+        del conf['angles']
+        self.assertRaises(config.ConfigException, config.parse_sensor_config, 'VIIRS', conf)
+
+    def test_read_sensor_config(self):
+        parser = configparser.ConfigParser()
+        parser.read_dict(Config('VIIRS').get_conf())
+        parser['algorithms']['lswt-algorithm'] = "'split-window'"
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'VIIRS.ini'), 'w') as ini:
+                parser.write(ini)
+            # the ini file in the working directory overrides the built-in configuration
+            with mock.patch('os.getcwd', return_value=directory):
+                self.assertEqual(('split-window',), config.read_sensor_config('VIIRS').algorithms)
+        self.assertEqual(config.parse_sensor_config('VIIRS', Config('VIIRS').get_conf()),
+                         config.read_sensor_config('VIIRS'))
+
+    def test_load_sensor_config(self):
+        self.assertIs(config.load_sensor_config('VIIRS'), config.load_sensor_config('VIIRS'))
+
+
 if __name__ == '__main__':
     unittest.main()
 
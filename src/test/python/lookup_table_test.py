@@ -1,7 +1,13 @@
+import os
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
 import numpy
 
+import lookup_table
+import lut_converter
 from lookup_table import LookupTable
 
 
@@ -40,6 +46,23 @@ class TestLookupTable(unittest.TestCase):
         self.assertEqual(0, a)
         self.assertEqual(1, b)
 
+    def test_get_value_threads(self):
+        values = numpy.array(range(0, 120))
+        lut = LookupTable(values, self.lut.dimensions, 2, lookup_table.LINEAR)
+        self.assertEqual(numpy.float32, lut.values.dtype)
+        self.assertTrue(numpy.issubdtype(lut.strides.dtype, numpy.integer))
+        self.assertFalse(hasattr(lut, '__dict__'))
+        first = lut.getValue([1, 1, 1])
+        second = lut.getValue([2, 1, 1])
+        numpy.testing.assert_array_equal([0, 1], first)
+        numpy.testing.assert_array_equal([30, 31], second)
+        # a table is shared by the threads that compute tiles, the lookups do not write into the table
+        coordinates = [[1 + i % 4, 1 + i % 5, 1 + 0.5 * (i % 5)] for i in range(200)]
+        expected = [lut.getValue(c) for c in coordinates]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            result = list(executor.map(lut.getValue, coordinates))
+        numpy.testing.assert_array_equal(expected, result)
+
     def test_get_values_length_2(self):
         dimensions = [numpy.array(range(1, 5), dtype=numpy.float64), numpy.array(range(1, 6), dtype=numpy.float64),
                       numpy.array(range(1, 4), dtype=numpy.float64)]
@@ -63,6 +86,211 @@ class TestLookupTable(unittest.TestCase):
         result = self.lut.getValues([numpy.ones(300000), numpy.ones(300000), numpy.ones(300000)])
         self.assertEqual((2, 300000), result.shape)
 
+    def test_get_values_same_as_get_value(self):
+        dimensions = [numpy.array(range(0, 4), dtype=numpy.float64), numpy.array([400, 800, 1000]),
+                      numpy.array(range(5, 56, 5), dtype=numpy.float64)]
+        values = numpy.random.RandomState(42).uniform(-30, 2, 4 * 3 * 11 * 2)
+        self.lut = LookupTable(values, dimensions, 2)
+        season = numpy.array([[0, 1, 3, 2], [3, -1, 4, 2.5]])
+        height = numpy.array([[400, 380, 800, 1000], [999.5, 1200, 600, 800]])
+        zenith = numpy.array([[5, 4.9, 55, 60], [37.3, 40, 45.0001, 12]], dtype=numpy.float32)
+        result = self.lut.getValues([season, height, zenith])
+        self.assertEqual((2, 2, 4), result.shape)
+        for i in range(0, 2):
+            for j in range(0, 4):
+                expected = self.lut.getValue([season[i, j], height[i, j], zenith[i, j]])
+                self.assertEqual(expected[0], result[0, i, j])
+                self.assertEqual(expected[1], result[1, i, j])
+
+    def test_get_values_linear(self):
+        season = numpy.array(range(0, 4), dtype=numpy.float64)
+        height = numpy.array([400, 800, 1000])
+        zenith = numpy.array(range(5, 56, 5), dtype=numpy.float64)
+        grid = numpy.meshgrid(season, height, zenith, indexing='ij')
+        # a linear function is reproduced exactly by the multilinear interpolation
+        values = 2.0 * grid[0] - 0.01 * grid[1] + 0.5 * grid[2]
+        lut = LookupTable(values.ravel(), [season, height, zenith], 1, lookup_table.LINEAR)
+        coordinates = [numpy.array([0.5, 3, 1.25]), numpy.array([400, 900, 750]), numpy.array([37.5, 55, 6])]
+        result = lut.getValues(coordinates)
+        expected = 2.0 * coordinates[0] - 0.01 * coordinates[1] + 0.5 * coordinates[2]
+        numpy.testing.assert_allclose(expected, result, rtol=1e-6)
+        for i in range(0, 3):
+            self.assertAlmostEqual(result[i], lut.getValue([c[i] for c in coordinates]), 5)
+
+    def test_get_values_linear_length_2(self):
+        values = numpy.array(range(0, 120))
+        lut = LookupTable(values, self.lut.dimensions, 2, lookup_table.LINEAR)
+        result = lut.getValues([numpy.array([1, 1.5]), numpy.array([1, 1]), numpy.array([1, 1])])
+        self.assertEqual((2, 2), result.shape)
+        # half way between season 1 and 2, the season stride is 30
+        numpy.testing.assert_allclose([[0, 15], [1, 16]], result)
+
+    def test_detect_grid(self):
+        self.assertEqual([(1.0, 1.0), (1.0, 1.0), (1.0, 1.0)], self.lut.grids)
+        self.assertIsNone(LookupTable.detectGrid(numpy.array([400, 800, 1000])))
+        self.assertEqual((5.0, 5.0), LookupTable.detectGrid(numpy.array(range(5, 56, 5), dtype=numpy.float64)))
+
+    def test_grid_index_same_as_search(self):
+        partition = numpy.arange(0, 1.05, 0.1)
+        grid = LookupTable.detectGrid(partition)
+        self.assertIsNotNone(grid)
+        coordinates = numpy.concatenate([partition, numpy.random.RandomState(1).uniform(-0.5, 1.5, 1000),
+                                         [numpy.nan]])
+        searched, searched_fractions = self.lut.computeFracIndexes(partition, coordinates)
+        computed, computed_fractions = self.lut.computeFracIndexes(partition, coordinates, grid)
+        numpy.testing.assert_array_equal(searched, computed)
+        numpy.testing.assert_array_equal(searched_fractions, computed_fractions)
+        for coordinate in coordinates:
+            numpy.testing.assert_array_equal(self.lut.computeFracIndex(partition, coordinate),
+                                             self.lut.computeFracIndex(partition, coordinate, grid))
+
+    def test_get_sub_table(self):
+        dimensions = [numpy.array(range(0, 4), dtype=numpy.float64), numpy.array([400, 800, 1000]),
+                      numpy.array(range(5, 56, 5), dtype=numpy.float64)]
+        values = numpy.random.RandomState(7).uniform(-30, 2, 4 * 3 * 11 * 2)
+        zenith = numpy.array([2, 5, 12.5, 37, 55, 70])
+        season = numpy.ones(zenith.shape) * 2
+        height = numpy.ones(zenith.shape) * 900
+        for interpolation in [lookup_table.NEAREST, lookup_table.LINEAR]:
+            lut = LookupTable(values, dimensions, 2, interpolation)
+            curve = lut.getSubTable([2, 900, None])
+            self.assertEqual(1, len(curve.dimensions))
+            numpy.testing.assert_allclose(lut.getValues([season, height, zenith]), curve.getValues([zenith]),
+                                          rtol=1e-6)
+
+    def test_get_values_deduplicated(self):
+        dimensions = [numpy.array(range(0, 4), dtype=numpy.float64), numpy.array([400, 800, 1000]),
+                      numpy.array(range(5, 56, 5), dtype=numpy.float64)]
+        values = numpy.random.RandomState(3).uniform(-30, 2, 4 * 3 * 11 * 2)
+        season = numpy.ones((20, 30)) * 2
+        height = numpy.ones((20, 30)) * 800
+        height[10:, :] = 1000
+        zenith = numpy.repeat(numpy.linspace(10, 40, 30)[numpy.newaxis, :], 20, axis=0)
+        for interpolation in [lookup_table.NEAREST, lookup_table.LINEAR]:
+            lut = LookupTable(values, dimensions, 2, interpolation)
+            hit_ratios = []
+            expected = lut.getValues([season, height, zenith], hit_ratios)
+            self.assertEqual([], hit_ratios)
+            lut.setDeduplication(True)
+            result = lut.getValues([season, height, zenith], hit_ratios)
+            numpy.testing.assert_array_equal(expected, result)
+            # 2 heights x 30 zenith angles out of 600 pixels
+            self.assertEqual(1, len(hit_ratios))
+            self.assertAlmostEqual(0.9, hit_ratios[0])
+            numpy.testing.assert_array_equal(expected, lut.getValues([season, height, zenith]))
+
+    def test_get_values_deduplicated_resolution(self):
+        lut = LookupTable(numpy.array(range(0, 60)), self.lut.dimensions, 1, lookup_table.LINEAR)
+        lut.setDeduplication(True, [1, 1, 0.5])
+        hit_ratios = []
+        result = lut.getValues([numpy.array([1, 1.1, 2]), numpy.array([1, 1, 1]), numpy.array([1.2, 1.1, 1.5])],
+                               hit_ratios)
+        self.assertAlmostEqual(1.0 / 3, hit_ratios[0])
+        numpy.testing.assert_allclose([0, 0, 15.5], result)
+        # the resolution can be an array per dimension
+        lut.setDeduplication(True, numpy.array([1, 1, 0.5]))
+        numpy.testing.assert_allclose(result, lut.getValues([numpy.array([1, 1.1, 2]), numpy.array([1, 1, 1]),
+                                                             numpy.array([1.2, 1.1, 1.5])]))
+        self.assertTrue(lut.getSubTable([None, 1, None]).deduplicate)
+
+    def test_get_values_scalar_coordinates(self):
+        dimensions = [numpy.array(range(0, 4), dtype=numpy.float64), numpy.array([400, 800, 1000]),
+                      numpy.array(range(5, 56, 5), dtype=numpy.float64)]
+        values = numpy.random.RandomState(4).uniform(-30, 2, 4 * 3 * 11 * 2)
+        zenith = numpy.linspace(3, 60, 40).reshape((5, 8))
+        for interpolation in [lookup_table.NEAREST, lookup_table.LINEAR]:
+            for deduplicate in [False, True]:
+                lut = LookupTable(values, dimensions, 2, interpolation)
+                lut.setDeduplication(deduplicate)
+                # scalar coordinates are broadcast to the other coordinates
+                expected = lut.getValues([numpy.full(zenith.shape, 2.0), numpy.full(zenith.shape, 700.0), zenith])
+                numpy.testing.assert_array_equal(expected, lut.getValues([2.0, numpy.float64(700), zenith]))
+                # only scalars give one value per coefficient
+                numpy.testing.assert_array_equal(expected[:, 0, 0], lut.getValues([2.0, 700.0, zenith[0, 0]]))
+        self.assertRaises(ValueError, self.lut.getValues, [numpy.ones(3), numpy.ones(4), 1.0])
+
+    def test_get_values_deduplicated_rows(self):
+        dimensions = [numpy.array(range(0, 4), dtype=numpy.float64), numpy.array([400, 800, 1000]),
+                      numpy.array(range(5, 56, 5), dtype=numpy.float64)]
+        values = numpy.random.RandomState(5).uniform(-30, 2, 4 * 3 * 11 * 2)
+        height = numpy.ones((6, 8)) * 800
+        height[3:, :] = 1000
+        zenith = numpy.repeat(numpy.linspace(10, 40, 8)[numpy.newaxis, :], 6, axis=0)
+        for interpolation in [lookup_table.NEAREST, lookup_table.LINEAR]:
+            lut = LookupTable(values, dimensions, 2, interpolation)
+            expected = lut.getValues([2.0, height, zenith])
+            lut.setDeduplication(True)
+            # too many combinations for a single key, the tuples are deduplicated as rows with a scalar coordinate
+            with mock.patch('lookup_table.KEY_COMBINATIONS', 1):
+                hit_ratios = []
+                numpy.testing.assert_array_equal(expected, lut.getValues([2.0, height, zenith], hit_ratios))
+                self.assertAlmostEqual(1 - 16 / 48.0, hit_ratios[0])
+
+    def test_write_read(self):
+        values = numpy.array(range(0, 120)) * 0.5
+        lut = LookupTable(values, self.lut.dimensions, 2)
+        filename = os.path.join(tempfile.mkdtemp(), 'test.lut')
+        lut.write(filename)
+        read_lut = LookupTable.read(filename, lookup_table.LINEAR)
+        self.assertIsInstance(read_lut.values, numpy.memmap)
+        self.assertEqual(2, read_lut.length)
+        self.assertEqual(lookup_table.LINEAR, read_lut.interpolation)
+        for i in range(0, 3):
+            numpy.testing.assert_array_equal(lut.dimensions[i], read_lut.dimensions[i])
+        numpy.testing.assert_array_equal(lut.strides, read_lut.strides)
+        numpy.testing.assert_array_equal(values, read_lut.values)
+
+    def test_read_no_lut_file(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'test.lut')
+        with open(filename, 'wb') as f:
+            f.write(b'no lut')
+        self.assertRaises(ValueError, LookupTable.read, filename)
+
+    def test_read_mono_lut(self):
+        from mono import Mono
+        lut = LookupTable.read(lookup_table.lut_path('mono_window.lut'))
+        self.assertEqual([4, 3, 11], [len(dimension) for dimension in lut.dimensions])
+        numpy.testing.assert_array_equal(numpy.array(Mono().values, dtype=numpy.float32), lut.values)
+        # the shipped file is the conversion of mono.py
+        filename = os.path.join(tempfile.mkdtemp(), 'mono_window.lut')
+        lut_converter.convert_mono(filename)
+        with open(filename, 'rb') as converted, open(lookup_table.lut_path('mono_window.lut'), 'rb') as shipped:
+            self.assertEqual(shipped.read(), converted.read())
+
+    def test_convert_xlsx(self):
+        openpyxl = self.import_openpyxl()
+        workbook = openpyxl.Workbook()
+        workbook.active.append(['Season', 'Height', 'coef a0', 'coef a1'])
+        for season, height, a0 in [(0, 400, 1.0), (0, 800, 2.0), (1, 400, 3.0), (1, 800, 'a0')]:
+            workbook.active.append([season, height, a0, 0.5])
+        directory = tempfile.mkdtemp()
+        workbook.save(os.path.join(directory, 'table.xlsx'))
+        # a node without coefficients is not stored as NaN
+        self.assertRaises(ValueError, lut_converter.convert_xlsx, os.path.join(directory, 'table.xlsx'),
+                          os.path.join(directory, 'table.lut'))
+        workbook.active.cell(5, 3, 4.0)
+        workbook.save(os.path.join(directory, 'table.xlsx'))
+        lut_converter.convert_xlsx(os.path.join(directory, 'table.xlsx'), os.path.join(directory, 'table.lut'))
+        lut = LookupTable.read(os.path.join(directory, 'table.lut'))
+        numpy.testing.assert_array_equal([1, 0.5, 2, 0.5, 3, 0.5, 4, 0.5], lut.values)
+
+    def import_openpyxl(self):
+        # openpyxl is only needed for the conversion of spreadsheets
+        try:
+            import openpyxl
+        except ImportError:
+            self.skipTest('openpyxl is not installed')
+        return openpyxl
+
+    def test_coefficient_dimensions(self):
+        for name in ('mono_window.lut', 'split_window.lut'):
+            lut = LookupTable.read(lookup_table.lut_path(name))
+            for dimension, nodes in zip(lut.dimensions, lookup_table.COEFFICIENT_DIMENSIONS):
+                numpy.testing.assert_array_equal(nodes, dimension)
+
+    def test_unknown_interpolation(self):
+        self.assertRaises(ValueError, LookupTable, numpy.ones(60), self.lut.dimensions, 1, 'cubic')
+
 
 if __name__ == '__main__':
     unittest.main()
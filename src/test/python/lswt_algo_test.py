@@ -41,6 +41,98 @@ class TestLSWTAlgo(unittest.TestCase):
         self.assertAlmostEqual(-2.34973288, lswt[0][1])
         self.assertAlmostEqual(8.99993896, lswt[0][2])
 
+    def test_algo_out(self):
+        lower_data = numpy.array([1.5, 2.4, 7.3], dtype=numpy.float32)
+        upper_data = numpy.array([4.7, 5.9, 6.5], dtype=numpy.float32)
+        zenith_data = numpy.array([0.5, 10.0, 45.0], dtype=numpy.float32)
+        out = numpy.zeros(3)
+
+        algo = SplitWindowAlgo(0.5, 1, 1.5, 2, False, use_numexpr=False)
+        lswt = algo.compute_lswt(lower_data, upper_data, zenith_data, out=out)
+
+        diff = lower_data - upper_data
+        expected = 0.5 + lower_data + 1.5 * diff + 2 * (1 - 1 / numpy.cos(zenith_data * numpy.pi / 180)) * diff
+        self.assertIs(out, lswt)
+        numpy.testing.assert_allclose(expected, lswt, rtol=1e-6)
+
+    def test_float32_precision(self):
+        random = numpy.random.RandomState(1)
+        lower_data = (270 + 30 * random.rand(50)).astype(numpy.float32)
+        upper_data = (lower_data - 3 * random.rand(50)).astype(numpy.float32)
+        zenith_data = (55 * random.rand(50)).astype(numpy.float32)
+        season = numpy.ones(50) * 2
+        height = 400 + 1000 * random.rand(50)
+        for interpolation in ['nearest', 'linear']:
+            expected = SplitWindowAlgo(0, 0, 0, 0, True, interpolation, False).compute_lswt_lut(
+                lower_data, upper_data, zenith_data, season, height)
+            algo = SplitWindowAlgo(0, 0, 0, 0, True, interpolation, False, numpy.float32)
+            result = algo.compute_lswt_lut(lower_data, upper_data, zenith_data, season.astype(numpy.float32),
+                                           height.astype(numpy.float32))
+            self.assertEqual(numpy.float32, result.dtype)
+            numpy.testing.assert_allclose(expected, result, atol=1e-3)
+            # the lswt is evaluated into out, the invalid pixels are NaN
+            out = numpy.zeros(50, dtype=numpy.float32)
+            invalid_data = lower_data.copy()
+            invalid_data[3] = numpy.nan
+            self.assertIs(out, algo.compute_lswt_lut(invalid_data, upper_data, zenith_data,
+                                                     season.astype(numpy.float32), height.astype(numpy.float32),
+                                                     out=out))
+            self.assertTrue(numpy.isnan(out[3]))
+            numpy.testing.assert_allclose(numpy.delete(expected, 3), numpy.delete(out, 3), atol=1e-3)
+
+            expected = MonoWindowAlgo(0, 0, True, interpolation).compute_lswt(lower_data, season, height,
+                                                                              zenith_data)
+            result = MonoWindowAlgo(0, 0, True, interpolation, dtype=numpy.float32).compute_lswt(
+                lower_data, season.astype(numpy.float32), height.astype(numpy.float32), zenith_data)
+            self.assertEqual(numpy.float32, result.dtype)
+            numpy.testing.assert_allclose(expected, result, atol=1e-3)
+
+    def test_split_lut_batch(self):
+        random = numpy.random.RandomState(2)
+        lower_data = 270 + 30 * random.rand(3, 4, 5)
+        upper_data = lower_data - 3 * random.rand(3, 4, 5)
+        zenith_data = 55 * random.rand(3, 4, 5)
+        lower_data[1, 2, 3] = numpy.nan
+        season = [0, 2, 3]
+        height = [400, 800, 1500]
+        algo = SplitWindowAlgo(0, 0, 0, 0, True, 'linear', False)
+        result = algo.compute_lswt_batch(lower_data, upper_data, zenith_data, season, height)
+        for i in range(0, 3):
+            expected = algo.compute_lswt_lut(lower_data[i], upper_data[i], zenith_data[i],
+                                             numpy.ones((4, 5)) * season[i], numpy.ones((4, 5)) * height[i])
+            numpy.testing.assert_array_equal(expected, result[i])
+
+    def test_mono_lut_batch(self):
+        random = numpy.random.RandomState(3)
+        data = 270 + 30 * random.rand(2, 3, 4)
+        zenith_data = 55 * random.rand(3, 4)
+        algo = MonoWindowAlgo(0, 0, True)
+        result = algo.compute_lswt_batch(data, zenith_data, [1, 3], 800)
+        for i in range(0, 2):
+            expected = algo.compute_lswt(data[i], numpy.ones((3, 4)) * [1, 3][i], numpy.ones((3, 4)) * 800,
+                                         zenith_data)
+            numpy.testing.assert_array_equal(expected, result[i])
+
+    def test_constant_geometry(self):
+        # scene-constant zenith, season and height given as scalars give the lswt of the materialized arrays
+        random = numpy.random.RandomState(4)
+        lower_data = 270 + 30 * random.rand(4, 5)
+        upper_data = lower_data - 3 * random.rand(4, 5)
+        lower_data[1, 2] = numpy.nan
+        full = numpy.ones((4, 5))
+        for use_numexpr in [False, True]:
+            algo = SplitWindowAlgo(0.5, 1, 1.5, 2, False, use_numexpr=use_numexpr)
+            numpy.testing.assert_allclose(algo.compute_lswt(lower_data, upper_data, full * 30.0),
+                                          algo.compute_lswt(lower_data, upper_data, numpy.float64(30)), rtol=1e-12)
+            algo = SplitWindowAlgo(0, 0, 0, 0, True, 'linear', use_numexpr)
+            numpy.testing.assert_allclose(algo.compute_lswt_lut(lower_data, upper_data, full * 30.0, full * 2,
+                                                                full * 700),
+                                          algo.compute_lswt_lut(lower_data, upper_data, numpy.float64(30),
+                                                                numpy.float64(2), numpy.float64(700)), rtol=1e-12)
+        algo = MonoWindowAlgo(0, 0, True, 'linear')
+        numpy.testing.assert_array_equal(algo.compute_lswt(lower_data, full * 2, full * 700, full * 30.0),
+                                         algo.compute_lswt(lower_data, 2.0, 700.0, numpy.float64(30)))
+
     def test_get_season(self):
         algo = MonoWindowAlgo()
         self.assertEqual(0, algo.get_season(Date(117, 4, 15)))
@@ -85,6 +177,72 @@ class TestLSWTAlgo(unittest.TestCase):
         self.assertAlmostEqual(1.1091340, result[0], 2)
         self.assertAlmostEqual(-27.831785, result[1], 2)
 
+    def test_mono_lut_linear(self):
+        algo = MonoWindowAlgo(0, 0, True, 'linear')
+        season = numpy.array([3, 3, 3])  # winter
+        height = numpy.array([800, 800, 800])
+        zenith = numpy.array([40, 42.5, 45])
+        result = algo.lut.getValues([season, height, zenith])
+        self.assertAlmostEqual(1.0936078, result[0, 0], 5)
+        self.assertAlmostEqual((1.0936078 + 1.1013171) / 2, result[0, 1], 5)
+        self.assertAlmostEqual((-23.638379 - 25.503619) / 2, result[1, 1], 4)
+        self.assertAlmostEqual(-25.503619, result[1, 2], 5)
+
+    def test_mono_collapsed_lut(self):
+        algo = MonoWindowAlgo(0, 0, True)
+        season = numpy.ones((5, 5)) * 3
+        height = numpy.ones((5, 5)) * 800
+        zenith = numpy.ones((5, 5)) * 40
+        data = numpy.ones((5, 5)) * 280
+        expected = algo.compute_lswt(data, season, height, zenith)
+        algo.collapse_lut(3, 800)
+        result = algo.compute_lswt(data, None, None, zenith)
+        numpy.testing.assert_array_equal(expected, result)
+
+    def test_mono_coefficient_grid(self):
+        algo = MonoWindowAlgo(0, 0, True, 'linear', grid_step=(3, 4))
+        algo.scene_size = (8, 15)
+        algo.collapse_lut(3, 800)
+        # zenith varies linearly inside one LUT cell, so the bilinear field equals the per pixel evaluation
+        zenith = 40 + numpy.add.outer(numpy.arange(8) * 0.25, numpy.arange(15) * 0.2)
+        data = numpy.ones((7, 10)) * 280
+        data[2, 3] = numpy.nan
+        expected = algo.compute_lswt(data, None, None, zenith[1:, 5:])
+        self.assertEqual((4, 0, 11, 8), algo.get_grid_rectangle((5, 1, 10, 7)))
+        result = algo.compute_lswt(data, None, None, zenith[:, 4:], (5, 1, 10, 7))
+        numpy.testing.assert_allclose(expected, result, rtol=1e-6)
+        self.assertTrue(numpy.isnan(result[2, 3]))
+
+    def test_mono_coefficient_grid_tiling(self):
+        algo = MonoWindowAlgo(0, 0, True, 'linear', grid_step=(4, 5))
+        algo.scene_size = (13, 17)
+        zenith = 30 + 20 * numpy.sin(numpy.add.outer(numpy.arange(13) * 0.3, numpy.arange(17) * 0.2))
+        height = 500 + numpy.add.outer(numpy.arange(13) * 37.0, numpy.arange(17) ** 2 * 3.0)
+        data = numpy.full((13, 17), 280.0)
+
+        def compute(rows, cols):
+            # the scene computed in tiles with the given borders, the inputs are read on the grid rectangles
+            lswt = numpy.zeros((13, 17))
+            for y0, y1 in zip(rows[:-1], rows[1:]):
+                for x0, x1 in zip(cols[:-1], cols[1:]):
+                    x, y, width, height_ = algo.get_grid_rectangle((x0, y0, x1 - x0, y1 - y0))
+                    lswt[y0:y1, x0:x1] = algo.compute_lswt(data[y0:y1, x0:x1], 1.0,
+                                                           height[y:y + height_, x:x + width],
+                                                           zenith[y:y + height_, x:x + width],
+                                                           (x0, y0, x1 - x0, y1 - y0))
+            return lswt
+
+        expected = compute([0, 13], [0, 17])
+        numpy.testing.assert_array_equal(expected, compute([0, 6, 13], [0, 7, 9, 17]))
+        numpy.testing.assert_array_equal(expected, compute([0, 1, 4, 12, 13], [0, 5, 16, 17]))
+
+    def test_mono_grid_nodes(self):
+        numpy.testing.assert_array_equal([0, 3, 6, 9], MonoWindowAlgo.get_grid_nodes(0, 10, 3, 10))
+        numpy.testing.assert_array_equal([-1, 2, 5, 8, 11], MonoWindowAlgo.get_grid_nodes(4, 10, 3, 20))
+        numpy.testing.assert_array_equal([-1, 2, 5, 7], MonoWindowAlgo.get_grid_nodes(4, 8, 3, 12))
+        numpy.testing.assert_array_equal([-2, 1], MonoWindowAlgo.get_grid_nodes(2, 1, 3, 10))
+        numpy.testing.assert_array_equal([0], MonoWindowAlgo.get_grid_nodes(3, 1, 3, 10))
+
     def test_mono_some_nan(self):
         algo = MonoWindowAlgo()
         season = numpy.ones((5, 5))
@@ -2,6 +2,7 @@ import unittest
 import numpy
 from lswt_quality_check import QualityCheck
 from numpy import testing
+from scipy import ndimage
 import snappy
 
 from utils import Utils
@@ -28,9 +29,147 @@ class TestLSWTQualityCheck(unittest.TestCase):
         in_data = numpy.array(in_data, dtype=numpy.float32)
         in_data[0, 0:2] = numpy.nan
         stdv = QualityCheck.spatial_stddev(in_data, 3)
+        # the NaN pixels are left out of the windows
         testing.assert_allclose(numpy.array(
-            [[numpy.nan, numpy.nan, numpy.nan, 0.99999994], [numpy.nan, numpy.nan, numpy.nan, 0.99999994],
-             [1.5, 1.32287566, 0.8660254, 0.99999994], [1.5, 1.32287566, 0.8660254, 0.99999994]]), stdv.tolist())
+            [[1.7320508, 1.0954451, 1.0, 1.0], [1.5491933, 1.2535663, 0.9258201, 1.0],
+             [1.5, 1.32287566, 0.8660254, 1.0], [1.5, 1.32287566, 0.8660254, 1.0]]), stdv.tolist(), rtol=1e-6)
+
+    def test_check_quality_bits(self):
+        lswt = numpy.ones((4, 4)) * 293
+        sat_za = numpy.ones((4, 4)) * 20
+        sat_za[1, 1] = 50
+        lwm = numpy.ones((4, 4))
+        lwm[3, 3] = 0
+        check = QualityCheck(lswt, numpy.ones((4, 4)) * 0.05, numpy.ones((4, 4)) * 0.02, None,
+                             numpy.ones((4, 4)) * 295, None, sat_za, numpy.ones((4, 4)) * 40,
+                             numpy.zeros((4, 4)), lwm, numpy.zeros((4, 4)), 4, 4, 'SLSTR')
+        flags = check.check_quality()
+        self.assertEqual(numpy.uint16, flags.dtype)
+        self.assertEqual(1024, flags[1, 1], 'SZA > 45 is bit 11')
+        self.assertEqual(8, flags[3, 3], 'land is bit 4')
+        self.assertEqual(0, flags[0, 0])
+
+    @staticmethod
+    def baseline_flags(lswt, rf1, rf2, bt4, sat_za, sun_za, rel_az, lwm, cmsk):
+        # the cascade of the quality check before the tests were registered in quality_tests, SLSTR
+        flags = (cmsk != 0) * 1
+        flags += numpy.logical_and(rf2 >= 0.1, sun_za < 90) * 2
+        if numpy.nanmax(sun_za) < 90:
+            flags += (rf2 / rf1 > 1.0) * 4
+        flags += (lwm == 0) * 8
+        flags += numpy.logical_and(numpy.logical_or(bt4 <= 263.15, rf1 < 0.005), sun_za < 90) * 16
+        flags += numpy.logical_or(lswt <= 268.15, lswt >= 308.15) * 32
+        good_pix = (flags == 0).astype(int)
+        flags += (ndimage.convolve(good_pix, numpy.ones((3, 3))) < 2) * 64
+        flags += (sat_za > 55.) * 128
+        flags += (sat_za > 45.) * 1024
+        tmp_lswt = numpy.where(good_pix == 0, 0., lswt)
+        valid = (tmp_lswt != 0).astype(int)
+        window = numpy.ones((3, 3))
+        n_valid = ndimage.convolve(valid, window)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            sub_sum = ndimage.convolve(tmp_lswt, window)
+            mean = sub_sum / n_valid
+            var = ndimage.convolve(tmp_lswt ** 2, window) - 2 * mean * sub_sum + n_valid * mean ** 2
+            stdv = numpy.sqrt(numpy.absolute(var / (n_valid - 1)))
+        flags += numpy.logical_and(numpy.isfinite(stdv), stdv > 3.) * 256
+        flags += numpy.logical_and(numpy.isfinite(stdv), stdv > 1.5) * 512
+        glint = numpy.degrees(numpy.arcsin(
+            numpy.sin(numpy.radians(sat_za)) * numpy.sin(numpy.radians(sun_za)) * numpy.cos(numpy.radians(rel_az)) +
+            numpy.cos(numpy.radians(sat_za)) * numpy.cos(numpy.radians(sun_za))))
+        flags += (glint < 36.) * 2048
+        return flags
+
+    @staticmethod
+    def baseline_levels(flags):
+        levels = numpy.zeros(flags.shape, dtype=numpy.int32)
+        flags = numpy.uint16(flags)
+        levels[numpy.bitwise_and(flags, 511) == 256] = 1
+        levels[numpy.bitwise_and(flags, 2047) == 1536] = 2
+        for value, level in [(2560, 3), (3072, 4), (2048, 5), (512, 6), (1024, 7), (0, 8)]:
+            levels[flags == value] = level
+        return levels
+
+    def test_check_quality_as_baseline(self):
+        random = numpy.random.RandomState(12)
+        seen = 0
+        for night in [False, True]:
+            lswt = 280 + 4 * random.rand(30, 30) + 6 * (random.rand(30, 30) < 0.1)
+            lswt[random.rand(30, 30) < 0.02] = 265
+            rf1 = 0.2 * random.rand(30, 30)
+            rf2 = 0.12 * random.rand(30, 30)
+            bt4 = lswt + 2
+            sat_za = 60 * random.rand(30, 30)
+            # the ratio test is decided per pixel now, the baseline skipped it on tiles with a night pixel
+            sun_za = 95 + 30 * random.rand(30, 30) if night else 30 + 50 * random.rand(30, 30)
+            rel_az = 180 * random.rand(30, 30)
+            lwm = (random.rand(30, 30) < 0.9) * 1.0
+            cmsk = (random.rand(30, 30) < 0.05) * 1.0
+            check = QualityCheck(numpy.array(lswt), rf1, rf2, None, bt4, None, sat_za, sun_za, rel_az, lwm, cmsk, 30,
+                                 30, 'SLSTR')
+            flags = check.check_quality()
+            expected = self.baseline_flags(lswt, rf1, rf2, bt4, sat_za, sun_za, rel_az, lwm, cmsk)
+            seen |= numpy.bitwise_or.reduce(expected, axis=None)
+            testing.assert_array_equal(expected, flags)
+            testing.assert_array_equal(self.baseline_levels(expected), check.get_quality_mask(flags))
+        # the inputs set every bit somewhere, the SZA > 45 and STDV > 1.5 bits keep their values
+        self.assertEqual(4095, seen)
+
+    def test_check_quality_early_out(self):
+        random = numpy.random.RandomState(4)
+        lswt = 280 + 20 * random.rand(20, 20)
+        visible = 0.2 * random.rand(20, 20)
+        nir = 0.2 * random.rand(20, 20)
+        bt4 = lswt + 2
+        sat_za = 60 * random.rand(20, 20)
+        sun_za = 60 * random.rand(20, 20)
+        rel_az = 180 * random.rand(20, 20)
+        lwm = (random.rand(20, 20) < 0.5).astype(numpy.float32)
+        cmsk = numpy.zeros((20, 20))
+        full = QualityCheck(numpy.array(lswt), visible, nir, None, bt4, None, sat_za, sun_za, rel_az, lwm, cmsk, 20, 20,
+                            'SLSTR')
+        full_flags = full.check_quality()
+        early = QualityCheck(numpy.array(lswt), visible, nir, None, bt4, None, sat_za, sun_za, rel_az, lwm, cmsk, 20,
+                             20, 'SLSTR', early_out=True)
+        early_flags = early.check_quality()
+        candidates = (full_flags & 255) == 0
+        testing.assert_array_equal(full_flags[candidates], early_flags[candidates])
+        testing.assert_array_equal(full.get_quality_mask(full_flags), early.get_quality_mask(early_flags))
+
+    def test_check_quality_tiles_with_halo(self):
+        random = numpy.random.RandomState(6)
+        bands = [280 + 20 * random.rand(20, 20), 0.2 * random.rand(20, 20), 0.2 * random.rand(20, 20), None,
+                 285 + 20 * random.rand(20, 20), None, 60 * random.rand(20, 20), 60 + 60 * random.rand(20, 20),
+                 180 * random.rand(20, 20), (random.rand(20, 20) < 0.8) * 1.0, numpy.zeros((20, 20))]
+        expected = QualityCheck(*(bands + [20, 20, 'SLSTR'])).check_quality()
+        halo = 1
+        for size in [4, 7]:
+            for y in range(0, 20, size):
+                for x in range(0, 20, size):
+                    y0, y1 = max(0, y - halo), min(20, y + size + halo)
+                    x0, x1 = max(0, x - halo), min(20, x + size + halo)
+                    tile = [None if band is None else band[y0:y1, x0:x1] for band in bands]
+                    flags = QualityCheck(*(tile + [y1 - y0, x1 - x0, 'SLSTR'])).check_quality()
+                    testing.assert_array_equal(expected[y:y + size, x:x + size],
+                                               flags[y - y0:y - y0 + size, x - x0:x - x0 + size])
+
+    def test_check_quality_views(self):
+        random = numpy.random.RandomState(8)
+        lswt = 280 + 20 * random.rand(20, 20)
+        visible = 0.2 * random.rand(400)
+        nir = 0.2 * random.rand(400)
+        bt4 = lswt + 2
+        sat_za = 60 * random.rand(20, 20)
+        lwm = (random.rand(20, 20) < 0.8) * 1.0
+        cmsk = numpy.zeros((20, 20))
+        expected = QualityCheck(lswt.ravel(), visible, nir, None, bt4.ravel(), None, sat_za, numpy.full((20, 20), 40.),
+                                numpy.full((20, 20), 100.), lwm, cmsk, 20, 20, 'SLSTR').check_quality()
+        # scalar angles and read-only inputs are used as views without a copy
+        lswt.flags.writeable = False
+        check = QualityCheck(lswt, visible, nir, None, bt4, None, sat_za, 40., 100., lwm, cmsk, 20, 20, 'SLSTR')
+        testing.assert_array_equal(expected, check.check_quality())
+        self.assertTrue(numpy.shares_memory(lswt, check.inputs['lswt']))
+        self.assertTrue(numpy.shares_memory(visible, check.inputs['rf1']))
 
     def test_get_quality_flag_Q8(self):
         # 0: 0000 0000 0000
@@ -1,8 +1,17 @@
 import unittest
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest import mock
 import snappy
 import numpy
 from src.main.python.musenalp_op import MuSenALPOp
 from snappy import jpy
+import config
+import lswt_algo
+import quality_tests
+import sensors
+from config import Config
+from tile_io_test import SourceContext
 
 
 class TestMuSenALPOp(unittest.TestCase):
@@ -30,11 +39,192 @@ class TestMuSenALPOp(unittest.TestCase):
         self.op.initialize(context)
         self.assertEqual('py_MuSenALP', context.getTargetProduct().getName())
 
+    def test_skip_flags(self):
+        context = ParameterContext({'maskBeforeCalculation': True})
+        self.op.quality_inputs = {'lwm', 'lswt'}
+        lwm = numpy.array([0, 0, 1, 1], dtype=numpy.float32)
+        valid = numpy.array([1, 0, 0, 1], dtype=numpy.float32)
+        self.assertIsNone(self.op.get_skip_flags(context, lwm, valid))
+        self.assertIsNone(self.op.get_skip_flags(context, None, None))
+        valid[3] = 0
+        numpy.testing.assert_array_equal([8, 32, 32, 32], self.op.get_skip_flags(context, lwm, valid))
+        # land pixels are only skipped if their lswt is masked before the calculation
+        self.assertIsNone(self.op.get_skip_flags(ParameterContext({'maskBeforeCalculation': False}), lwm, valid))
+
+    def test_skipped_tile(self):
+        # a skipped tile is written from the land/water mask and the valid pixels, no other source tile is read
+        self.op.dtype = numpy.dtype(numpy.float32)
+        self.op.algorithm_parameter = 'split-window'
+        self.op.sensor = sensors.create('AVHRR', config.parse_sensor_config('AVHRR', Config('AVHRR').get_conf()))
+        self.op.sensor.bands = dict((name, name) for name in sensors.INPUTS)
+        self.op.tile_reads = set(sensors.INPUTS)
+        self.op.quality_inputs = quality_tests.QualityTests(quality_tests.STANDARD_SCHEME).get_inputs()
+        self.op.lwm_band, self.op.valid_pixel_band, self.op.cmsk_band = 'lwm', 'valid', 'cmsk'
+        self.op.needs_lut = True
+        self.op.height_band = 'height'
+        rasters = {'lwm': numpy.tile(numpy.array([0, 1, 1, 0, 1], dtype=numpy.uint8), 4)}
+        rasters['valid'] = 1 - rasters['lwm']
+        context = SourceContext(rasters)
+        context.getParameter = {'maskBeforeCalculation': True}.get
+        results = []
+        self.op.set_target_tiles = lambda *values: results.append(values[:3])
+        self.op.computeTileStack(context, {}, FakeRectangle(0, 0, 5, 4))
+        self.assertEqual({'lwm', 'valid'}, set(context.reads))
+        self.assertEqual([(0, 0)], self.op.skipped_tiles)
+        lswt, flags, index = results[0]
+        self.assertEqual(numpy.float32, lswt.dtype)
+        self.assertTrue(numpy.isnan(lswt).all())
+        # land pixels get the land bit, invalid water pixels the range bit, the cloud bit is not set
+        numpy.testing.assert_array_equal(numpy.where(rasters['lwm'] == 0, 8, 32), flags)
+        numpy.testing.assert_array_equal(numpy.zeros(20), index)
+
+    def test_gather_scatter(self):
+        self.op.dtype = numpy.float32
+        water = numpy.array([1, 2, 5])
+        data, scalar, missing = self.op.gather(water, numpy.arange(6.).reshape((2, 3)), numpy.float32(40), None)
+        numpy.testing.assert_array_equal([1, 2, 5], data)
+        self.assertEqual(40, scalar)
+        self.assertIsNone(missing)
+        lswt, flags = self.op.scatter(water, FakeRectangle(0, 0, 3, 2), numpy.array([280, 281, 282]),
+                                      numpy.array([0, 512, 1], dtype=numpy.uint16))
+        numpy.testing.assert_array_equal([numpy.nan, 280, 281, numpy.nan, numpy.nan, 282], lswt)
+        numpy.testing.assert_array_equal([8, 0, 512, 8, 8, 1], flags)
+
+    def test_read_inputs(self):
+        self.op.sensor = sensors.create('VIIRS', config.parse_sensor_config('VIIRS', Config('VIIRS').get_conf()))
+        self.op.sensor.bands = {'bt4': 'bt4'}
+        self.op.tile_reads = {'bt4'}
+        self.op.lwm_band = 'lwm'
+        self.op.valid_pixel_band = 'valid'
+        self.op.quality_inputs = {'lwm'}
+        rasters = {'lwm': numpy.zeros(20, dtype=numpy.uint8), 'valid': numpy.ones(20, dtype=numpy.uint8),
+                   'bt4': numpy.arange(20, dtype=numpy.int16)}
+        context = SourceContext(rasters)
+        context.getParameter = {'maskBeforeCalculation': True}.get
+        rectangle = FakeRectangle(0, 0, 5, 2)
+        # the sensor bands of a land tile are not read
+        water, skip_flags, samples = self.op.read_inputs(context, rectangle, self.op.get_tile_buffers())
+        self.assertEqual([8] * 10, list(skip_flags))
+        self.assertEqual({'lwm', 'valid'}, set(context.reads))
+        rasters['lwm'][7] = 1
+        with ThreadPoolExecutor(max_workers=2) as self.op.read_pool:
+            water, skip_flags, samples = self.op.read_inputs(context, rectangle, self.op.get_tile_buffers())
+        self.assertIsNone(water)
+        self.assertIsNone(skip_flags)
+        numpy.testing.assert_array_equal(numpy.arange(10), samples['bt4'])
+
+    def test_calibrate_dtype(self):
+        self.op.dtype = numpy.dtype(numpy.float32)
+        self.op.sensor = sensors.create('AVHRR', config.parse_sensor_config('AVHRR', Config('AVHRR').get_conf()))
+        self.op.tile_reads = {'bt4', 'bt5', 'sat_za', 'sun_za', 'rel_az'}
+        samples = dict((name, numpy.array([2900, 6553.5 / 0.1, 1000], dtype=numpy.float32))
+                       for name in self.op.tile_reads)
+        samples['sat_za'][2] = -32768
+        tile = self.op.calibrate(samples)
+        for name in self.op.tile_reads:
+            self.assertEqual(numpy.float32, tile[name].dtype, name)
+            self.assertIs(samples[name], tile[name])
+        self.assertTrue(numpy.isnan(tile['bt4'][1]))
+        self.assertTrue(numpy.isnan(tile['sat_za'][2]))
+        # a float64 input is narrowed to the type of the tiles
+        self.op.sensor.calibrate = lambda raw: dict(raw, bt4=raw['bt4'].astype(numpy.float64))
+        self.assertEqual(numpy.float32, self.op.calibrate(samples)['bt4'].dtype)
+
+    def test_prefetch(self):
+        self.op.sensor = sensors.create('VIIRS', config.parse_sensor_config('VIIRS', Config('VIIRS').get_conf()))
+        self.op.sensor.bands = {'bt4': 'bt4'}
+        self.op.tile_reads = {'bt4'}
+        self.op.width, self.op.height, self.op.tile_size = 5, 4, (3, 2)
+        context = SourceContext({'bt4': numpy.arange(20, dtype=numpy.int16)})
+        context.getParameter = {'maskBeforeCalculation': False}.get
+        with mock.patch('src.main.python.musenalp_op.Rectangle', FakeRectangle), \
+                ThreadPoolExecutor(max_workers=1) as self.op.prefetch_pool:
+            first = FakeRectangle(0, 0, 3, 2)
+            self.op.get_inputs(context, first, first)
+            self.assertEqual([(3, 0, 2, 2)], list(self.op.prefetched))
+            second = FakeRectangle(3, 0, 2, 2)
+            water, skip_flags, samples = self.op.get_inputs(context, second, second)
+            numpy.testing.assert_array_equal([3, 4, 8, 9], samples['bt4'])
+            self.assertEqual([(0, 2, 3, 2)], list(self.op.prefetched))
+            self.op.prefetched[(0, 2, 3, 2)].result()
+            # the second tile has only been read by the prefetch thread
+            self.assertEqual(['bt4'] * 3, context.reads)
+            self.op.dispose(context)
+        self.assertEqual(0, len(self.op.prefetched))
+
+    def test_prefetch_started_tiles(self):
+        self.op.sensor = sensors.create('VIIRS', config.parse_sensor_config('VIIRS', Config('VIIRS').get_conf()))
+        self.op.sensor.bands = {'bt4': 'bt4'}
+        self.op.tile_reads = {'bt4'}
+        self.op.width, self.op.height, self.op.tile_size = 5, 4, (1, 1)
+        context = SourceContext({'bt4': numpy.arange(20, dtype=numpy.int16)})
+        context.getParameter = {'maskBeforeCalculation': False}.get
+        with mock.patch('src.main.python.musenalp_op.Rectangle', FakeRectangle), \
+                mock.patch('src.main.python.musenalp_op.STARTED_TILES', 3), \
+                ThreadPoolExecutor(max_workers=1) as self.op.prefetch_pool:
+            for x in range(5):
+                tile = FakeRectangle(x, 0, 1, 1)
+                self.op.get_inputs(context, tile, tile)
+            # only the last started tiles are kept
+            self.assertEqual([(2, 0, 1, 1), (3, 0, 1, 1), (4, 0, 1, 1)], list(self.op.started_tiles))
+            self.op.dispose(context)
+
+    def test_prefetch_failed(self):
+        self.op.sensor = sensors.create('VIIRS', config.parse_sensor_config('VIIRS', Config('VIIRS').get_conf()))
+        self.op.sensor.bands = {'bt4': 'bt4'}
+        self.op.tile_reads = {'bt4'}
+        self.op.width, self.op.height, self.op.tile_size = 5, 4, (3, 2)
+        context = SourceContext({'bt4': numpy.arange(20, dtype=numpy.int16)})
+        context.getParameter = {'maskBeforeCalculation': False}.get
+        failed = Future()
+        failed.set_exception(RuntimeError('no source tile'))
+        self.op.prefetched[(3, 0, 2, 2)] = failed
+        with mock.patch('src.main.python.musenalp_op.Rectangle', FakeRectangle), \
+                ThreadPoolExecutor(max_workers=1) as self.op.prefetch_pool:
+            second = FakeRectangle(3, 0, 2, 2)
+            # the tile is read again by the thread that computes it
+            water, skip_flags, samples = self.op.get_inputs(context, second, second)
+            numpy.testing.assert_array_equal([3, 4, 8, 9], samples['bt4'])
+            self.op.dispose(context)
+
+    def test_log_statistics(self):
+        self.op.algo = lswt_algo.SplitWindowAlgo(1.0, 1.0, 0.5, 0.1, False)
+        self.op.get_statistics(ParameterContext({'logStatistics': False}))
+        self.assertIsNone(self.op.lut_hit_ratios)
+        self.assertIsNone(self.op.algo.timings)
+        self.op.skipped_tiles.append((0, 0))
+        with mock.patch('src.main.python.musenalp_op.LOGGER') as logger:
+            self.op.dispose(None)
+        self.assertFalse(logger.info.called)
+        self.op.get_statistics(ParameterContext({'logStatistics': True}))
+        self.op.lut_hit_ratios.extend([0.5, 0.7])
+        self.op.algo.timings.add('range', 0.25)
+        with self.assertLogs('musenalp', 'INFO') as logs:
+            self.op.dispose(None)
+        self.assertEqual(3, len(logs.output))
+        self.assertIn('60.0 %', logs.output[0])
+
     def test_read_add_metadata(self):
         product = snappy.ProductIO.readProduct("..\\resources\\S2_quality_an.nc")
         metadata_elements = product.getMetadataRoot().getElementNames()
 
 
+class FakeRectangle(namedtuple('FakeRectangle', ['x', 'y', 'width', 'height'])):
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
+
+class ParameterContext:
+    def __init__(self, parameters):
+        self.parameters = parameters
+
+    def getParameter(self, param):
+        return self.parameters.get(param)
+
+
 class FakeContext:
     def __init__(self, source, sensor):
         self.source = source
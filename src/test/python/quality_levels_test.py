@@ -0,0 +1,58 @@
+import unittest
+
+import numpy
+from numpy import testing
+
+import quality_levels
+from quality_levels import QualityLevels
+
+
+class TestQualityLevels(unittest.TestCase):
+    def setUp(self):
+        self.flags = numpy.arange(65536, dtype=numpy.uint16)
+
+    def test_standard(self):
+        # the cascade the table replaces
+        flag = self.flags
+        expected = numpy.zeros(flag.shape)
+        expected[numpy.where(numpy.bitwise_and(flag, 511) == 256)] = 1
+        expected[numpy.where(numpy.bitwise_and(flag, 2047) == 1536)] = 2
+        expected[numpy.where(flag == 2560)] = 3
+        expected[numpy.where(flag == 3072)] = 4
+        expected[numpy.where(flag == 2048)] = 5
+        expected[numpy.where(flag == 512)] = 6
+        expected[numpy.where(flag == 1024)] = 7
+        expected[numpy.where(flag == 0)] = 8
+        testing.assert_array_equal(expected, quality_levels.STANDARD.get_levels(flag))
+
+    def test_mono(self):
+        flag = self.flags
+        expected = numpy.zeros(flag.shape)
+        expected[numpy.where(flag == 48)] = 1
+        expected[numpy.where(flag == 32)] = 2
+        expected[numpy.where(flag == 0)] = 3
+        testing.assert_array_equal(expected, quality_levels.MONO.get_levels(flag))
+
+    def test_idl(self):
+        flag = self.flags
+        expected = numpy.ones(flag.shape)
+        level = numpy.logical_not(numpy.bitwise_and(flag, 511))
+        expected[level] = 4
+        for shift, value in [(11, 8), (12, 16), (13, 32), (10, 64)]:
+            level = numpy.logical_and(level, numpy.logical_not(numpy.bitwise_and(7, numpy.right_shift(flag, shift))))
+            expected[level] = value
+        testing.assert_array_equal(expected, quality_levels.IDL.get_levels(flag))
+
+    def test_shape_and_type(self):
+        flags = numpy.array([[0, 256], [1024, 3]], dtype=numpy.float64)
+        levels = quality_levels.STANDARD.get_levels(flags, numpy.int32)
+        self.assertEqual(numpy.int32, levels.dtype)
+        testing.assert_array_equal([[8, 1], [7, 0]], levels)
+
+    def test_scheme(self):
+        levels = QualityLevels((5, [(1, 1, 2), (3, 3, 1)]))
+        testing.assert_array_equal([5, 2, 5, 1], levels.get_levels([0, 1, 2, 3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+import numpy
+from numpy import testing
+
+import quality_levels
+import quality_tests
+from quality_tests import QualityTests, QualityTestException, QualityTestTimings
+
+
+class TestQualityTests(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        shape = (10, 12)
+        self.inputs = {'lswt': random.uniform(266, 310, shape), 'rf1': random.uniform(0, 0.12, shape),
+                       'rf2': random.uniform(0, 0.12, shape), 'bt3': random.uniform(90, 300, shape),
+                       'bt4': random.uniform(260, 300, shape), 'bt5': random.uniform(260, 300, shape),
+                       'sat_za': random.uniform(0, 60, shape), 'sun_za': random.uniform(30, 100, shape),
+                       'rel_az': random.uniform(0, 180, shape), 'lwm': (random.rand(*shape) < 0.9) * 1.0,
+                       'cmsk': (random.rand(*shape) < 0.2) * 1.0}
+
+    def test_registry(self):
+        for scheme in [quality_tests.STANDARD_SCHEME, quality_tests.IDL_SCHEME, quality_tests.MONO_SCHEME]:
+            names = [name for name, bit in scheme.tests]
+            bits = [bit for name, bit in scheme.tests]
+            self.assertTrue(all(name in quality_tests.TESTS for name in names))
+            self.assertEqual(len(bits), len(set(bits)))
+            self.assertEqual(0, sum(bits) & ~quality_levels.ALL_BITS)
+
+    def test_disabled(self):
+        flags = QualityTests(quality_tests.STANDARD_SCHEME).run(self.inputs, 'SLSTR')
+        tests = QualityTests(quality_tests.STANDARD_SCHEME, ['vis_cloud', 'ratio', 'gross_ir', 'glint'])
+        self.assertEqual({'cmsk', 'lwm', 'lswt', 'sat_za'}, tests.get_inputs())
+        # the inputs of the disabled tests are not needed
+        inputs = dict((name, self.inputs[name]) for name in tests.get_inputs())
+        disabled = tests.run(inputs, 'SLSTR')
+        self.assertEqual(0, numpy.count_nonzero(disabled & (2 | 4 | 16 | 2048)))
+        # the pointwise tests that still run do not change
+        testing.assert_array_equal(flags & (1 | 8 | 32 | 128 | 1024), disabled & (1 | 8 | 32 | 128 | 1024))
+
+    def test_unknown_test(self):
+        self.assertRaises(QualityTestException, QualityTests, quality_tests.STANDARD_SCHEME, ['cloud'])
+
+    def test_early_out(self):
+        full = QualityTests(quality_tests.STANDARD_SCHEME).run(self.inputs, 'SLSTR')
+        early = QualityTests(quality_tests.STANDARD_SCHEME, early_out=True).run(self.inputs, 'SLSTR')
+        testing.assert_array_equal(quality_levels.STANDARD.get_levels(full),
+                                   quality_levels.STANDARD.get_levels(early))
+
+    def test_tile_decisions(self):
+        # the tests decided for the whole tile give the same flags as the tests evaluated per pixel
+        random = numpy.random.RandomState(1)
+        shape = self.inputs['lswt'].shape
+        tiles = [{'sun_za': random.uniform(95, 120, shape), 'sat_za': random.uniform(0, 30, shape)},
+                 {'sun_za': random.uniform(95, 120, shape), 'sat_za': random.uniform(0, 60, shape)},
+                 {'sun_za': random.uniform(20, 30, shape), 'sat_za': random.uniform(10, 20, shape)},
+                 {'sat_za': random.uniform(56, 70, shape)},
+                 {'sat_za': numpy.where(random.rand(*shape) < 0.1, numpy.nan, random.uniform(56, 70, shape))},
+                 {'sun_za': numpy.float64(100), 'rel_az': numpy.float64(30)},
+                 {'lwm': numpy.zeros(shape)}]
+        for scheme in [quality_tests.STANDARD_SCHEME, quality_tests.IDL_SCHEME]:
+            for early_out in [False, True]:
+                tests = QualityTests(scheme, early_out=early_out)
+                reference = QualityTests(scheme, early_out=early_out)
+                reference.tests = [(test._replace(decide=None), bit) for test, bit in reference.tests]
+                for tile in tiles:
+                    inputs = dict(self.inputs)
+                    inputs.update((name, quality_tests.tile_view(values, shape)) for name, values in tile.items())
+                    testing.assert_array_equal(reference.run(inputs, 'AVHRR'), tests.run(inputs, 'AVHRR'))
+
+    def test_constant_inputs(self):
+        # scene-constant angles given as scalars flag the same pixels as the angles materialized on the tile
+        shape = self.inputs['lswt'].shape
+        constants = {'sat_za': numpy.float64(50), 'sun_za': numpy.float64(60), 'rel_az': numpy.float64(170)}
+        scalars = dict(self.inputs)
+        scalars.update((name, quality_tests.tile_view(value, shape)) for name, value in constants.items())
+        arrays = dict(self.inputs)
+        arrays.update((name, numpy.full(shape, value)) for name, value in constants.items())
+        for scheme in [quality_tests.STANDARD_SCHEME, quality_tests.IDL_SCHEME]:
+            tests = QualityTests(scheme)
+            testing.assert_array_equal(tests.run(arrays, 'TIRS'), tests.run(scalars, 'TIRS'))
+
+    def test_subset(self):
+        # the flags of the water pixels do not depend on whether the land pixels are computed
+        inputs = dict(self.inputs)
+        inputs['lswt'] = numpy.where(inputs['lwm'] == 0, numpy.nan, inputs['lswt'])
+        water = numpy.flatnonzero(inputs['lwm'])
+        subset = dict((name, values.reshape(-1)[water]) for name, values in inputs.items())
+        for early_out in [False, True]:
+            tests = QualityTests(quality_tests.STANDARD_SCHEME, early_out=early_out)
+            flags = tests.run(inputs, 'SLSTR')
+            testing.assert_array_equal(flags.reshape(-1)[water],
+                                       tests.run(subset, 'SLSTR', shape=flags.shape, index=water))
+
+    def test_timings(self):
+        timings = QualityTestTimings()
+        tests = QualityTests(quality_tests.MONO_SCHEME, ['stddev_1.5'], timings=timings)
+        tests.run(self.inputs, 'SLSTR')
+        tests.run(self.inputs, 'SLSTR')
+        report = timings.get_report()
+        self.assertEqual(['cloud_mask', 'land_water', 'range', 'single_pixel', 'stddev_3'],
+                         sorted(name for name, seconds, tiles in report))
+        self.assertTrue(all(tiles == 2 and seconds >= 0 for name, seconds, tiles in report))
+
+
+if __name__ == '__main__':
+    unittest.main()
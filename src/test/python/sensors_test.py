@@ -0,0 +1,108 @@
+import math
+import unittest
+
+import numpy
+from numpy import testing
+
+import config
+import sensors
+from lswt_algo import SplitWindowAlgo
+from config import Config
+
+
+def get_config(sattype):
+    return config.parse_sensor_config(sattype, Config(sattype).get_conf())
+
+
+class TestSensors(unittest.TestCase):
+    def setUp(self):
+        self.raw = {'bt4': numpy.array([2900, 6553.5 / 0.1, 2850], dtype=numpy.float32),
+                    'sat_za': numpy.array([1000, 2000, 3000], dtype=numpy.float32),
+                    'sat_az': numpy.array([10, 300, 90], dtype=numpy.float32),
+                    'sun_az': numpy.array([50, 20, 90], dtype=numpy.float32)}
+
+    def test_create(self):
+        for sattype in ['AVHRR', 'SLSTR', 'TIRS', 'VIIRS', 'AATSR']:
+            self.assertIsInstance(sensors.create(sattype, get_config(sattype)), sensors.Sensor)
+        self.assertRaises(sensors.SensorException, sensors.create, 'MODIS', get_config('AVHRR'))
+
+    def test_get_reads(self):
+        sensor = sensors.create('VIIRS', get_config('VIIRS'))
+        sensor.bands = {'bt4': 'band', 'rf1': 'band', 'rf2': 'band', 'sat_za': 'grid', 'sun_za': 'grid',
+                        'sat_az': 'grid', 'sun_az': 'grid'}
+        self.assertEqual({'bt4', 'sat_za'}, sensor.get_reads({'bt4', 'bt5', 'sat_za'}))
+        self.assertEqual({'bt4', 'sat_za', 'sat_az', 'sun_az'}, sensor.get_reads({'bt4', 'sat_za', 'rel_az'}))
+        slstr = sensors.create('SLSTR', get_config('SLSTR'))
+        slstr.bands = sensor.bands
+        self.assertEqual({'bt4', 'rf2', 'sat_za', 'sun_za'}, slstr.get_reads({'bt4', 'rf2', 'sat_za'}))
+
+    def test_calibrate(self):
+        sensor = sensors.create('VIIRS', get_config('VIIRS'))
+        values = sensor.calibrate(self.raw)
+        testing.assert_allclose([29.0, 655.35, 28.5], values['bt4'], rtol=1e-6)
+        testing.assert_array_equal([40, 80, 0], values['rel_az'])
+        self.assertIsNone(values['bt5'])
+        self.assertIsNone(values['sun_za'])
+
+    def test_calibrate_avhrr(self):
+        sensor = sensors.create('AVHRR', get_config('AVHRR'))
+        bt4 = self.raw['bt4']
+        self.raw['bt5'] = numpy.array([6553.5 / 0.1, 2800, 2700], dtype=numpy.float32)
+        self.raw['sat_za'][2] = -32768
+        values = sensor.calibrate(self.raw)
+        testing.assert_allclose([290, numpy.nan, 285], values['bt4'], rtol=1e-6)
+        testing.assert_allclose([numpy.nan, 280, 270], values['bt5'], rtol=1e-6)
+        testing.assert_allclose([10, 20, numpy.nan], values['sat_za'], rtol=1e-6)
+        # the float32 tile buffers are masked in place
+        self.assertIs(bt4, values['bt4'])
+        for name in ('bt4', 'bt5', 'sat_za'):
+            self.assertEqual(numpy.float32, values[name].dtype)
+        # only the angles are read for the grid of the mono-window coefficients
+        self.assertEqual(20, sensor.calibrate({'sat_za': numpy.array([2000], dtype=numpy.float32)})['sat_za'][0])
+        testing.assert_array_equal([True, False, True], sensor.get_cloudy(numpy.array([0, 1, 7])))
+
+    def test_calibrate_aatsr_slstr(self):
+        values = sensors.create('AATSR', get_config('AATSR')).calibrate(self.raw)
+        testing.assert_array_equal([-910, -1910, -2910], values['sat_za'])
+        slstr = sensors.create('SLSTR', get_config('SLSTR'))
+        # without a manifest there are no solar irradiances, the reflectances are not finite
+        with numpy.errstate(divide='ignore'):
+            values = slstr.calibrate({'rf1': numpy.array([100.0]), 'rf2': numpy.array([100.0]),
+                                      'sun_za': numpy.array([60.0])})
+        self.assertEqual((0.0, 0.0), (slstr.solar_irr_s2, slstr.solar_irr_s3))
+        self.assertFalse(numpy.isfinite(values['rf1']).any())
+        self.assertFalse(numpy.isfinite(values['rf2']).any())
+        slstr.solar_irr_s2 = 1525.94
+        values = slstr.calibrate({'rf1': numpy.array([100.0]), 'sun_za': numpy.array([60.0])})
+        testing.assert_allclose([math.pi * 100 / (1525.94 * 0.5)], values['rf1'])
+
+    def test_calibrate_tirs(self):
+        sensor = sensors.create('TIRS', get_config('TIRS'))
+        sensor.k1, sensor.k2 = 774.8853, 1321.0789
+        sensor.rescaling['rf1'] = (0.01, -50.0, 2e-5, -0.1)
+        sensor.sun_elevation, sensor.sun_azimuth, sensor.sat_azimuth = 30.0, 150.0, 10.0
+        values = sensor.calibrate({'bt4': numpy.array([10.0, 8.0]), 'rf1': numpy.array([20000.0, 30000.0])})
+        testing.assert_allclose(1321.0789 / numpy.log(774.8853 / numpy.array([10.0, 8.0]) + 1), values['bt4'])
+        testing.assert_allclose((2e-5 * (numpy.array([20000.0, 30000.0]) - 50) / 0.01 - 0.1) / 0.5, values['rf1'])
+        self.assertEqual(60, values['sun_za'])
+        self.assertEqual(140, values['rel_az'])
+        self.assertEqual(0, numpy.ndim(values['sat_za']))
+
+    def test_calibrate_tirs_float32(self):
+        sensor = sensors.create('TIRS', get_config('TIRS'))
+        sensor.k1, sensor.k2 = 774.8853, 1321.0789
+        sensor.rescaling['rf1'] = (0.01, -50.0, 2e-5, -0.1)
+        sensor.roll_angle, sensor.sun_elevation, sensor.sun_azimuth, sensor.sat_azimuth = 0.5, 30.0, 150.0, 10.0
+        values = sensor.calibrate({'bt4': numpy.array([10.0, 8.0], dtype=numpy.float32),
+                                   'bt5': numpy.array([9.0, 7.5], dtype=numpy.float32),
+                                   'rf1': numpy.array([20000.0, 30000.0], dtype=numpy.float32)})
+        for name in ('bt4', 'bt5', 'rf1'):
+            self.assertEqual(numpy.float32, values[name].dtype, name)
+        for use_numexpr in (False, True):
+            algo = SplitWindowAlgo(0.5, 1.0, 1.5, 2.0, False, use_numexpr=use_numexpr, dtype=numpy.float32)
+            lswt = algo.compute_lswt(values['bt4'], values['bt5'], values['sat_za'])
+            self.assertEqual(numpy.float32, lswt.dtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+###################################################################################################
+# conversions and time of the tile I/O of one tile, getSamplesFloat/setSamples against tile_io
+#
+# the tiles are fakes whose Java arrays are numpy arrays. They count the calls that convert samples between Java and
+# numpy and the bytes these calls copy: getSamplesFloat copies the raster into a new float[], setSamples copies the
+# samples into a double[] that is converted to the type of the band, getDataBuffer hands out the raster itself.
+# Real jpy behaviour is not covered: whether jpy copies a Java array it hands to numpy, and the cost of the calls
+# into the JVM, are not measured. The buffers of tile_io are allocated by a first tile that is not counted.
+#
+# python tile_io_benchmark.py [tile size]
+###################################################################################################
+
+import sys
+import time
+
+import numpy
+
+import tile_io
+from tile_io_test import FakeTile
+
+# raw input bands of a split-window tile: bt4, bt5, bt3, rf1, rf2, sat_za, sun_za, rel_az, cmsk, valid, lwm
+INPUTS = 11
+SCALE = 0.01
+
+
+class Conversions:
+    # calls of the fakes by name and the bytes they copied
+    def __init__(self):
+        self.calls = {}
+        self.bytes = 0
+
+    def reset(self):
+        self.calls = {}
+        self.bytes = 0
+
+    def add(self, name, nbytes):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.bytes += nbytes
+
+
+class CountingTile(FakeTile):
+    def __init__(self, raster_data, size, conversions):
+        FakeTile.__init__(self, raster_data, size, 0, 0, size, size)
+        self.conversions = conversions
+
+    def getDataBuffer(self):
+        # the fake hands out its raster without a copy
+        self.conversions.add('getDataBuffer', 0)
+        return FakeTile.getDataBuffer(self)
+
+    def getSamplesFloat(self):
+        samples = FakeTile.getSamplesFloat(self)
+        self.conversions.add('getSamplesFloat', samples.nbytes)
+        return samples
+
+    def setSamples(self, samples):
+        # Tile.setSamples(double[]) converts the samples to the type of the band
+        values = numpy.asarray(samples, dtype=numpy.float64)
+        self.conversions.add('setSamples', values.nbytes)
+        self.get_raw()[...] = values.reshape((self.height, self.width))
+
+
+def create_tiles(size, conversions):
+    sources = [CountingTile(numpy.full(size * size, 2900, dtype=numpy.int16), size, conversions)
+               for _ in range(INPUTS)]
+    targets = [CountingTile(numpy.zeros(size * size, dtype=dtype), size, conversions)
+               for dtype in (numpy.float32, numpy.uint16, numpy.uint16)]
+    return sources, targets
+
+
+def compute_old(sources, targets, buffers):
+    tile = [numpy.array(source.getSamplesFloat(), dtype=numpy.float32) * SCALE for source in sources]
+    lswt = tile[0].astype(numpy.float64)
+    targets[0].setSamples(lswt)
+    # the flags and the quality index stand for results, both versions write them
+    targets[1].setSamples(numpy.zeros(lswt.shape, dtype=numpy.uint16).astype(numpy.int32))
+    targets[2].setSamples(numpy.zeros(lswt.shape, dtype=numpy.float64))
+
+
+def compute_new(sources, targets, buffers, zero_copy=False):
+    size = sources[0].getWidth() * sources[0].getHeight()
+    tile = [tile_io.read_samples(source, buffers.get(str(i), size)) for i, source in enumerate(sources)]
+    for values in tile:
+        numpy.multiply(values, SCALE, out=values)
+    lswt = buffers.get('lswt', size, numpy.float64)
+    lswt[:] = tile[0]
+    tile_io.write_samples(targets[0], lswt, zero_copy)
+    tile_io.write_samples(targets[1], numpy.zeros(lswt.shape, dtype=numpy.uint16), zero_copy)
+    tile_io.write_samples(targets[2], numpy.zeros(lswt.shape, dtype=numpy.float64), zero_copy)
+
+
+def measure(compute, size, repeats=10):
+    conversions = Conversions()
+    sources, targets = create_tiles(size, conversions)
+    buffers = tile_io.TileBuffers()
+    compute(sources, targets, buffers)
+    conversions.reset()
+    compute(sources, targets, buffers)
+    counted = (dict(conversions.calls), conversions.bytes)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        compute(sources, targets, buffers)
+    return counted, (time.perf_counter() - start) / repeats
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    print('tile ' + str(size) + ' x ' + str(size) + ', ' + str(INPUTS) + ' int16 inputs, 3 outputs')
+    for name, compute in [('getSamplesFloat/setSamples', compute_old), ('tile_io', compute_new),
+                          ('tile_io zero copy', lambda *tiles: compute_new(*tiles, zero_copy=True))]:
+        (calls, copied), seconds = measure(compute, size)
+        print('%-28s %12d bytes converted %8.2f ms  %s' % (
+            name, copied, seconds * 1000, ', '.join('%s x%d' % (call, calls[call]) for call in sorted(calls))))
+
+
+if __name__ == '__main__':
+    main()
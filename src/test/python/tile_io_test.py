@@ -0,0 +1,177 @@
+import unittest
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from numpy import testing
+
+import tile_io
+
+
+class FakeProductData:
+    def __init__(self, elems, type_string):
+        self.elems = elems
+        self.type_string = type_string
+
+    def getElems(self):
+        return self.elems
+
+    def getTypeString(self):
+        return self.type_string
+
+
+class FakeRaster:
+    def __init__(self, factor=1.0, offset=0.0, log_scaled=False):
+        self.factor = factor
+        self.offset = offset
+        self.log_scaled = log_scaled
+
+    def isScalingApplied(self):
+        return self.factor != 1.0 or self.offset != 0.0 or self.log_scaled
+
+    def isLog10Scaled(self):
+        return self.log_scaled
+
+    def getScalingFactor(self):
+        return self.factor
+
+    def getScalingOffset(self):
+        return self.offset
+
+
+class FakeTile:
+    # a tile of width x height in a raster of stride columns, the tile starts at column x and row y of the raster
+    def __init__(self, raster_data, stride, x, y, width, height, raster=None):
+        self.raster_data = raster_data
+        self.stride = stride
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.raster = FakeRaster() if raster is None else raster
+        self.samples = None
+
+    def getDataBuffer(self):
+        return None if self.raster_data is None else FakeProductData(self.raster_data, self.raster_data.dtype.name)
+
+    def getRasterDataNode(self):
+        return self.raster
+
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
+    def getScanlineOffset(self):
+        return self.y * self.stride + self.x
+
+    def getScanlineStride(self):
+        return self.stride
+
+    def get_raw(self):
+        return self.raster_data.reshape((-1, self.stride))[self.y:self.y + self.height, self.x:self.x + self.width]
+
+    def getSamplesFloat(self):
+        raw = self.get_raw()
+        if self.raster.log_scaled:
+            return numpy.power(10, raw * self.raster.factor + self.raster.offset).astype(numpy.float32).ravel()
+        return (raw * self.raster.factor + self.raster.offset).astype(numpy.float32).ravel()
+
+    def setSamples(self, samples):
+        self.samples = samples
+
+
+class SourceContext:
+    # source tiles of raster arrays by band of 5 columns
+    def __init__(self, rasters):
+        self.rasters = rasters
+        self.reads = []
+
+    def getSourceTile(self, band, rectangle):
+        self.reads.append(band)
+        return FakeTile(self.rasters[band], 5, rectangle.x, rectangle.y, rectangle.width, rectangle.height)
+
+
+FakeRectangle = namedtuple('FakeRectangle', ['x', 'y', 'width', 'height'])
+
+
+class TestTileIO(unittest.TestCase):
+    def setUp(self):
+        self.raw = numpy.arange(20, dtype=numpy.uint16).reshape((4, 5)) * 1000
+
+    def test_read_samples(self):
+        tile = FakeTile(self.raw.ravel(), 5, 1, 1, 3, 2)
+        out = numpy.full(6, numpy.nan, dtype=numpy.float32)
+        samples = tile_io.read_samples(tile, out)
+        self.assertIs(out, samples)
+        testing.assert_array_equal(self.raw[1:3, 1:4].ravel(), samples)
+
+    def test_read_samples_scaled(self):
+        tile = FakeTile(self.raw.ravel(), 5, 0, 2, 5, 2, FakeRaster(0.01, -100.0))
+        samples = tile_io.read_samples(tile)
+        self.assertEqual(numpy.float32, samples.dtype)
+        testing.assert_allclose(self.raw[2:].ravel() * 0.01 - 100, samples, rtol=1e-6)
+
+    def test_read_samples_fallback(self):
+        tile = FakeTile(self.raw.ravel(), 5, 0, 0, 2, 2, FakeRaster(0.0001, 0.0, True))
+        testing.assert_allclose(numpy.power(10, self.raw[:2, :2].ravel() * 0.0001), tile_io.read_samples(tile),
+                                rtol=1e-6)
+        tile = FakeTile(self.raw.ravel(), 5, 0, 0, 2, 2)
+        tile.raster_data = None
+        tile.get_raw = lambda: self.raw[:2, :2]
+        testing.assert_array_equal(self.raw[:2, :2].ravel(), tile_io.read_samples(tile))
+
+    def test_read_tiles(self):
+        context = SourceContext({'bt4': self.raw.ravel(), 'bt5': self.raw.ravel() + 1})
+        rectangle = FakeRectangle(1, 2, 2, 2)
+        buffers = tile_io.TileBuffers()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for pool in (None, executor):
+                tiles = tile_io.read_tiles(context, rectangle, {'bt4': 'bt4', 'bt5': 'bt5', 'bt3': None}, buffers, pool)
+                self.assertEqual({'bt4', 'bt5'}, set(tiles))
+                testing.assert_array_equal(self.raw[2:, 1:3].ravel(), tiles['bt4'])
+                testing.assert_array_equal(self.raw[2:, 1:3].ravel() + 1, tiles['bt5'])
+                self.assertTrue(numpy.shares_memory(tiles['bt4'], buffers.get('bt4', 4)))
+
+    def test_next_tile(self):
+        self.assertEqual((4, 0, 4, 3), tile_io.next_tile(FakeRectangle(0, 0, 4, 3), (4, 3), (10, 5)))
+        self.assertEqual((8, 3, 2, 2), tile_io.next_tile(FakeRectangle(4, 3, 4, 2), (4, 3), (10, 5)))
+        self.assertEqual((0, 3, 4, 2), tile_io.next_tile(FakeRectangle(8, 0, 2, 3), (4, 3), (10, 5)))
+        self.assertIsNone(tile_io.next_tile(FakeRectangle(8, 3, 2, 2), (4, 3), (10, 5)))
+
+    def test_write_samples(self):
+        raster_data = numpy.zeros(20, dtype=numpy.uint16)
+        tile = FakeTile(raster_data, 5, 2, 1, 3, 3)
+        values = numpy.arange(9, dtype=numpy.float64)
+        # by default the samples are set, the data buffer is not written
+        tile_io.write_samples(tile, values)
+        self.assertIs(values, tile.samples)
+        self.assertEqual(0, raster_data.sum())
+        tile.samples = None
+        tile_io.write_samples(tile, values, zero_copy=True)
+        testing.assert_array_equal(numpy.arange(9).reshape((3, 3)), raster_data.reshape((4, 5))[1:, 2:])
+        self.assertEqual(0, raster_data.reshape((4, 5))[0].sum())
+        self.assertIsNone(tile.samples)
+
+    def test_write_samples_fallback(self):
+        tile = FakeTile(numpy.zeros(4, dtype=numpy.float32), 2, 0, 0, 2, 2)
+        tile.raster_data.flags.writeable = False
+        tile_io.write_samples(tile, numpy.array([1, 2, 3, 4], dtype=numpy.uint16), zero_copy=True)
+        self.assertEqual(numpy.int32, tile.samples.dtype)
+        lswt = numpy.array([1.5, numpy.nan, 2, 3], dtype=numpy.float32)
+        tile_io.write_samples(tile, lswt, zero_copy=True)
+        self.assertIs(lswt, tile.samples)
+
+    def test_tile_buffers(self):
+        buffers = tile_io.TileBuffers()
+        buffer = buffers.get('bt4', 100)
+        self.assertEqual(100, buffer.size)
+        self.assertTrue(numpy.shares_memory(buffer, buffers.get('bt4', 50)))
+        self.assertFalse(numpy.shares_memory(buffer, buffers.get('bt5', 50)))
+        self.assertEqual(numpy.float64, buffers.get('bt4', 50, numpy.float64).dtype)
+        self.assertEqual(200, buffers.get('bt4', 200, numpy.float64).size)
+
+
+if __name__ == '__main__':
+    unittest.main()
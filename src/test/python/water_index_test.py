@@ -0,0 +1,43 @@
+import unittest
+
+import numpy
+from numpy import testing
+
+import water_index
+from water_index import WaterIndex
+
+
+class TestWaterIndex(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        self.mask = random.rand(37, 53) < 0.3
+        self.mask[5] = True
+        self.mask[6] = False
+        self.mask[:, 0] = True
+
+    def test_spans(self):
+        rows, starts, ends = water_index.find_spans(self.mask, 10)
+        mask = numpy.zeros(self.mask.shape, dtype=bool)
+        for row, start, end in zip(rows, starts, ends):
+            self.assertFalse(mask[row - 10, start:end].any())
+            mask[row - 10, start:end] = True
+        testing.assert_array_equal(self.mask, mask)
+
+    def test_get_pixels(self):
+        index = WaterIndex.from_mask(self.mask)
+        self.assertEqual(numpy.count_nonzero(self.mask), index.get_pixel_count())
+        for x, y, width, height in [(0, 0, 53, 37), (10, 3, 7, 9), (-1, -1, 5, 5), (50, 30, 8, 10), (3, 6, 10, 1)]:
+            tile = numpy.zeros((height, width), dtype=bool)
+            y0, x0 = max(y, 0), max(x, 0)
+            part = self.mask[y0:y + height, x0:x + width]
+            tile[y0 - y:y0 - y + part.shape[0], x0 - x:x0 - x + part.shape[1]] = part
+            testing.assert_array_equal(numpy.flatnonzero(tile), index.get_pixels(x, y, width, height))
+
+    def test_rows_in_blocks(self):
+        spans = [water_index.find_spans(self.mask[y:y + 8], y) for y in range(0, 37, 8)]
+        index = WaterIndex(53, 37, *[numpy.concatenate(values) for values in zip(*spans)])
+        testing.assert_array_equal(numpy.flatnonzero(self.mask), index.get_pixels(0, 0, 53, 37))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+import numpy
+from numpy import testing
+from scipy import ndimage
+
+import window_stats
+
+
+class TestWindowStats(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        self.data = 280 + 10 * random.rand(12, 15)
+        self.data[3, 4] = numpy.nan
+        self.valid = random.rand(12, 15) < 0.7
+
+    def brute_force(self, n):
+        # statistics of every window from the mirrored tile
+        r = n // 2
+        data = numpy.pad(self.data, r, mode='symmetric')
+        valid = numpy.pad(self.valid, r, mode='symmetric')
+        count = numpy.zeros(self.data.shape)
+        mean = numpy.full(self.data.shape, numpy.nan)
+        std = numpy.full(self.data.shape, numpy.nan)
+        for i in range(0, self.data.shape[0]):
+            for j in range(0, self.data.shape[1]):
+                window = data[i:i + n, j:j + n][valid[i:i + n, j:j + n]]
+                window = window[numpy.isfinite(window)]
+                count[i, j] = len(window)
+                if len(window) > 0:
+                    mean[i, j] = window.mean()
+                if len(window) > 1:
+                    std[i, j] = window.std(ddof=1)
+        return count, mean, std
+
+    def test_window_statistics(self):
+        for n in [1, 3, 5, 15]:
+            count, mean, std = window_stats.window_statistics(self.data, n, self.valid)
+            expected_count, expected_mean, expected_std = self.brute_force(n)
+            testing.assert_array_equal(expected_count, count)
+            testing.assert_allclose(expected_mean, mean, rtol=1e-12)
+            testing.assert_allclose(expected_std, std, rtol=1e-9, atol=1e-6)
+
+    def test_window_count_as_convolution(self):
+        for n in [3, 7, 31]:
+            expected = ndimage.convolve(self.valid.astype(int), numpy.ones((n, n)))
+            testing.assert_array_equal(expected, window_stats.window_count(self.valid, n))
+
+    def test_float32(self):
+        data = self.data.astype(numpy.float32)
+        count, mean, std = window_stats.window_statistics(data, 3, self.valid)
+        self.assertEqual(numpy.float32, std.dtype)
+        expected = window_stats.window_statistics(data.astype(numpy.float64), 3, self.valid)[2]
+        testing.assert_allclose(expected, std, atol=1e-6)
+
+    def test_data_not_modified(self):
+        data = numpy.array(self.data)
+        window_stats.window_statistics(data, 3, self.valid)
+        testing.assert_array_equal(self.data, data)
+
+    def test_even_window(self):
+        self.assertRaises(ValueError, window_stats.window_sum, self.data, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()